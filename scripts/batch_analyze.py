@@ -0,0 +1,230 @@
+from trace_session import TraceSession
+from table_io import write_table
+from run_pipeline import extract_all, ENGINES
+from query_cache import QueryCache, add_cache_arguments
+from instrumentation import add_instrumentation_arguments, configure_from_args, span
+import identify_performance_anomalies
+import instrumentation
+import argparse
+import glob
+import multiprocessing
+import os
+import pandas as pd
+import signal
+import sys
+import time
+
+REPORT_FILE_NAME = "performance_anomalies_report.md"
+SUMMARY_FILE_NAME = "fleet_summary.csv"
+# Grace period for a timed-out worker to close its trace processor before it is killed
+TERMINATE_GRACE_S = 5
+# Files picked up from a traces directory when no --pattern is given: these extensions, or
+# none at all (as in ../data/PerfettoTraceForRecruitment). Reports and tables written next
+# to the traces are skipped.
+TRACE_EXTENSIONS = {"", ".perfetto-trace", ".pftrace", ".perfetto", ".pb", ".trace", ".ctrace", ".systrace", ".gz"}
+
+
+def list_traces(traces_source, pattern=None):
+    """Returns trace paths from a directory or from a manifest file.
+
+    In a directory, files matching `pattern`, or by default files with one of
+    TRACE_EXTENSIONS, are found recursively. A manifest lists one trace path per line; blank
+    lines and lines starting with '#' are skipped, relative paths are resolved against the
+    manifest's directory and a trace listed twice is analyzed once.
+    """
+    if os.path.isdir(traces_source):
+        paths = glob.glob(os.path.join(traces_source, "**", pattern or "*"), recursive=True)
+        return sorted(p for p in paths if os.path.isfile(p) and (pattern or os.path.splitext(p)[1].lower() in TRACE_EXTENSIONS))
+    base_dir = os.path.dirname(os.path.abspath(traces_source))
+    traces = []
+    with open(traces_source) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            traces.append(os.path.normpath(line if os.path.isabs(line) else os.path.join(base_dir, line)))
+    return list(dict.fromkeys(traces))
+
+
+def report_dirs(traces, output_dir):
+    """Returns an output directory for each trace, in the same order, named after the trace file."""
+    dirs = []
+    used = set()
+    for trace_file in traces:
+        name = os.path.splitext(os.path.basename(trace_file))[0] or "trace"
+        unique_name = name
+        suffix = 1
+        while unique_name in used:
+            suffix += 1
+            unique_name = f"{name}_{suffix}"
+        used.add(unique_name)
+        dirs.append(os.path.join(output_dir, unique_name))
+    return dirs
+
+
+def summarize(tables, session, aggregates):
+    """Returns the fleet summary columns for one analyzed trace from the aggregates returned by identify_performance_anomalies.main."""
+    per_process, bounds = aggregates["cpu_time"]
+    per_process = per_process.sort_values("dur", ascending=False)
+    frequent_short_runners, _ = aggregates["short_runs"]
+    long_tasks_df = tables["long_tasks"]
+
+    yt_states = tables["yt_thread_states"]
+    high_runnable_threads = 0
+    if yt_states is not None and not yt_states.empty:
+        active_ns = (yt_states["total_runnable_ns"] + yt_states["total_running_ns"]).replace(0, pd.NA)
+        runnable_ratio = yt_states["total_runnable_ns"] / active_ns
+        high_runnable_threads = int((runnable_ratio > identify_performance_anomalies.HIGH_RUNNABLE_RATIO_THRESHOLD).sum())
+
+    load_s = sum(seconds for label, seconds, _ in session.timings if label == "trace load")
+    youtube_rows = per_process[per_process["process_name"] == identify_performance_anomalies.YOUTUBE_PROCESS_NAME]
+    return {
+        "load_s": round(load_s, 3),
+        "query_s": round(sum(t[1] for t in session.timings) - load_s, 3),
+        "sched_slices": int(bounds["slice_count"]),
+        "top_process": per_process["process_name"].iloc[0] if not per_process.empty else None,
+        "top_process_cpu_ms": per_process["dur"].iloc[0] / 1_000_000 if not per_process.empty else 0.0,
+        "youtube_cpu_ms": youtube_rows["dur"].sum() / 1_000_000,
+        "long_tasks": len(long_tasks_df),
+        "max_long_task_ms": long_tasks_df["dur"].max() / 1_000_000 if not long_tasks_df.empty else 0.0,
+        "high_runnable_threads": high_runnable_threads,
+        "frequent_short_runners": len(frequent_short_runners),
+    }
+
+
+def analyze_trace(trace_file, trace_output_dir, engine="pandas", cache_options=None):
+    """Runs the full extract + identify_performance_anomalies pipeline on one trace.
+
+    `cache_options` are (cache_dir, max_bytes) of a QueryCache, or None to disable caching.
+    """
+    os.makedirs(trace_output_dir, exist_ok=True)
+    cache = QueryCache(*cache_options) if cache_options else None
+    with TraceSession(trace_file, cache=cache) as session:
+        with span("extract", "pipeline", trace=trace_file, engine=engine):
+            tables = extract_all(session, engine)
+        with span("identify_performance_anomalies", "pipeline", trace=trace_file, engine=engine):
+            aggregates = identify_performance_anomalies.main(
+                tables["system_info"],
+                tables["cpu_sched"],
+                tables["long_tasks"],
+                tables["yt_thread_states"],
+                tables["thread_states"],
+                os.path.join(trace_output_dir, REPORT_FILE_NAME),
+            )
+        with span("summarize", "pipeline", trace=trace_file):
+            return summarize(tables, session, aggregates)
+
+
+def _raise_system_exit(signum, frame):
+    raise SystemExit(1)
+
+
+def _worker(trace_file, trace_output_dir, engine, cache_options, conn):
+    # On timeout the parent sends SIGTERM; unwinding through the TraceSession context
+    # manager shuts down this worker's trace_processor instead of orphaning it.
+    signal.signal(signal.SIGTERM, _raise_system_exit)
+    # The forked worker starts with a copy of the parent's spans; only its own are sent back
+    instrumentation.reset()
+    start = time.perf_counter()
+    try:
+        row = {"status": "ok", **analyze_trace(trace_file, trace_output_dir, engine, cache_options)}
+    except Exception as e:
+        row = {"status": f"error: {e}"}
+    row["wall_s"] = round(time.perf_counter() - start, 3)
+    if instrumentation.enabled():
+        row["spans"] = instrumentation.spans()
+    conn.send(row)
+    conn.close()
+
+
+def _receive(conn):
+    """Returns the row sent by a worker, or None if it has sent nothing (yet)."""
+    if not conn.poll():
+        return None
+    try:
+        return conn.recv()
+    except EOFError:
+        # Poll also reports the pipe as readable once the worker exited without sending
+        return None
+
+
+def run_batch(traces, output_dir, workers=None, timeout_s=None, engine="pandas", cache_options=None):
+    """Analyzes `traces` in up to `workers` concurrent processes and returns the fleet summary DataFrame.
+
+    Each worker process owns exactly one trace_processor instance, so `workers` also bounds
+    the number of concurrently loaded traces. A trace still running after `timeout_s`
+    seconds is terminated and reported with status "timeout". Workers and results are keyed
+    by position in `traces`, so a trace listed twice is analyzed twice.
+    """
+    workers = workers or os.cpu_count() or 1
+    dirs = report_dirs(traces, output_dir)
+    pending = list(reversed(range(len(traces))))
+    running = {}
+    rows = {}
+
+    while pending or running:
+        while pending and len(running) < workers:
+            i = pending.pop()
+            parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_worker, args=(traces[i], dirs[i], engine, cache_options, child_conn))
+            process.start()
+            child_conn.close()
+            running[i] = (process, parent_conn, time.perf_counter())
+
+        time.sleep(0.1)
+        for i, (process, conn, started) in list(running.items()):
+            elapsed = time.perf_counter() - started
+            row = _receive(conn)
+            if row is None and process.is_alive():
+                if timeout_s is None or elapsed < timeout_s:
+                    continue
+                process.terminate()
+                process.join(TERMINATE_GRACE_S)
+                if process.is_alive():
+                    process.kill()
+                row = {"status": "timeout", "wall_s": round(elapsed, 3)}
+            elif row is None:
+                # The worker may have sent its row and exited between the two checks above
+                process.join()
+                row = _receive(conn) or {"status": f"failed (exit code {process.exitcode})", "wall_s": round(elapsed, 3)}
+            instrumentation.add_spans(row.pop("spans", []))
+            rows[i] = row
+            process.join()
+            conn.close()
+            del running[i]
+            print(f"[{len(rows)}/{len(traces)}] {traces[i]}: {row['status']} ({row['wall_s']:.1f} s)")
+
+    summary = [{"trace": trace_file, "report": os.path.join(dirs[i], REPORT_FILE_NAME), **rows[i]} for i, trace_file in enumerate(traces)]
+    return pd.DataFrame(summary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the extract + identify_performance_anomalies pipeline on many traces in parallel.")
+    parser.add_argument("traces", help="directory of traces, or a manifest file listing one trace path per line")
+    parser.add_argument("output_dir", help=f"directory for per-trace reports and {SUMMARY_FILE_NAME}")
+    parser.add_argument("--workers", type=int, default=None, help="concurrent worker processes / trace_processor instances (default: CPU count)")
+    parser.add_argument("--timeout", type=float, default=None, help="per-trace timeout in seconds")
+    parser.add_argument("--engine", choices=ENGINES, default="pandas", help="analysis engine, see run_pipeline.py")
+    parser.add_argument("--pattern", default=None, help="glob for trace files when TRACES is a directory (default: files with a trace extension or none)")
+    parser.add_argument("--summary-format", default="csv", choices=["csv", "parquet", "arrow"], help="file format of the fleet summary table")
+    add_cache_arguments(parser)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    cache_options = None if args.no_cache else (args.cache_dir, int(args.cache_max_gb * 1024 ** 3))
+
+    traces = list_traces(args.traces, args.pattern)
+    if not traces:
+        print(f"No traces found in {args.traces}")
+        sys.exit(1)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    batch_start = time.perf_counter()
+    summary_df = run_batch(traces, args.output_dir, args.workers, args.timeout, args.engine, cache_options)
+    batch_s = time.perf_counter() - batch_start
+
+    summary_path = os.path.join(args.output_dir, os.path.splitext(SUMMARY_FILE_NAME)[0] + "." + args.summary_format)
+    write_table(summary_df, summary_path)
+    ok_count = int((summary_df["status"] == "ok").sum())
+    print(f"Analyzed {ok_count}/{len(traces)} traces successfully in {batch_s:.1f} s ({len(traces) / batch_s * 60:.1f} traces/min).")
+    print(f"Fleet summary saved to {summary_path}")
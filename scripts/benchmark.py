@@ -0,0 +1,265 @@
+from trace_session import TraceSession
+from table_io import read_table, write_table
+from synthetic_trace import synthetic_tables, write_dataset, write_systrace, MAIN_THREAD_NAME
+from extract_metadata import extract_system_info, extract_process_info, extract_thread_info
+from extract_cpu_usage import extract_cpu_sched
+from extract_thread_states import extract_thread_states
+from extract_long_tasks import extract_long_tasks
+from extract_youtube_thread_cpu_states import extract_youtube_thread_cpu_states
+from extract_process_thread_states import extract_process_thread_states
+from trace_model import compact_table, memory_mb
+import identify_performance_anomalies
+import argparse
+import inspect
+import multiprocessing
+import os
+import pandas as pd
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+DEFAULT_SIZES = [100_000, 1_000_000]
+DEFAULT_REPEAT = 3
+# A benchmark regresses when its wall time grows by more than this fraction of the
+# baseline and by at least REGRESSION_MIN_SECONDS (so tiny benchmarks do not flap)
+REGRESSION_TOLERANCE = 0.25
+REGRESSION_MIN_SECONDS = 0.05
+RESULT_COLUMNS = ["size", "benchmark", "status", "rows", "wall_s", "min_wall_s", "rows_per_s", "rss_before_mb", "peak_rss_mb", "memory_before_mb", "memory_after_mb"]
+
+EXTRACTORS = {
+    "extract_system_info": extract_system_info,
+    "extract_process_info": extract_process_info,
+    "extract_thread_info": extract_thread_info,
+    "extract_cpu_sched": extract_cpu_sched,
+    "extract_thread_states": extract_thread_states,
+    "extract_long_tasks": lambda session: extract_long_tasks(session, identify_performance_anomalies.YOUTUBE_PROCESS_NAME, MAIN_THREAD_NAME, identify_performance_anomalies.LONG_TASK_THRESHOLD_MS * 1_000_000),
+    "extract_youtube_thread_cpu_states": extract_youtube_thread_cpu_states,
+    "extract_process_thread_states": extract_process_thread_states,
+}
+# Arguments of the analyze_* functions, by parameter name: a dataset table name or a fixed value
+ANALYZER_TABLES = {
+    "system_info_df": "system_info",
+    "cpu_sched": "cpu_sched",
+    "thread_states": "thread_states",
+    "long_tasks_df": "long_tasks",
+    "youtube_thread_states_df": "yt_thread_states",
+}
+ANALYZER_VALUES = {
+    "process_name": identify_performance_anomalies.YOUTUBE_PROCESS_NAME,
+    "thread_name": MAIN_THREAD_NAME,
+    "topology": None,
+    "cpu_time": None,
+    "short_runs": None,
+}
+# Tables whose in-memory size is measured before and after compact_table
+COMPACT_TABLES = ["cpu_sched", "thread_states"]
+
+
+def analyzers():
+    """Returns every analyze_* function of identify_performance_anomalies by name."""
+    return {name: func for name, func in inspect.getmembers(identify_performance_anomalies, inspect.isfunction)
+            if name.startswith("analyze_") and func.__module__ == identify_performance_anomalies.__name__}
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _time_calls(func, repeat):
+    wall = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        wall.append(time.perf_counter() - start)
+    return result, wall
+
+
+def _run_analyzer(name, dataset, repeat):
+    func = analyzers()[name]
+    kwargs = {}
+    rows = 0
+    for param in inspect.signature(func).parameters:
+        if param in ANALYZER_TABLES:
+            kwargs[param] = read_table(dataset[ANALYZER_TABLES[param]])
+            rows += len(kwargs[param])
+        elif param in ANALYZER_VALUES:
+            kwargs[param] = ANALYZER_VALUES[param]
+        else:
+            raise ValueError(f"No benchmark input for parameter '{param}' of {name}")
+    rss_before = _peak_rss_mb()
+    _, wall = _time_calls(lambda: func(**kwargs), repeat)
+    return rows, wall, rss_before
+
+
+def _run_compact(table, dataset, repeat):
+    """Times compact_table on `table` and returns its size in MB before and after, along with the timings."""
+    df = read_table(dataset[table])
+    # The dataset stores the names as dictionaries; start from the Python strings a trace processor query returns
+    df = df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+    rss_before = _peak_rss_mb()
+    compacted, wall = _time_calls(lambda: compact_table(df), repeat)
+    return len(df), wall, rss_before, memory_mb(df), memory_mb(compacted)
+
+
+def _run_extractor(name, trace_path, repeat):
+    with TraceSession(trace_path) as session:
+        if name == "trace_load":
+            rss_before = _peak_rss_mb()
+            start = time.perf_counter()
+            session.tp
+            return None, [time.perf_counter() - start], rss_before
+        session.tp
+        rss_before = _peak_rss_mb()
+        df, wall = _time_calls(lambda: EXTRACTORS[name](session), repeat)
+        return (len(df) if df is not None else 0), wall, rss_before
+
+
+def _benchmark_worker(kind, name, source, repeat, conn):
+    try:
+        memory = {}
+        if kind == "analyzer":
+            rows, wall, rss_before = _run_analyzer(name, source, repeat)
+        elif kind == "compact":
+            rows, wall, rss_before, memory["memory_before_mb"], memory["memory_after_mb"] = _run_compact(name.removeprefix("compact_table:"), source, repeat)
+        else:
+            rows, wall, rss_before = _run_extractor(name, source, repeat)
+        wall_s = statistics.median(wall)
+        conn.send({
+            "status": "ok",
+            "rows": rows,
+            "wall_s": wall_s,
+            "min_wall_s": min(wall),
+            "rows_per_s": rows / wall_s if rows and wall_s > 0 else None,
+            "rss_before_mb": rss_before,
+            "peak_rss_mb": _peak_rss_mb(),
+            **memory,
+        })
+    except Exception as e:
+        conn.send({"status": f"error: {e}"})
+    conn.close()
+
+
+def run_benchmark(kind, name, source, repeat):
+    """Runs one benchmark in a fresh process, so its peak RSS is not inflated by earlier benchmarks."""
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_benchmark_worker, args=(kind, name, source, repeat, child_conn))
+    process.start()
+    child_conn.close()
+    result = parent_conn.recv() if parent_conn.poll(None) else None
+    process.join()
+    return result or {"status": f"failed (exit code {process.exitcode})"}
+
+
+def _dataset_worker(size, dataset_dir, with_trace, conn):
+    tables = synthetic_tables(size)
+    paths = write_dataset(tables, dataset_dir)
+    if with_trace:
+        paths["trace"] = os.path.join(dataset_dir, "trace.systrace")
+        write_systrace(tables, paths["trace"])
+    conn.send(paths)
+    conn.close()
+
+
+def prepare_dataset(size, dataset_dir, with_trace):
+    """Generates the synthetic dataset of `size` sched slices in a separate process and returns its table paths."""
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_dataset_worker, args=(size, dataset_dir, with_trace, child_conn))
+    process.start()
+    child_conn.close()
+    paths = parent_conn.recv()
+    process.join()
+    return paths
+
+
+def run_suite(sizes, work_dir, repeat=DEFAULT_REPEAT, with_extractors=True, only=None):
+    """Benchmarks every analyzer (and extractor) on synthetic datasets of each size. Returns one result row per benchmark."""
+    results = []
+    for size in sizes:
+        dataset = prepare_dataset(size, os.path.join(work_dir, f"n{size}"), with_extractors)
+        benchmarks = [("analyzer", name, dataset) for name in analyzers()]
+        benchmarks += [("compact", f"compact_table:{table}", dataset) for table in COMPACT_TABLES]
+        if with_extractors:
+            benchmarks += [("extractor", name, dataset["trace"]) for name in ["trace_load", *EXTRACTORS]]
+        trace_loaded = True
+        for kind, name, source in benchmarks:
+            if only and name not in only and name != "trace_load":
+                continue
+            if kind == "extractor" and not trace_loaded:
+                result = {"size": size, "benchmark": name, "status": "skipped (trace load failed)"}
+            else:
+                result = {"size": size, "benchmark": name, **run_benchmark(kind, name, source, repeat)}
+            # The extractors need a working trace processor; without one, do not retry for each of them
+            if name == "trace_load":
+                trace_loaded = result["status"] == "ok"
+            results.append(result)
+            timing = f"{result['wall_s']:.3f} s, peak RSS {result['peak_rss_mb']:.0f} MB" if result["status"] == "ok" else result["status"]
+            if "memory_before_mb" in result:
+                timing += f", table {result['memory_before_mb']:.1f} MB -> {result['memory_after_mb']:.1f} MB"
+            print(f"[n={size}] {name}: {timing}")
+    return results
+
+
+def compare(baseline_df, current_df, tolerance=REGRESSION_TOLERANCE, min_seconds=REGRESSION_MIN_SECONDS):
+    """Joins current results to the baseline by (size, benchmark) and flags wall time regressions."""
+    merged = current_df.merge(baseline_df[["size", "benchmark", "wall_s", "peak_rss_mb"]], on=["size", "benchmark"],
+                              how="left", suffixes=("", "_baseline"))
+    merged["wall_ratio"] = merged["wall_s"] / merged["wall_s_baseline"]
+    merged["regression"] = ((merged["wall_s"] > merged["wall_s_baseline"] * (1 + tolerance))
+                            & (merged["wall_s"] - merged["wall_s_baseline"] >= min_seconds))
+    # A benchmark that worked in the baseline and fails now is a regression too
+    merged["regression"] |= (merged["status"] != "ok") & merged["wall_s_baseline"].notna()
+    return merged[["size", "benchmark", "status", "wall_s_baseline", "wall_s", "wall_ratio", "peak_rss_mb_baseline", "peak_rss_mb", "regression"]]
+
+
+def print_comparison(comparison):
+    for _, row in comparison.iterrows():
+        if row["status"] != "ok" or pd.isna(row["wall_s_baseline"]):
+            note = row["status"] if row["status"] != "ok" else "no baseline"
+            print(f"  n={row['size']} {row['benchmark']}: {note}{'  REGRESSION' if row['regression'] else ''}")
+            continue
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"  n={row['size']} {row['benchmark']}: {row['wall_s_baseline']:.3f} s -> {row['wall_s']:.3f} s ({row['wall_ratio']:.2f}x){flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the extractors and analyzers on synthetic traces and compare against a baseline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write a results table")
+    run_parser.add_argument("output_path", help="results table (.csv, .parquet or .arrow)")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="number of sched slices of each synthetic dataset")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per benchmark; the median wall time is reported")
+    run_parser.add_argument("--no-extractors", action="store_true", help="only benchmark the analyzers (no trace processor needed)")
+    run_parser.add_argument("--only", nargs="+", help="only run these benchmarks")
+    run_parser.add_argument("--work-dir", help="directory for the synthetic datasets (default: a temporary directory)")
+    run_parser.add_argument("--baseline", help="compare against this results table and exit with status 1 on regressions")
+    compare_parser = subparsers.add_parser("compare", help="compare two results tables")
+    compare_parser.add_argument("baseline_path")
+    compare_parser.add_argument("current_path")
+    for p in (run_parser, compare_parser):
+        p.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="allowed wall time increase as a fraction of the baseline")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = run_suite(args.sizes, args.work_dir or tmp_dir, args.repeat, not args.no_extractors, args.only)
+        current_df = pd.DataFrame(results).reindex(columns=RESULT_COLUMNS)
+        write_table(current_df, args.output_path)
+        print(f"Benchmark results saved to {args.output_path}")
+        baseline_path = args.baseline
+    else:
+        current_df = read_table(args.current_path)
+        baseline_path = args.baseline_path
+
+    if baseline_path:
+        comparison = compare(read_table(baseline_path), current_df, args.tolerance)
+        print(f"Comparison against {baseline_path}:")
+        print_comparison(comparison)
+        regressions = int(comparison["regression"].sum())
+        if regressions:
+            print(f"{regressions} benchmarks regressed by more than {args.tolerance:.0%}.")
+            sys.exit(1)
+        print("No regressions.")
@@ -0,0 +1,373 @@
+from trace_session import TraceSession
+from table_io import iter_chunks, write_table
+from extract_long_tasks import extract_long_tasks
+from extract_process_thread_states import extract_process_thread_states, state_column
+import identify_performance_anomalies as anomalies
+import argparse
+import glob
+import math
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+MAIN_THREAD_NAME = "com.google.android.youtube:main"
+# Tables read from a run directory: <name>.<extension>, or a chunk directory <name>
+RUN_TABLES = {
+    "cpu_sched": anomalies.CPU_SCHED_COLUMNS,
+    "thread_states": anomalies.THREAD_STATES_COLUMNS,
+    "long_tasks": anomalies.LONG_TASKS_COLUMNS,
+}
+RUNNABLE_STATES = ["R", "R+"]
+# Long-task durations are counted in log-spaced bins from HIST_MIN_NS up to HIST_DECADES
+# decades above it, with one underflow and one overflow bin. The bins are the same for every
+# run, so merging runs is an element-wise sum of their count arrays.
+HIST_MIN_NS = 1_000_000
+HIST_DECADES = 5
+HIST_BINS_PER_DECADE = 20
+PERCENTILES = [50, 90, 99]
+# Differences are significant below this false discovery rate
+SIGNIFICANCE_LEVEL = 0.05
+REPORT_TOP_N = 15
+METRIC_LABELS = {
+    "cpu_ms": "CPU time (ms)",
+    "running_ms": "running time (ms)",
+    "runnable_ratio": "runnable ratio",
+    "short_runs": "short runs",
+    "long_task_count": "long tasks",
+    "long_task_p50_ms": "long task p50 (ms)",
+    "long_task_p90_ms": "long task p90 (ms)",
+}
+
+
+def histogram_edges():
+    """Returns the edges (ns) of the regular long-task bins; bin 0 is below the first edge and the last bin above the last."""
+    return HIST_MIN_NS * 10 ** (np.arange(HIST_DECADES * HIST_BINS_PER_DECADE + 1) / HIST_BINS_PER_DECADE)
+
+
+def log_histogram(dur_ns):
+    """Counts durations in the log-spaced bins of histogram_edges()."""
+    dur_ns = np.asarray(dur_ns, dtype=np.float64)
+    bin_count = HIST_DECADES * HIST_BINS_PER_DECADE
+    bins = np.floor(np.log10(np.maximum(dur_ns, 1) / HIST_MIN_NS) * HIST_BINS_PER_DECADE).astype(np.int64) + 1
+    return np.bincount(np.clip(bins, 0, bin_count + 1), minlength=bin_count + 2)
+
+
+def histogram_percentiles(counts, percentiles=PERCENTILES):
+    """Returns the given percentiles (ns) of a log_histogram, interpolated geometrically within a bin.
+
+    Values in the underflow or overflow bin are reported at the nearest edge.
+    """
+    total = counts.sum()
+    if total == 0:
+        return [0.0] * len(percentiles)
+    edges = histogram_edges()
+    lower = np.concatenate([[edges[0]], edges])
+    upper = np.concatenate([edges, [edges[-1]]])
+    cumulative = np.cumsum(counts)
+    values = []
+    for percentile in percentiles:
+        rank = percentile / 100 * total
+        i = int(np.searchsorted(cumulative, rank, side="left"))
+        before = cumulative[i - 1] if i > 0 else 0
+        fraction = (rank - before) / counts[i] if counts[i] else 0
+        values.append(float(lower[i] * (upper[i] / lower[i]) ** fraction))
+    return values
+
+
+def find_run_tables(run_dir):
+    """Returns the path of each RUN_TABLES table in a run directory, or None where it is missing."""
+    paths = {}
+    for name in RUN_TABLES:
+        candidates = [p for p in glob.glob(os.path.join(run_dir, name + ".*")) if not p.endswith(".tmp")]
+        if os.path.isdir(os.path.join(run_dir, name)):
+            candidates.append(os.path.join(run_dir, name))
+        paths[name] = sorted(candidates)[0] if candidates else None
+    return paths
+
+
+def _thread_times(cpu_sched, thread_states):
+    """Returns running_ns and runnable_ns per (process_name, thread_name)."""
+    keys = ["process_name", "thread_name"]
+    if hasattr(cpu_sched, "query_df"):  # a TraceSession
+        totals = extract_process_thread_states(cpu_sched)
+        runnable_columns = [c for c in (state_column(s) for s in RUNNABLE_STATES) if c in totals.columns]
+        totals = totals.assign(running_ns=totals["total_running_ns"], runnable_ns=totals[runnable_columns].sum(axis=1))
+        return totals.groupby(keys, observed=True)[["running_ns", "runnable_ns"]].sum().reset_index()
+
+    running = [chunk[chunk["utid"] != 0].groupby(keys, observed=True)["dur"].sum().rename("running_ns") for chunk in iter_chunks(cpu_sched)]
+    runnable = []
+    for chunk in iter_chunks(thread_states):
+        chunk = chunk[chunk["state"].isin(RUNNABLE_STATES)]
+        runnable.append(chunk.groupby(keys, observed=True)["dur"].sum().rename("runnable_ns"))
+    running = pd.concat(running).groupby(level=keys, observed=True).sum() if running else pd.Series(name="running_ns", dtype="int64")
+    runnable = pd.concat(runnable).groupby(level=keys, observed=True).sum() if runnable else pd.Series(name="runnable_ns", dtype="int64")
+    return pd.concat([running, runnable], axis=1).fillna(0).rename_axis(keys).reset_index()
+
+
+def _profile_tables(cpu_sched, thread_states, long_tasks):
+    metrics = []
+    per_process, _ = anomalies.cpu_time_aggregate(cpu_sched)
+    metrics.append(pd.DataFrame({"metric": "cpu_ms", "process_name": per_process["process_name"], "thread_name": "",
+                                 "value": per_process["dur"] / 1_000_000}))
+
+    times = _thread_times(cpu_sched, thread_states)
+    active_ns = times["running_ns"] + times["runnable_ns"]
+    metrics.append(pd.DataFrame({"metric": "running_ms", "process_name": times["process_name"], "thread_name": times["thread_name"],
+                                 "value": times["running_ns"] / 1_000_000}))
+    metrics.append(pd.DataFrame({"metric": "runnable_ratio", "process_name": times["process_name"], "thread_name": times["thread_name"],
+                                 "value": (times["runnable_ns"] / active_ns.where(active_ns > 0)).fillna(0)}))
+
+    short_runs, _ = anomalies.short_runs_aggregate(cpu_sched, thread_states, count_threshold=0)
+    metrics.append(pd.DataFrame({"metric": "short_runs", "process_name": short_runs["process_name"], "thread_name": short_runs["thread_name"],
+                                 "value": short_runs["short_run_count"]}))
+
+    histogram = log_histogram(long_tasks["dur"].to_numpy(dtype=np.float64))
+    p50, p90 = histogram_percentiles(histogram, [50, 90])
+    metrics.append(pd.DataFrame({
+        "metric": ["long_task_count", "long_task_p50_ms", "long_task_p90_ms"],
+        "process_name": anomalies.YOUTUBE_PROCESS_NAME, "thread_name": MAIN_THREAD_NAME,
+        "value": [len(long_tasks), p50 / 1_000_000, p90 / 1_000_000],
+    }))
+    metrics = pd.concat(metrics, ignore_index=True)
+    metrics = metrics.astype({"process_name": str, "thread_name": str, "value": "float64"})
+    return metrics, histogram
+
+
+def run_profile(run):
+    """Returns (metrics, long-task histogram) of one run: a directory of extracted tables or a trace file.
+
+    metrics has one row per (metric, process_name, thread_name) with its value; process
+    metrics have an empty thread_name. Traces are aggregated inside trace processor.
+    """
+    if os.path.isdir(run):
+        paths = find_run_tables(run)
+        if paths["cpu_sched"] is None:
+            raise FileNotFoundError(f"No cpu_sched table in {run}")
+        tables = {name: anomalies.load_input(paths[name], columns, chunked=name != "long_tasks") for name, columns in RUN_TABLES.items()}
+        return _profile_tables(tables["cpu_sched"], tables["thread_states"], tables["long_tasks"])
+    with TraceSession(run) as session:
+        long_tasks = extract_long_tasks(session, anomalies.YOUTUBE_PROCESS_NAME, MAIN_THREAD_NAME, anomalies.LONG_TASK_THRESHOLD_MS * 1_000_000)
+        return _profile_tables(session, session, long_tasks)
+
+
+def mann_whitney(a, b):
+    """Two-sided Mann-Whitney U test of every row of `a` (keys x n runs) against the same row of `b` (keys x m runs).
+
+    All rows are ranked at once; tied values get their average rank and the normal
+    approximation uses the tie-corrected variance with a continuity correction. Returns
+    (u, p_value) arrays; p_value is NaN when a side has fewer than two runs.
+    """
+    k, n = a.shape
+    m = b.shape[1]
+    total = n + m
+    if k == 0 or n < 2 or m < 2:
+        return np.full(k, np.nan), np.full(k, np.nan)
+    values = np.concatenate([a, b], axis=1)
+    order = np.argsort(values, axis=1, kind="stable")
+    sorted_values = np.take_along_axis(values, order, axis=1)
+    starts = np.ones((k, total), dtype=bool)
+    starts[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    # Tie groups numbered across all rows: row r uses numbers r * total .. r * total + total - 1
+    group = np.cumsum(starts, axis=1) - 1 + np.arange(k)[:, None] * total
+    sizes = np.bincount(group.ravel(), minlength=k * total)
+    first = np.zeros(k * total)
+    first[group[starts]] = np.broadcast_to(np.arange(total), (k, total))[starts]
+    ranks = np.empty((k, total))
+    np.put_along_axis(ranks, order, first[group] + (sizes[group] + 1) / 2, axis=1)
+
+    u = ranks[:, :n].sum(axis=1) - n * (n + 1) / 2
+    ties = (sizes.astype(np.float64) ** 3 - sizes).reshape(k, total).sum(axis=1)
+    sigma = np.sqrt(n * m / 12 * ((total + 1) - ties / (total * (total - 1))))
+    z = np.maximum(np.abs(u - n * m / 2) - 0.5, 0) / np.where(sigma > 0, sigma, 1)
+    p_value = np.where(sigma > 0, np.vectorize(math.erfc, otypes=[np.float64])(z / math.sqrt(2)), 1.0)
+    return u, p_value
+
+
+def benjamini_hochberg(p_values):
+    """Returns Benjamini-Hochberg adjusted p-values (q-values); NaN stays NaN."""
+    p_values = np.asarray(p_values, dtype=np.float64)
+    q_values = np.full(len(p_values), np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    if len(valid) == 0:
+        return q_values
+    order = valid[np.argsort(p_values[valid])]
+    scaled = p_values[order] * len(valid) / np.arange(1, len(valid) + 1)
+    q_values[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.0)
+    return q_values
+
+
+def _run_matrix(metrics, keys):
+    """Pivots (run, metric, process_name, thread_name, value) rows into a keys x runs matrix; missing values are 0."""
+    runs = metrics["run"].max() + 1 if not metrics.empty else 0
+    matrix = np.zeros((len(keys), runs))
+    if runs:
+        rows = keys.get_indexer(pd.MultiIndex.from_frame(metrics[["metric", "process_name", "thread_name"]]))
+        np.add.at(matrix, (rows, metrics["run"].to_numpy()), metrics["value"].to_numpy())
+    return matrix
+
+
+def profile_builds(builds, workers=1):
+    """Profiles every run of every build. Returns ({build: metrics with a run column}, {build: merged long-task histogram}, failures).
+
+    Runs are profiled in up to `workers` processes; each run's histogram is added to its build's
+    as soon as it arrives, and failed runs are left out.
+    """
+    jobs = [(build, run) for build, runs in builds.items() for run in runs]
+    metrics = {build: [] for build in builds}
+    histograms = {build: log_histogram([]) for build in builds}
+    failures = []
+    with multiprocessing.Pool(max(1, workers)) as pool:
+        for (build, run), result in zip(jobs, pool.imap(_profile_job, [run for _, run in jobs])):
+            if isinstance(result, str):
+                failures.append((build, run, result))
+                print(f"[{build}] {run}: {result}")
+                continue
+            run_metrics, histogram = result
+            metrics[build].append(run_metrics.assign(run=len(metrics[build])))
+            histograms[build] += histogram
+    metrics = {build: pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=["metric", "process_name", "thread_name", "value", "run"])
+               for build, parts in metrics.items()}
+    return metrics, histograms, failures
+
+
+def _profile_job(run):
+    try:
+        return run_profile(run)
+    except Exception as e:
+        return f"error: {e}"
+
+
+def compare_metrics(metrics, baseline):
+    """Compares every build's per-run metrics with the baseline build's.
+
+    Returns one row per (build, metric, process_name, thread_name) with the mean and median
+    over runs on both sides, the change of the mean, the Mann-Whitney p-value and the
+    Benjamini-Hochberg q-value over the comparisons of the same build and metric.
+    """
+    keys = pd.MultiIndex.from_frame(pd.concat([m[["metric", "process_name", "thread_name"]] for m in metrics.values()]).drop_duplicates())
+    keys = keys.sort_values()
+    base = _run_matrix(metrics[baseline], keys)
+    results = []
+    for build, build_metrics in metrics.items():
+        if build == baseline:
+            continue
+        current = _run_matrix(build_metrics, keys)
+        _, p_value = mann_whitney(base, current)
+        base_mean = base.mean(axis=1) if base.shape[1] else np.zeros(len(keys))
+        mean = current.mean(axis=1) if current.shape[1] else np.zeros(len(keys))
+        result = keys.to_frame(index=False).assign(
+            baseline=baseline, build=build, baseline_runs=base.shape[1], runs=current.shape[1],
+            baseline_mean=base_mean, mean=mean,
+            baseline_median=np.median(base, axis=1) if base.shape[1] else 0.0,
+            median=np.median(current, axis=1) if current.shape[1] else 0.0,
+            delta=mean - base_mean,
+            delta_pct=np.where(base_mean != 0, (mean - base_mean) / np.where(base_mean != 0, base_mean, 1) * 100, np.nan),
+            p_value=p_value,
+        )
+        # Keys that are zero in every run of both builds carry no information
+        result = result[(base != 0).any(axis=1) | (current != 0).any(axis=1)]
+        result["q_value"] = np.nan
+        for metric, rows in result.groupby("metric").groups.items():
+            result.loc[rows, "q_value"] = benjamini_hochberg(result.loc[rows, "p_value"].to_numpy())
+        result["significant"] = result["q_value"] < SIGNIFICANCE_LEVEL
+        results.append(result)
+    columns = ["baseline", "build", "metric", "process_name", "thread_name", "baseline_runs", "runs", "baseline_mean", "mean",
+               "baseline_median", "median", "delta", "delta_pct", "p_value", "q_value", "significant"]
+    return pd.concat(results, ignore_index=True)[columns] if results else pd.DataFrame(columns=columns)
+
+
+def histogram_table(histograms):
+    """Returns the merged long-task histograms as (build, bin_start_ms, bin_end_ms, count) rows."""
+    edges = np.concatenate([[0], histogram_edges(), [np.inf]]) / 1_000_000
+    return pd.concat([pd.DataFrame({"build": build, "bin_start_ms": edges[:-1], "bin_end_ms": edges[1:], "count": counts})
+                      for build, counts in histograms.items()], ignore_index=True)
+
+
+def render_report(comparison, histograms, run_counts, baseline):
+    report = ["# Build Comparison Report\n"]
+    report.append(f"Baseline: **{baseline}** ({run_counts[baseline]} runs). Differences are tested with a Mann-Whitney U test over runs; "
+                  f"significant means a Benjamini-Hochberg q-value below {SIGNIFICANCE_LEVEL}.\n")
+
+    report.append("## Long Main-Thread Tasks")
+    report.append("| build | runs | long tasks | " + " | ".join(f"p{p} (ms)" for p in PERCENTILES) + " |")
+    report.append("|---|---|---|" + "---|" * len(PERCENTILES))
+    for build, counts in histograms.items():
+        values = histogram_percentiles(counts)
+        report.append(f"| {build} | {run_counts[build]} | {int(counts.sum())} | " + " | ".join(f"{v / 1_000_000:.1f}" for v in values) + " |")
+    report.append("")
+
+    for build in comparison["build"].unique():
+        rows = comparison[comparison["build"] == build]
+        report.append(f"## {build} vs {baseline}")
+        if rows["p_value"].isna().all():
+            report.append("- Fewer than two runs on a side, so no significance is computed; the largest changes are listed.")
+            shown = rows
+        else:
+            shown = rows[rows["significant"]]
+            report.append(f"- {len(shown)} of {len(rows)} compared metrics changed significantly.")
+            if shown.empty:
+                report.append(f"- The changes with p < {SIGNIFICANCE_LEVEL} before correction are listed; more runs are needed to confirm them.")
+                shown = rows[rows["p_value"] < SIGNIFICANCE_LEVEL]
+        for metric, label in METRIC_LABELS.items():
+            metric_rows = shown[shown["metric"] == metric]
+            if metric_rows.empty:
+                continue
+            report.append(f"- **{label}**, largest changes:")
+            top = metric_rows.reindex(metric_rows["delta"].abs().sort_values(ascending=False).index).head(REPORT_TOP_N)
+            for _, row in top.iterrows():
+                name = row["process_name"] + (f" / {row['thread_name']}" if row["thread_name"] else "")
+                pct = f" ({row['delta_pct']:+.1f}%)" if pd.notna(row["delta_pct"]) else ""
+                q = f", q={row['q_value']:.3g}" if pd.notna(row["q_value"]) else ""
+                report.append(f"  - {name}: {row['baseline_mean']:.3g} -> {row['mean']:.3g}{pct}{q}")
+        report.append("")
+    return "\n".join(report)
+
+
+def parse_builds(build_args):
+    builds = {}
+    for name, *runs in build_args:
+        if name in builds:
+            raise ValueError(f"Build '{name}' is given twice")
+        if not runs:
+            raise ValueError(f"Build '{name}' has no runs")
+        builds[name] = runs
+    if len(builds) < 2:
+        raise ValueError("Give at least two builds to compare")
+    return builds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-process and per-thread metrics of two or more builds over repeated runs.")
+    parser.add_argument("--build", nargs="+", action="append", required=True, metavar=("NAME", "RUN"),
+                        help="a build name and its runs: directories of extracted tables or trace files; the first build is the baseline")
+    parser.add_argument("--output", required=True, help="comparison table (.csv, .parquet, .arrow or .cols)")
+    parser.add_argument("--report", help="markdown report of the significant changes")
+    parser.add_argument("--histograms", help="table of the merged long-task histograms per build")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="runs profiled in parallel")
+    args = parser.parse_args()
+
+    try:
+        builds = parse_builds(args.build)
+    except ValueError as e:
+        parser.error(str(e))
+    baseline = next(iter(builds))
+
+    metrics, histograms, failures = profile_builds(builds, args.workers)
+    run_counts = {build: int(m["run"].max() + 1) if not m.empty else 0 for build, m in metrics.items()}
+    if run_counts[baseline] == 0:
+        print(f"Error: no run of the baseline build '{baseline}' could be profiled.")
+        sys.exit(1)
+    comparison = compare_metrics(metrics, baseline)
+    write_table(comparison, args.output)
+    print(f"Comparison of {len(builds)} builds ({sum(run_counts.values())} runs) saved to {args.output}")
+    if args.histograms:
+        write_table(histogram_table(histograms), args.histograms)
+        print(f"Long-task histograms saved to {args.histograms}")
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(render_report(comparison, histograms, run_counts, baseline))
+        print(f"Comparison report saved to {args.report}")
+    if failures:
+        print(f"{len(failures)} runs could not be profiled.")
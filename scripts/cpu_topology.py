@@ -0,0 +1,213 @@
+from trace_session import TraceSession
+from query_builder import sql_list, sql_literal
+from query_cache import DEFAULT_CACHE_DIR
+from extract_metadata import extract_system_info
+import argparse
+import hashlib
+import json
+import numpy as np
+import os
+import pandas as pd
+import re
+import sys
+
+DEFAULT_TOPOLOGY_DIR = os.path.join(DEFAULT_CACHE_DIR, "topology")
+# Metadata identifying the hardware; traces with the same values share a cached topology
+FINGERPRINT_KEYS = ["android_build_fingerprint", "android_soc_model", "android_hardware_revision", "system_machine"]
+MAX_FREQ_METADATA = re.compile(r"^cpu(\d+)_max_freq_khz$", re.IGNORECASE)
+# Highest frequency each CPU reached during the trace. CPUs of a cluster share a frequency
+# domain, so they reach the same maximum as long as the cluster was busy at some point.
+CPUFREQ_MAX_QUERY = """
+    SELECT cpu_counter_track.cpu AS cpu, CAST(MAX(counter.value) AS INT) AS max_freq_khz
+    FROM counter
+    JOIN cpu_counter_track ON counter.track_id = cpu_counter_track.id
+    WHERE cpu_counter_track.name = 'cpufreq'
+    GROUP BY 1
+"""
+UNKNOWN_CLUSTER = "UNKNOWN"
+# A topology from the cpufreq counters is merged over the traces of a device (highest
+# frequency of each CPU) and used without querying the counters once this many traces
+# in a row raised no CPU's maximum.
+SETTLED_TRACES = 3
+
+# Used when neither the metadata nor the cpufreq counters give the CPU frequencies
+# (example: 0-3 LITTLE, 4-7 BIG).
+ASSUMED_LITTLE_CORES = list(range(4))
+ASSUMED_BIG_CORES = list(range(4, 8))
+
+
+def cluster_names(count):
+    """Names `count` clusters ordered by max frequency: LITTLE, MID (MID1, MID2, ... if several), BIG."""
+    if count == 1:
+        return ["UNIFORM"]
+    if count == 2:
+        return ["LITTLE", "BIG"]
+    if count == 3:
+        return ["LITTLE", "MID", "BIG"]
+    return ["LITTLE", *[f"MID{i}" for i in range(1, count - 1)], "BIG"]
+
+
+class CpuTopology:
+    """Which cluster each CPU belongs to, with `source` telling where that came from.
+
+    CPUs are grouped into clusters by their maximum frequency. `cluster_of` classifies a whole
+    cpu column at once through a cpu -> cluster code lookup array.
+    """
+
+    def __init__(self, cpu_clusters, source, max_freq_khz=None, stable_traces=0):
+        self.cpu_clusters = {int(cpu): cluster for cpu, cluster in sorted(cpu_clusters.items())}
+        self.source = source
+        # Traces in a row whose cpufreq counters did not change max_freq_khz (see load_topology)
+        self.stable_traces = stable_traces
+        self.max_freq_khz = {int(cpu): int(freq) for cpu, freq in (max_freq_khz or {}).items()}
+        self.clusters = list(dict.fromkeys(self.cpu_clusters.values()))
+        self.categories = self.clusters + [UNKNOWN_CLUSTER]
+        self._lookup = np.full(max(self.cpu_clusters, default=-1) + 1, len(self.clusters), dtype=np.int8)
+        for cpu, cluster in self.cpu_clusters.items():
+            self._lookup[cpu] = self.clusters.index(cluster)
+
+    @classmethod
+    def from_max_freq(cls, max_freq_khz, source, stable_traces=0):
+        """Groups CPUs with the same maximum frequency; `max_freq_khz` maps cpu -> kHz."""
+        freqs = sorted(set(max_freq_khz.values()))
+        names = dict(zip(freqs, cluster_names(len(freqs))))
+        return cls({cpu: names[freq] for cpu, freq in max_freq_khz.items()}, source, max_freq_khz, stable_traces)
+
+    @classmethod
+    def assumed(cls):
+        return cls({**dict.fromkeys(ASSUMED_LITTLE_CORES, "LITTLE"), **dict.fromkeys(ASSUMED_BIG_CORES, "BIG")}, "assumed")
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls({int(cpu): cluster for cpu, cluster in data["cpu_clusters"].items()}, data["source"],
+                   {int(cpu): freq for cpu, freq in data.get("max_freq_khz", {}).items()}, data.get("stable_traces", 0))
+
+    def to_dict(self):
+        return {"cpu_clusters": self.cpu_clusters, "source": self.source, "max_freq_khz": self.max_freq_khz,
+                "stable_traces": self.stable_traces}
+
+    def cpus(self, cluster):
+        return [cpu for cpu, name in self.cpu_clusters.items() if name == cluster]
+
+    def cluster_of(self, cpu):
+        """Returns the cluster of every value of `cpu` as a categorical; unknown CPUs get UNKNOWN_CLUSTER."""
+        cpu = np.asarray(cpu, dtype=np.int64)
+        known = (cpu >= 0) & (cpu < len(self._lookup))
+        codes = np.where(known, self._lookup[np.where(known, cpu, 0)], len(self.clusters))
+        return pd.Categorical.from_codes(codes, categories=self.categories)
+
+    def cluster_sql(self, column):
+        """Returns an SQL CASE expression mapping `column` (a cpu number) to its cluster name."""
+        whens = " ".join(f"WHEN {column} IN ({sql_list(self.cpus(cluster))}) THEN {sql_literal(cluster)}" for cluster in self.clusters)
+        return f"CASE {whens} ELSE {sql_literal(UNKNOWN_CLUSTER)} END"
+
+    def describe(self):
+        parts = []
+        for cluster in self.clusters:
+            cpus = self.cpus(cluster)
+            freq = self.max_freq_khz.get(cpus[0])
+            parts.append(f"{cluster} {cpus}" + (f" ({freq / 1_000_000:.2f} GHz)" if freq else ""))
+        return ", ".join(parts)
+
+
+def device_fingerprint(system_info_df):
+    """Returns a hash of the hardware-identifying metadata, or None if the trace has none of it."""
+    rows = system_info_df[system_info_df["name"].isin(FINGERPRINT_KEYS)]
+    values = {row["name"]: str(row["str_value"]) for _, row in rows.iterrows() if pd.notna(row["str_value"])}
+    if not values:
+        return None
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def max_freq_from_metadata(system_info_df):
+    """Returns cpu -> max frequency (kHz) from the cpuN_max_freq_khz metadata entries."""
+    max_freq = {}
+    for _, row in system_info_df.iterrows():
+        match = MAX_FREQ_METADATA.match(str(row["name"]))
+        if match and pd.notna(row["int_value"]):
+            max_freq[int(match.group(1))] = int(row["int_value"])
+    return max_freq
+
+
+def max_freq_from_counters(session):
+    """Returns cpu -> highest cpufreq counter value (kHz) seen in the trace."""
+    df = session.query_df(CPUFREQ_MAX_QUERY, label="cpufreq max")
+    return {int(cpu): int(freq) for cpu, freq in zip(df["cpu"], df["max_freq_khz"]) if pd.notna(freq)}
+
+
+def _read_cached(path):
+    try:
+        with open(path) as f:
+            return CpuTopology.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_cached(path, topology):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(topology.to_dict(), f, indent=2)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"Warning: could not cache the CPU topology: {e}")
+
+
+def merge_max_freq(cached, max_freq_khz):
+    """Merges the cpufreq maxima of one more trace into the `cached` counter topology.
+
+    Each CPU keeps the highest frequency seen in any trace, so a cluster that stayed idle in
+    one trace is still told apart once another trace ramped it up. stable_traces counts the
+    traces in a row that raised no CPU's maximum.
+    """
+    merged = dict(cached.max_freq_khz)
+    for cpu, freq in max_freq_khz.items():
+        merged[cpu] = max(merged.get(cpu, 0), freq)
+    stable_traces = cached.stable_traces + 1 if merged == cached.max_freq_khz else 0
+    return CpuTopology.from_max_freq(merged, "cpufreq", stable_traces)
+
+
+def load_topology(system_info_df, session=None, cache_dir=DEFAULT_TOPOLOGY_DIR):
+    """Returns the CPU topology of the traced device, or the assumed one if it cannot be detected.
+
+    The topology comes from the cpuN_max_freq_khz metadata or, given a session, the cpufreq
+    counters, and is cached per device fingerprint. A cached topology from the metadata is
+    used as is. The counters only give the highest frequency reached in one trace, so a
+    counter topology is merged with the cached one (see merge_max_freq), and the counter
+    query is skipped once SETTLED_TRACES traces in a row added nothing. Without a session, a
+    cached counter topology is used as is. With cache_dir None nothing is cached.
+    """
+    fingerprint = device_fingerprint(system_info_df)
+    path = os.path.join(cache_dir, f"{fingerprint}.json") if cache_dir and fingerprint else None
+    cached = _read_cached(path) if path and os.path.exists(path) else None
+    if cached is not None and cached.source == "metadata":
+        return cached
+
+    max_freq = max_freq_from_metadata(system_info_df)
+    if max_freq:
+        topology = CpuTopology.from_max_freq(max_freq, "metadata")
+    elif cached is not None and (session is None or cached.stable_traces >= SETTLED_TRACES):
+        return cached
+    else:
+        max_freq = max_freq_from_counters(session) if session is not None else {}
+        if not max_freq:
+            return cached or CpuTopology.assumed()
+        topology = merge_max_freq(cached, max_freq) if cached is not None else CpuTopology.from_max_freq(max_freq, "cpufreq")
+    if path:
+        _write_cached(path, topology)
+    return topology
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect the CPU clusters of the traced device and cache them by device fingerprint.")
+    parser.add_argument("trace_file_path")
+    parser.add_argument("--cache-dir", default=DEFAULT_TOPOLOGY_DIR, help="directory of the cached topologies")
+    args = parser.parse_args()
+
+    try:
+        with TraceSession(args.trace_file_path) as session:
+            topology = load_topology(extract_system_info(session), session, args.cache_dir)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
+    print(f"CPU clusters ({topology.source}): {topology.describe()}")
@@ -1,54 +1,78 @@
-from perfetto.trace_processor import TraceProcessor
+from trace_session import TraceSession
+from table_io import write_table, write_table_chunks
+from query_builder import QueryTemplate
+from trace_model import compact_table
 import pandas as pd
 import sys
 
-if len(sys.argv) != 3:
-    print("Usage: python extract_cpu_usage.py <trace_file_path> <cpu_usage_output_path>")
-    sys.exit(1)
-
-trace_file = sys.argv[1]
-cpu_usage_output = sys.argv[2]
-
-try:
-    # Initialize TraceProcessor with the trace file
-    tp = TraceProcessor(trace=trace_file)
-
-    # Query for CPU scheduling slices (CPU time per thread)
-    # This query provides duration each thread ran on each CPU
-    cpu_sched_df = tp.query("""
-        SELECT
-            thread.name AS thread_name,
-            process.name AS process_name,
-            process.upid,
-            thread.utid,
-            sched_slice.cpu,
-            sched_slice.ts,
-            sched_slice.dur,
-            sched_slice.end_state
-        FROM sched_slice
-        JOIN thread ON sched_slice.utid = thread.utid
-        JOIN process ON thread.upid = process.upid
-        ORDER BY sched_slice.ts;
-    """).as_pandas_dataframe()
-    cpu_sched_df.to_csv(cpu_usage_output, index=False)
-    print(f"CPU scheduling slice data saved to {cpu_usage_output}")
-
-    # Example: Query for CPU frequency (if available and relevant)
-    # cpu_freq_df = tp.query("SELECT ts, value, cpu FROM counter WHERE name = 'cpufreq'").as_pandas_dataframe()
-    # cpu_freq_df.to_csv(cpu_freq_output, index=False)
-    # print(f"CPU frequency data saved to {cpu_freq_output}")
-
-    # Example: Query for Android CPU metrics (this returns a protobuf, not directly a dataframe)
-    # try:
-    #     android_cpu_metric = tp.metric([\'android_cpu\'])
-    #     with open(f"{cpu_usage_output}_android_cpu_metric.txt", "w") as f:
-    #         f.write(str(android_cpu_metric))
-    #     print(f"Android CPU metric saved to {cpu_usage_output}_android_cpu_metric.txt")
-    # except Exception as e_metric:
-    #     print(f"Could not retrieve android_cpu metric: {e_metric}")
-
-except Exception as e:
-    print(f"An error occurred: {e}")
-    sys.exit(1)
-
-print("CPU usage data extraction complete.")
+# Query for CPU scheduling slices (CPU time per thread)
+# This query provides duration each thread ran on each CPU
+CPU_SCHED_QUERY_TEMPLATE = """
+    SELECT
+        thread.name AS thread_name,
+        process.name AS process_name,
+        process.upid,
+        thread.utid,
+        sched_slice.cpu,
+        sched_slice.ts,
+        sched_slice.dur,
+        sched_slice.end_state
+    FROM sched_slice
+    JOIN thread ON sched_slice.utid = thread.utid
+    JOIN process ON thread.upid = process.upid
+    {where}
+    ORDER BY sched_slice.ts;
+"""
+CPU_SCHED_QUERY = CPU_SCHED_QUERY_TEMPLATE.format(where="")
+CPU_SCHED_CHUNK_QUERY = QueryTemplate(CPU_SCHED_QUERY_TEMPLATE.format(where="WHERE sched_slice.ts >= :start_ts AND sched_slice.ts < :end_ts"))
+
+
+def extract_cpu_sched(session):
+    return compact_table(session.query_df(CPU_SCHED_QUERY, label="cpu_sched"))
+
+
+def iter_cpu_sched_chunks(session, chunk_rows):
+    """Yields the same rows as extract_cpu_sched in ts order, as DataFrames of roughly `chunk_rows` rows."""
+    for start_ts, end_ts in session.ts_ranges("sched_slice", chunk_rows):
+        yield compact_table(session.query_df(CPU_SCHED_CHUNK_QUERY.bind(start_ts=start_ts, end_ts=end_ts), label="cpu_sched chunk"))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python extract_cpu_usage.py <trace_file_path> <cpu_usage_output_path> [chunk_rows]")
+        print("With chunk_rows, the output path is a directory and the data is written in chunks of about chunk_rows rows as it is queried.")
+        sys.exit(1)
+
+    trace_file = sys.argv[1]
+    cpu_usage_output = sys.argv[2]
+    chunk_rows = int(sys.argv[3]) if len(sys.argv) == 4 else None
+
+    try:
+        with TraceSession(trace_file) as session:
+            if chunk_rows:
+                row_count = write_table_chunks(iter_cpu_sched_chunks(session, chunk_rows), cpu_usage_output)
+                print(f"CPU scheduling slice data ({row_count} rows) saved in chunks to {cpu_usage_output}")
+            else:
+                cpu_sched_df = extract_cpu_sched(session)
+                write_table(cpu_sched_df, cpu_usage_output)
+                print(f"CPU scheduling slice data saved to {cpu_usage_output}")
+
+            # Example: Query for CPU frequency (if available and relevant)
+            # cpu_freq_df = session.query_df("SELECT ts, value, cpu FROM counter WHERE name = 'cpufreq'")
+            # cpu_freq_df.to_csv(cpu_freq_output, index=False)
+            # print(f"CPU frequency data saved to {cpu_freq_output}")
+
+            # Example: Query for Android CPU metrics (this returns a protobuf, not directly a dataframe)
+            # try:
+            #     android_cpu_metric = session.tp.metric([\'android_cpu\'])
+            #     with open(f"{cpu_usage_output}_android_cpu_metric.txt", "w") as f:
+            #         f.write(str(android_cpu_metric))
+            #     print(f"Android CPU metric saved to {cpu_usage_output}_android_cpu_metric.txt")
+            # except Exception as e_metric:
+            #     print(f"Could not retrieve android_cpu metric: {e_metric}")
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
+
+    print("CPU usage data extraction complete.")
@@ -1,49 +1,106 @@
-from perfetto.trace_processor import TraceProcessor
-import pandas as pd
+from trace_session import TraceSession
+from query_builder import values_table, sql_literal
 import sys
 
-if len(sys.argv) != 6:
-    print("Usage: python extract_long_tasks.py <trace_file_path> <process_name> <thread_name> <duration_threshold_ns> <output_csv_path>")
-    sys.exit(1)
-
-trace_file = sys.argv[1]
-process_name_filter = sys.argv[2]
-thread_name_filter = sys.argv[3]
-duration_threshold_ns = int(sys.argv[4])
-output_csv = sys.argv[5]
-
-try:
-    tp = TraceProcessor(trace=trace_file)
-
-    # Construct the query parts
-    query_select = "SELECT slice.name AS slice_name, thread.name AS thread_name, process.name AS process_name, slice.ts, slice.dur, thread.utid, process.upid"
-    query_from_join = """
-    FROM slice
-    JOIN thread_track ON slice.track_id = thread_track.id
-    JOIN thread ON thread_track.utid = thread.utid
-    JOIN process ON thread.upid = process.upid
+# table_io (and with it pandas) is only imported when this runs as a script, so that
+# `perfetto_analysis.py long-tasks` can build the query without loading pandas.
+
+
+LONG_TASKS_COLUMNS = ["slice_name", "thread_name", "process_name", "ts", "dur", "utid", "upid"]
+FILTER_COLUMNS = ["filter_process_name", "filter_thread_name", "filter_duration_threshold_ns"]
+
+# One (process, thread, threshold) filter per row of the `filters` table; a NULL thread_name
+# matches every thread of the process. All filters are answered by a single pass over slice.
+LONG_TASKS_BATCH_QUERY = """
+WITH {filters}
+SELECT
+    filters.process_name AS filter_process_name,
+    filters.thread_name AS filter_thread_name,
+    filters.min_dur AS filter_duration_threshold_ns,
+    slice.name AS slice_name,
+    thread.name AS thread_name,
+    process.name AS process_name,
+    slice.ts,
+    slice.dur,
+    thread.utid,
+    process.upid
+FROM slice
+JOIN thread_track ON slice.track_id = thread_track.id
+JOIN thread ON thread_track.utid = thread.utid
+JOIN process ON thread.upid = process.upid
+JOIN filters ON process.name = filters.process_name
+    AND (filters.thread_name IS NULL OR thread.name = filters.thread_name)
+    AND slice.dur > filters.min_dur
+WHERE slice.dur > (SELECT MIN(min_dur) FROM filters){ts_filter}
+ORDER BY filters.filter_id, slice.dur DESC;
+"""
+
+
+def long_tasks_batch_query(filters, end_range=None):
+    """Returns the query selecting the long tasks of many (process_name, thread_name, duration_threshold_ns) filters.
+
+    A thread_name of 'all' (or None) selects every thread of the process. Each row has the
+    long task columns plus filter_process_name, filter_thread_name and
+    filter_duration_threshold_ns identifying the filter it matched. With an end_range of
+    (start_ts, end_ts), only slices that ended in [start_ts, end_ts) are selected.
+    """
+    filters = [(process_name, None if not isinstance(thread_name, str) or thread_name.lower() == "all" else thread_name, int(threshold_ns))
+               for process_name, thread_name, threshold_ns in filters]
+    filters_cte = values_table("filters", ["filter_id", "process_name", "thread_name", "min_dur"],
+                               [(i, *f) for i, f in enumerate(filters)])
+    ts_filter = ""
+    if end_range is not None:
+        ts_filter = f" AND slice.ts + slice.dur >= {sql_literal(end_range[0])} AND slice.ts + slice.dur < {sql_literal(end_range[1])}"
+    return LONG_TASKS_BATCH_QUERY.format(filters=filters_cte, ts_filter=ts_filter)
+
+
+def extract_long_tasks_batch(session, filters, end_range=None):
+    """Returns the long tasks of many (process_name, thread_name, duration_threshold_ns) filters in one query.
+
+    See long_tasks_batch_query for the filters and the columns of the result.
     """
-    
-    conditions = []
-    conditions.append(f"process.name = '{process_name_filter}'")   
-    if thread_name_filter.lower() != 'all':
-        conditions.append(f"thread.name = \'{thread_name_filter}\'")
-    
-    conditions.append(f"slice.dur > {duration_threshold_ns}")
-    
-    query_where = "WHERE " + " AND ".join(conditions)
-    query_order_by = "ORDER BY slice.dur DESC"
-    
-    final_query = f"{query_select}\n{query_from_join}\n{query_where}\n{query_order_by};"
-    
-    # print(f"Executing query: {final_query}") # For debugging
-
-    long_tasks_df = tp.query(final_query).as_pandas_dataframe()
-    long_tasks_df.to_csv(output_csv, index=False)
-    print(f"Long-running task data for process \'{process_name_filter}\' (thread: \'{thread_name_filter}\") saved to {output_csv}")
-
-except Exception as e:
-    print(f"An error occurred: {e}")
-    sys.exit(1)
-
-print("Long-running task extraction complete.")
+    long_tasks_df = session.query_df(long_tasks_batch_query(filters, end_range), label="long_tasks")
+    return long_tasks_df[FILTER_COLUMNS + LONG_TASKS_COLUMNS]
+
+
+def extract_long_tasks(session, process_name_filter, thread_name_filter, duration_threshold_ns):
+    long_tasks_df = extract_long_tasks_batch(session, [(process_name_filter, thread_name_filter, duration_threshold_ns)])
+    return long_tasks_df[LONG_TASKS_COLUMNS]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 6):
+        print("Usage: python extract_long_tasks.py <trace_file_path> <process_name> <thread_name> <duration_threshold_ns> <output_csv_path>")
+        print("       python extract_long_tasks.py <trace_file_path> <filters_csv_path> <output_csv_path>")
+        print("The filters file has process_name, thread_name and duration_threshold_ns columns; all filters are checked in one query.")
+        sys.exit(1)
+
+    from table_io import write_table, read_table
+
+    trace_file = sys.argv[1]
+    if len(sys.argv) == 4:
+        filters_df = read_table(sys.argv[2])
+        filters = list(filters_df[["process_name", "thread_name", "duration_threshold_ns"]].itertuples(index=False, name=None))
+        output_csv = sys.argv[3]
+    else:
+        process_name_filter = sys.argv[2]
+        thread_name_filter = sys.argv[3]
+        duration_threshold_ns = int(sys.argv[4])
+        output_csv = sys.argv[5]
+
+    try:
+        with TraceSession(trace_file) as session:
+            if len(sys.argv) == 4:
+                long_tasks_df = extract_long_tasks_batch(session, filters)
+                write_table(long_tasks_df, output_csv)
+                print(f"Long-running task data for {len(filters)} filters saved to {output_csv}")
+            else:
+                long_tasks_df = extract_long_tasks(session, process_name_filter, thread_name_filter, duration_threshold_ns)
+                write_table(long_tasks_df, output_csv)
+                print(f"Long-running task data for process \'{process_name_filter}\' (thread: \'{thread_name_filter}\") saved to {output_csv}")
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
+
+    print("Long-running task extraction complete.")
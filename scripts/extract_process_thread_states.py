@@ -0,0 +1,107 @@
+from trace_session import TraceSession
+from table_io import write_table
+from query_builder import sql_literal, sql_list
+import argparse
+import re
+import sys
+
+# Column names of the thread states reported by extract_youtube_thread_cpu_states.py. They are
+# always present in the output; any other observed state gets a total_state_<state>_ns column.
+STATE_COLUMNS = {
+    "R": "total_runnable_ns",
+    "S": "total_sleeping_ns",
+    "D": "total_interruptible_sleep_ns",
+    "DK": "total_uninterruptible_sleep_ns",
+    "T": "total_stopped_ns",
+    "P": "total_parked_ns",
+}
+# Running time comes from sched_slice, so the thread_state Running rows are not pivoted
+RUNNING_STATE = "Running"
+THREAD_COLUMNS = ["process_name", "upid", "utid", "thread_name"]
+
+
+def process_filter_sql(process_names=None, process_regex=None):
+    """Returns the WHERE clause selecting processes by exact names and/or a regex; all processes when both are None."""
+    conditions = []
+    if process_names:
+        conditions.append(f"process.name IN ({sql_list(process_names)})")
+    if process_regex:
+        conditions.append(f"process.name REGEXP {sql_literal(process_regex)}")
+    return "WHERE " + " OR ".join(conditions) if conditions else ""
+
+
+def state_column(state):
+    if state in STATE_COLUMNS:
+        return STATE_COLUMNS[state]
+    return "total_state_" + re.sub(r"\W", lambda m: "_plus" if m.group() == "+" else "_", state) + "_ns"
+
+
+def pivot_state_totals(threads, totals, keys):
+    """Turns (keys..., state, state_ns) totals into one row per row of `threads` with a column per state.
+
+    Rows with state RUNNING_STATE become total_running_ns. Threads without any totals get zeros.
+    """
+    wide = totals.pivot_table(index=keys, columns="state", values="state_ns", aggfunc="sum", fill_value=0, observed=True)
+    wide.columns = [("total_running_ns" if state == RUNNING_STATE else state_column(state)) for state in wide.columns]
+    other_columns = sorted(c for c in wide.columns if c not in STATE_COLUMNS.values() and c != "total_running_ns")
+    value_columns = ["total_running_ns", *STATE_COLUMNS.values(), *other_columns]
+
+    result = threads.merge(wide, left_on=keys, right_index=True, how="left")
+    result = result.reindex(columns=list(threads.columns) + value_columns)
+    result[value_columns] = result[value_columns].fillna(0).astype("int64")
+    return result
+
+
+def extract_process_thread_states(session, process_names=None, process_regex=None):
+    """Returns running time and time per thread state for every thread of the selected processes.
+
+    One row per thread (process_name, upid, utid, thread_name, total_running_ns and a column per
+    state). All selected processes are handled by a single GROUP BY utid, state query, so
+    monitoring many apps costs the same as monitoring one.
+    """
+    where = process_filter_sql(process_names, process_regex)
+    threads_sql = f"""
+        SELECT process.name AS process_name, thread.upid, thread.utid, thread.name AS thread_name
+        FROM thread
+        JOIN process ON thread.upid = process.upid
+        {where}
+    """
+    threads = session.query_df(threads_sql, label="process_threads")
+    totals = session.query_df(f"""
+        WITH target_threads AS ({threads_sql})
+        SELECT utid, {sql_literal(RUNNING_STATE)} AS state, SUM(dur) AS state_ns
+        FROM sched_slice
+        WHERE utid IN (SELECT utid FROM target_threads)
+        GROUP BY utid
+        UNION ALL
+        SELECT utid, state, SUM(dur) AS state_ns
+        FROM thread_state
+        WHERE utid IN (SELECT utid FROM target_threads) AND state IS NOT NULL AND state != {sql_literal(RUNNING_STATE)}
+        GROUP BY utid, state
+    """, label="process_thread_state_totals")
+
+    result = pivot_state_totals(threads[THREAD_COLUMNS], totals, ["utid"])
+    return result.sort_values(["process_name", "total_running_ns", "thread_name"], ascending=[True, False, True], ignore_index=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract running and thread state times per thread for many processes in one pass.")
+    parser.add_argument("trace_file_path")
+    parser.add_argument("output_path", help="output table (.csv, .parquet or .arrow)")
+    parser.add_argument("--process", action="append", dest="process_names", metavar="NAME", help="exact process name; may be repeated")
+    parser.add_argument("--regex", help="regular expression matched against process names")
+    args = parser.parse_args()
+
+    try:
+        with TraceSession(args.trace_file_path) as session:
+            thread_states_df = extract_process_thread_states(session, args.process_names, args.regex)
+            if thread_states_df.empty:
+                print("No matching processes found in the trace.")
+                sys.exit(1)
+            write_table(thread_states_df, args.output_path)
+            print(f"Thread CPU and state times of {thread_states_df['upid'].nunique()} processes saved to {args.output_path}")
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
+
+    print("Process thread state extraction complete.")
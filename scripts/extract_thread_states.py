@@ -1,38 +1,62 @@
-from perfetto.trace_processor import TraceProcessor
+from trace_session import TraceSession
+from table_io import write_table, write_table_chunks
+from query_builder import QueryTemplate
+from trace_model import compact_table
 import pandas as pd
 import sys
 
-if len(sys.argv) != 3:
-    print("Usage: python extract_thread_states.py <trace_file_path> <thread_states_output_path>")
-    sys.exit(1)
-
-trace_file = sys.argv[1]
-thread_states_output = sys.argv[2]
-
-try:
-    # Initialize TraceProcessor with the trace file
-    tp = TraceProcessor(trace=trace_file)
-
-    # Query for thread states
-    thread_states_df = tp.query("""
-        SELECT
-            thread_state.utid,
-            thread.name AS thread_name,
-            process.name AS process_name,
-            thread_state.ts,
-            thread_state.dur,
-            thread_state.state,
-            thread_state.blocked_function
-        FROM thread_state
-        JOIN thread ON thread_state.utid = thread.utid
-        JOIN process ON thread.upid = process.upid
-        ORDER BY thread_state.ts;
-    """).as_pandas_dataframe()
-    thread_states_df.to_csv(thread_states_output, index=False)
-    print(f"Thread state data saved to {thread_states_output}")
-
-except Exception as e:
-    print(f"An error occurred: {e}")
-    sys.exit(1)
-
-print("Thread state data extraction complete.")
+# Query for thread states
+THREAD_STATES_QUERY_TEMPLATE = """
+    SELECT
+        thread_state.utid,
+        thread.name AS thread_name,
+        process.name AS process_name,
+        thread_state.ts,
+        thread_state.dur,
+        thread_state.state,
+        thread_state.blocked_function
+    FROM thread_state
+    JOIN thread ON thread_state.utid = thread.utid
+    JOIN process ON thread.upid = process.upid
+    {where}
+    ORDER BY thread_state.ts;
+"""
+THREAD_STATES_QUERY = THREAD_STATES_QUERY_TEMPLATE.format(where="")
+THREAD_STATES_CHUNK_QUERY = QueryTemplate(THREAD_STATES_QUERY_TEMPLATE.format(where="WHERE thread_state.ts >= :start_ts AND thread_state.ts < :end_ts"))
+
+
+def extract_thread_states(session):
+    return compact_table(session.query_df(THREAD_STATES_QUERY, label="thread_states"))
+
+
+def iter_thread_states_chunks(session, chunk_rows):
+    """Yields the same rows as extract_thread_states in ts order, as DataFrames of roughly `chunk_rows` rows."""
+    for start_ts, end_ts in session.ts_ranges("thread_state", chunk_rows):
+        yield compact_table(session.query_df(THREAD_STATES_CHUNK_QUERY.bind(start_ts=start_ts, end_ts=end_ts), label="thread_states chunk"))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python extract_thread_states.py <trace_file_path> <thread_states_output_path> [chunk_rows]")
+        print("With chunk_rows, the output path is a directory and the data is written in chunks of about chunk_rows rows as it is queried.")
+        sys.exit(1)
+
+    trace_file = sys.argv[1]
+    thread_states_output = sys.argv[2]
+    chunk_rows = int(sys.argv[3]) if len(sys.argv) == 4 else None
+
+    try:
+        with TraceSession(trace_file) as session:
+            if chunk_rows:
+                row_count = write_table_chunks(iter_thread_states_chunks(session, chunk_rows), thread_states_output)
+                print(f"Thread state data ({row_count} rows) saved in chunks to {thread_states_output}")
+            else:
+                thread_states_df = extract_thread_states(session)
+                write_table(thread_states_df, thread_states_output)
+                print(f"Thread state data saved to {thread_states_output}")
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
+
+    print("Thread state data extraction complete.")
@@ -1,75 +1,41 @@
-from perfetto.trace_processor import TraceProcessor
-import pandas as pd
+from trace_session import TraceSession
+from table_io import write_table
+from extract_process_thread_states import extract_process_thread_states, STATE_COLUMNS
 import sys
 
-if len(sys.argv) != 3:
-    print("Usage: python extract_youtube_thread_cpu_states.py <trace_file_path> <output_csv_path>")
-    sys.exit(1)
+YOUTUBE_PROCESS_NAME = "com.google.android.youtube"
+YOUTUBE_THREAD_STATES_COLUMNS = ["thread_name", "total_running_ns", *STATE_COLUMNS.values()]
 
-trace_file = sys.argv[1]
-output_csv = sys.argv[2]
-process_name_filter = "com.google.android.youtube"
 
-try:
-    tp = TraceProcessor(trace=trace_file)
+def extract_youtube_thread_cpu_states(session, process_name_filter=YOUTUBE_PROCESS_NAME):
+    """Returns per-thread running and state times, or None if the process is not in the trace."""
+    thread_states_df = extract_process_thread_states(session, [process_name_filter])
+    if thread_states_df.empty:
+        return None
+    thread_states_df = thread_states_df.sort_values(["total_running_ns", "thread_name"], ascending=[False, True], ignore_index=True)
+    return thread_states_df[YOUTUBE_THREAD_STATES_COLUMNS]
 
-    # Get upid for the process name
-    upid_query_result = tp.query(f"SELECT upid FROM process WHERE name = \'{process_name_filter}\' LIMIT 1").as_pandas_dataframe()
-    if upid_query_result.empty:
-        print(f"Process \'{process_name_filter}\' not found in the trace.")
-        sys.exit(1)
-    target_upid = upid_query_result["upid"][0]
-
-    query = f"""
-    WITH YoutubeThreads AS (
-        SELECT utid, name AS thread_name
-        FROM thread
-        WHERE upid = {target_upid}
-    ),
-    RunningTimes AS (
-        SELECT
-            utid,
-            SUM(dur) AS running_ns
-        FROM sched_slice
-        WHERE utid IN (SELECT utid FROM YoutubeThreads)
-        GROUP BY utid
-    ),
-    StateTimes AS (
-        SELECT
-            utid,
-            state,
-            SUM(dur) AS state_ns
-        FROM thread_state
-        WHERE utid IN (SELECT utid FROM YoutubeThreads)
-        GROUP BY utid, state
-    )
-    SELECT
-        yt.thread_name,
-        COALESCE(rt.running_ns, 0) AS total_running_ns,
-        COALESCE(st_runnable.state_ns, 0) AS total_runnable_ns, /* R */
-        COALESCE(st_sleeping.state_ns, 0) AS total_sleeping_ns, /* S */
-        COALESCE(st_interruptible_sleep.state_ns, 0) AS total_interruptible_sleep_ns, /* D */
-        COALESCE(st_uninterruptible_sleep.state_ns, 0) AS total_uninterruptible_sleep_ns, /* DK */
-        COALESCE(st_stopped.state_ns, 0) AS total_stopped_ns, /* T */
-        COALESCE(st_parked.state_ns, 0) AS total_parked_ns /* P */
-    FROM YoutubeThreads yt
-    LEFT JOIN RunningTimes rt ON yt.utid = rt.utid
-    LEFT JOIN StateTimes st_runnable ON yt.utid = st_runnable.utid AND st_runnable.state = 'R'
-    LEFT JOIN StateTimes st_sleeping ON yt.utid = st_sleeping.utid AND st_sleeping.state = 'S'
-    LEFT JOIN StateTimes st_interruptible_sleep ON yt.utid = st_interruptible_sleep.utid AND st_interruptible_sleep.state = 'D'
-    LEFT JOIN StateTimes st_uninterruptible_sleep ON yt.utid = st_uninterruptible_sleep.utid AND st_uninterruptible_sleep.state = 'DK'
-    LEFT JOIN StateTimes st_stopped ON yt.utid = st_stopped.utid AND st_stopped.state = 'T'
-    LEFT JOIN StateTimes st_parked ON yt.utid = st_parked.utid AND st_parked.state = 'P'
-    ORDER BY total_running_ns DESC, yt.thread_name;
-    """
-
-    youtube_thread_states_df = tp.query(query).as_pandas_dataframe()
-    youtube_thread_states_df.to_csv(output_csv, index=False)
-    print(f"YouTube thread CPU and state times saved to {output_csv}")
 
-except Exception as e:
-    print(f"An error occurred: {e}")
-    sys.exit(1)
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python extract_youtube_thread_cpu_states.py <trace_file_path> <output_csv_path>")
+        sys.exit(1)
 
-print("YouTube thread CPU and state time extraction complete.")
+    trace_file = sys.argv[1]
+    output_csv = sys.argv[2]
+    process_name_filter = YOUTUBE_PROCESS_NAME
+
+    try:
+        with TraceSession(trace_file) as session:
+            youtube_thread_states_df = extract_youtube_thread_cpu_states(session, process_name_filter)
+            if youtube_thread_states_df is None:
+                print(f"Process \'{process_name_filter}\' not found in the trace.")
+                sys.exit(1)
+            write_table(youtube_thread_states_df, output_csv)
+            print(f"YouTube thread CPU and state times saved to {output_csv}")
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
 
+    print("YouTube thread CPU and state time extraction complete.")
@@ -1,3 +1,12 @@
+from table_io import read_table, ChunkedTable, iter_chunks, is_column_store
+from query_builder import QueryTemplate, values_table
+from window_utilization import busy_time_per_window, sliding_busy_time, combine_busy_time
+from trace_model import compact_table, name_mask
+from sched_index import SchedIndex, competing_threads, SLICE_COLUMNS
+from instrumentation import span, traced
+from cpu_topology import CpuTopology, load_topology, ASSUMED_LITTLE_CORES, ASSUMED_BIG_CORES, UNKNOWN_CLUSTER
+import numpy as np
+import os
 import pandas as pd
 import sys
 
@@ -6,14 +15,18 @@ LONG_TASK_THRESHOLD_MS = 16
 HIGH_RUNNABLE_RATIO_THRESHOLD = 0.2 # Runnable time is 20% of (runnable + running)
 CPU_SPIKE_WINDOW_MS = 100 # Time window in ms to check for CPU spikes
 CPU_SPIKE_PROCESS_THRESHOLD_MS = 50 # If a process uses more than this in a window, it might be a spike contributor
+CPU_SPIKE_SLIDE_MS = 25 # Step between consecutive spike windows; set equal to CPU_SPIKE_WINDOW_MS for fixed windows
 SHORT_RUN_THRESHOLD_NS = 5_000_000 # 5ms for a run to be considered short
 FREQUENT_SHORT_RUN_COUNT_THRESHOLD = 100 # If a thread has more than this many short runs
+RUN_SLEEP_MAX_GAP_NS = 10_000 # The thread state following a run must start within this long after the run ends
+RUN_SLEEP_TOP_N = 10 # Threads and kernel functions listed in the run->sleep section
+LONG_TASK_DETAIL_TOP_N = 5 # Longest tasks listed with the threads that ran on the CPUs meanwhile
+COMPETING_THREADS_TOP_N = 3 # Competing threads listed per long task
+MIGRATION_TOP_N = 10 # Threads listed in the core migration section
+SLEEP_STATES = ["S"]
+UNINTERRUPTIBLE_SLEEP_STATES = ["D", "DK"]
 
-# Assumed CPU core configuration (example: 0-3 LITTLE, 4-7 big/Gold). Update if metadata provides specifics.
-# This is a placeholder; actual core types should be determined from device specs or trace metadata if possible.
-ASSUMED_LITTLE_CORES = list(range(4))
-ASSUMED_BIG_CORES = list(range(4, 8))
-
+@traced("analyzer")
 def analyze_perf_samples_skipped(system_info_df):
     report = []
     report.append("## Perf Samples Skipped Analysis")
@@ -26,7 +39,8 @@ def analyze_perf_samples_skipped(system_info_df):
     report.append("\n")
     return "\n".join(report)
 
-def analyze_long_main_thread_tasks(long_tasks_df, process_name, thread_name):
+@traced("analyzer")
+def analyze_long_main_thread_tasks(long_tasks_df, process_name, thread_name, cpu_sched=None):
     report = []
     report.append(f"## Long Tasks on {process_name} - {thread_name} Analysis")
     if long_tasks_df.empty:
@@ -39,9 +53,12 @@ def analyze_long_main_thread_tasks(long_tasks_df, process_name, thread_name):
         report.append(f"  - Maximum duration observed: {max_duration_ms:.2f} ms.")
         report.append(f"  - Average duration of these long tasks: {avg_duration_ms:.2f} ms.")
         report.append(f"  - These tasks are prime suspects for causing UI unresponsiveness or jank.")
+        if cpu_sched is not None:
+            report.extend(_long_task_competition_report(long_tasks_df, cpu_sched))
     report.append("\n")
     return "\n".join(report)
 
+@traced("analyzer")
 def analyze_high_runnable_time(youtube_thread_states_df):
     report = []
     report.append("## High Runnable Time for YouTube Threads Analysis")
@@ -67,142 +84,758 @@ def analyze_high_runnable_time(youtube_thread_states_df):
     report.append("\n")
     return "\n".join(report)
 
-def analyze_youtube_thread_core_placement(cpu_sched_df, system_info_df):
+YOUTUBE_PROCESS_NAME = "com.google.android.youtube"
+CRITICAL_YOUTUBE_THREADS = ["com.google.android.youtube:main", "RenderThread", "GPU completion"]
+
+# The sched-based analyzers below are split into an aggregation step and a rendering step.
+# The aggregation takes cpu_sched/thread_states either as a DataFrame, as a ChunkedTable
+# (see table_io.py), reduced one chunk at a time so chunked extraction output is analyzed
+# with bounded memory, or as a TraceSession (see trace_session.py). For a TraceSession the
+# aggregation runs as SQL inside trace processor and only the small result table is
+# transferred. Both engines return the same columns.
+
+SCHED_JOIN_SQL = """
+    FROM sched_slice
+    JOIN thread ON sched_slice.utid = thread.utid
+    JOIN process ON thread.upid = process.upid
+"""
+
+# {cluster} and {prev_cluster} are CpuTopology.cluster_sql expressions, filled in per topology
+CORE_PLACEMENT_QUERY = f"""
+    SELECT
+        CASE WHEN thread.name IN (:critical_threads) THEN thread.name END AS thread_name,
+        {{cluster}} AS core_type,
+        SUM(sched_slice.dur) AS dur,
+        COUNT(*) AS slice_count
+    {SCHED_JOIN_SQL}
+    WHERE process.name = :process_name
+    GROUP BY 1, 2
+"""
+CLUSTER_TIME_QUERY = f"""
+    SELECT process.name AS process_name, {{cluster}} AS cluster, SUM(sched_slice.dur) AS dur
+    {SCHED_JOIN_SQL}
+    WHERE sched_slice.utid != 0
+    GROUP BY 1, 2
+"""
+MIGRATIONS_QUERY = f"""
+    SELECT
+        utid,
+        process_name,
+        thread_name,
+        COUNT(*) AS slice_count,
+        SUM(prev_cpu IS NOT NULL AND prev_cpu != cpu) AS migrations,
+        SUM(prev_cpu IS NOT NULL AND {{prev_cluster}} != {{cluster}}) AS cluster_migrations
+    FROM (
+        SELECT
+            thread.utid,
+            process.name AS process_name,
+            thread.name AS thread_name,
+            sched_slice.cpu,
+            LAG(sched_slice.cpu) OVER (PARTITION BY sched_slice.utid ORDER BY sched_slice.ts) AS prev_cpu
+        {SCHED_JOIN_SQL}
+        WHERE sched_slice.utid != 0
+    )
+    GROUP BY 1, 2, 3
+"""
+# Bucket number of the first and the last nanosecond of a slice
+FIRST_BUCKET_SQL = "(sched_slice.ts - :origin_ts) / :bucket_ns"
+LAST_BUCKET_SQL = "(sched_slice.ts + sched_slice.dur - 1 - :origin_ts) / :bucket_ns"
+BUCKET_BUSY_QUERIES = {
+    key: QueryTemplate(f"""
+        SELECT {key_sql} AS key, {FIRST_BUCKET_SQL} AS window, SUM(sched_slice.dur) AS busy_ns
+        {SCHED_JOIN_SQL}
+        WHERE sched_slice.utid != 0 AND sched_slice.dur > 0 AND {FIRST_BUCKET_SQL} = {LAST_BUCKET_SQL} AND {key_sql} IS NOT NULL
+        GROUP BY 1, 2
+    """)
+    for key, key_sql in [("process", "process.name"), ("cpu", "sched_slice.cpu")]
+}
+BUCKET_CROSSING_QUERY = QueryTemplate(f"""
+    SELECT process.name AS process_name, sched_slice.cpu, sched_slice.ts, sched_slice.dur
+    {SCHED_JOIN_SQL}
+    WHERE sched_slice.utid != 0 AND sched_slice.dur > 0 AND {FIRST_BUCKET_SQL} != {LAST_BUCKET_SQL}
+""")
+SHORT_RUNS_QUERY = QueryTemplate(f"""
+    SELECT process.name AS process_name, thread.name AS thread_name, COUNT(*) AS short_run_count
+    {SCHED_JOIN_SQL}
+    WHERE sched_slice.dur < :short_run_threshold_ns
+        AND process.name IS NOT NULL AND thread.name IS NOT NULL
+    GROUP BY process.name, thread.name
+    HAVING COUNT(*) > :count_threshold
+    ORDER BY process.name, thread.name
+""")
+# A Running thread_state interval is the same period as its sched slice, so the state
+# that follows a run is simply the next thread_state row of that thread.
+RUN_SLEEP_QUERY = QueryTemplate("""
+    WITH runs AS (
+        SELECT
+            utid, ts, dur, state,
+            LEAD(ts) OVER w AS next_ts,
+            LEAD(state) OVER w AS next_state,
+            LEAD(blocked_function) OVER w AS next_blocked_function
+        FROM thread_state
+        WINDOW w AS (PARTITION BY utid ORDER BY ts)
+    )
+    SELECT
+        process.name AS process_name,
+        thread.name AS thread_name,
+        runs.next_state AS state,
+        runs.next_blocked_function AS blocked_function,
+        COUNT(*) AS run_count
+    FROM runs
+    JOIN thread ON runs.utid = thread.utid
+    JOIN process ON thread.upid = process.upid
+    WHERE runs.state = 'Running' AND runs.dur < :short_run_threshold_ns AND runs.utid != 0
+        AND runs.next_ts - (runs.ts + runs.dur) BETWEEN 0 AND :max_gap_ns
+    GROUP BY 1, 2, 3, 4
+""")
+
+LONG_TASK_COMPETITION_SQL = """
+WITH {tasks}
+SELECT
+    tasks.task_ts,
+    tasks.task_utid,
+    process.name AS process_name,
+    thread.name AS thread_name,
+    SUM(MIN(sched_slice.ts + sched_slice.dur, tasks.end_ts) - MAX(sched_slice.ts, tasks.task_ts)) AS overlap_ns,
+    COUNT(DISTINCT sched_slice.cpu) AS cpu_count
+FROM tasks
+JOIN sched_slice ON sched_slice.dur > 0 AND sched_slice.ts < tasks.end_ts AND sched_slice.ts + sched_slice.dur > tasks.task_ts
+JOIN thread ON sched_slice.utid = thread.utid
+JOIN process ON thread.upid = process.upid
+WHERE sched_slice.utid != 0 AND sched_slice.utid != tasks.task_utid
+GROUP BY 1, 2, 3, 4
+"""
+
+def _is_trace_session(source):
+    return hasattr(source, "query_df")
+
+def _is_precomputed(source):
+    """True for sources carrying already merged aggregates, such as incremental_analysis.IncrementalState."""
+    return hasattr(source, "aggregates")
+
+def _sum_partials(partials, columns, keys):
+    """Combines per-chunk groupby sums into one DataFrame with `keys` as regular columns."""
+    if not partials:
+        return pd.DataFrame(columns=keys + columns)
+    return pd.concat(partials).groupby(keys, dropna=False, observed=True)[columns].sum().reset_index()
+
+def _has_rows(table):
+    return any(not chunk.empty for chunk in iter_chunks(table))
+
+def detect_topology(system_info_df, cpu_sched):
+    """Returns the CpuTopology of the traced device (see cpu_topology.py).
+
+    With a TraceSession the cpufreq counters are used when the metadata has no CPU frequencies.
+    """
+    if _is_precomputed(cpu_sched):
+        topology = cpu_sched.aggregates.get("topology")
+        return CpuTopology.from_dict(topology) if topology else CpuTopology.assumed()
+    return load_topology(system_info_df, cpu_sched if _is_trace_session(cpu_sched) else None)
+
+def core_placement_aggregate(cpu_sched, topology=None):
+    """Returns dur and slice_count of YouTube slices per (thread_name, core_type).
+
+    thread_name is only kept for CRITICAL_YOUTUBE_THREADS and is null for all other threads.
+    core_type is the cluster of the CPU in `topology` (the assumed topology when None).
+    """
+    topology = topology or CpuTopology.assumed()
+    if _is_precomputed(cpu_sched):
+        return cpu_sched.aggregates["core_placement"]
+    if _is_trace_session(cpu_sched):
+        sql = QueryTemplate(CORE_PLACEMENT_QUERY.format(cluster=topology.cluster_sql("sched_slice.cpu"))).bind(
+            critical_threads=CRITICAL_YOUTUBE_THREADS, process_name=YOUTUBE_PROCESS_NAME)
+        return cpu_sched.query_df(sql, label="core_placement aggregate")
+
+    partials = []
+    for chunk in iter_chunks(cpu_sched):
+        youtube_sched_df = chunk[name_mask(chunk["process_name"], YOUTUBE_PROCESS_NAME)]
+        if youtube_sched_df.empty:
+            continue
+        thread_name = youtube_sched_df["thread_name"]
+        partials.append(pd.DataFrame({
+            "thread_name": thread_name.where(name_mask(thread_name, CRITICAL_YOUTUBE_THREADS), None),
+            "core_type": topology.cluster_of(youtube_sched_df["cpu"]),
+            "dur": youtube_sched_df["dur"].to_numpy(),
+            "slice_count": 1,
+        }, index=youtube_sched_df.index))
+    return _sum_partials(partials, ["dur", "slice_count"], ["thread_name", "core_type"])
+
+def cluster_time_aggregate(cpu_sched, topology):
+    """Returns the CPU time of each process on each cluster of `topology` (process_name, cluster, dur); idle is left out."""
+    if _is_precomputed(cpu_sched):
+        return cpu_sched.aggregates["cluster_time"]
+    if _is_trace_session(cpu_sched):
+        return cpu_sched.query_df(CLUSTER_TIME_QUERY.format(cluster=topology.cluster_sql("sched_slice.cpu")), label="cluster_time aggregate")
+
+    partials = []
+    for chunk in iter_chunks(cpu_sched):
+        chunk = chunk[chunk["utid"] != 0]
+        if chunk.empty:
+            continue
+        partials.append(pd.DataFrame({
+            "process_name": chunk["process_name"].to_numpy(),
+            "cluster": topology.cluster_of(chunk["cpu"]),
+            "dur": chunk["dur"].to_numpy(),
+        }))
+    return _sum_partials(partials, ["dur"], ["process_name", "cluster"])
+
+def migrations_aggregate(cpu_sched, topology, last_cpu=None):
+    """Returns (migrations per thread, last CPU per utid).
+
+    A migration is a thread running on a different CPU than in its previous sched slice; a
+    cluster migration also changes cluster. The per-thread table has utid, process_name,
+    thread_name, slice_count, migrations and cluster_migrations. Chunks must come in ts order;
+    `last_cpu` (a Series indexed by utid) carries the CPU of each thread's previous slice over
+    from earlier data. For a TraceSession, the migrations are counted in SQL and no last CPUs
+    are returned.
+    """
+    keys = ["utid", "process_name", "thread_name"]
+    columns = ["slice_count", "migrations", "cluster_migrations"]
+    last_cpu = last_cpu if last_cpu is not None else pd.Series(dtype="int64")
+    if _is_precomputed(cpu_sched):
+        return cpu_sched.aggregates["thread_migrations"], last_cpu
+    if _is_trace_session(cpu_sched):
+        sql = MIGRATIONS_QUERY.format(cluster=topology.cluster_sql("cpu"), prev_cluster=topology.cluster_sql("prev_cpu"))
+        return cpu_sched.query_df(sql, label="migrations aggregate"), last_cpu
+
+    partials = []
+    for chunk in iter_chunks(cpu_sched):
+        chunk = chunk[chunk["utid"] != 0]
+        if chunk.empty:
+            continue
+        order = np.lexsort((chunk["ts"].to_numpy(), chunk["utid"].to_numpy()))
+        rows = chunk.iloc[order]
+        utid = rows["utid"].to_numpy()
+        cpu = rows["cpu"].to_numpy(dtype=np.int64)
+        first = np.append(True, utid[1:] != utid[:-1])
+        last = np.append(utid[1:] != utid[:-1], True)
+        prev_cpu = np.append(-1, cpu[:-1])
+        prev_cpu[first] = last_cpu.reindex(utid[first]).fillna(-1).to_numpy(dtype=np.int64)
+        migrated = (prev_cpu >= 0) & (prev_cpu != cpu)
+        cluster_changed = topology.cluster_of(prev_cpu).codes != topology.cluster_of(cpu).codes
+        partials.append(pd.DataFrame({
+            "utid": utid,
+            "process_name": rows["process_name"].to_numpy(),
+            "thread_name": rows["thread_name"].to_numpy(),
+            "slice_count": 1,
+            "migrations": migrated.astype(np.int64),
+            "cluster_migrations": (migrated & cluster_changed).astype(np.int64),
+        }))
+        last_cpu = pd.Series(cpu[last], index=utid[last]).combine_first(last_cpu).astype(np.int64)
+    return _sum_partials(partials, columns, keys), last_cpu
+
+def long_task_competition_aggregate(long_tasks_df, cpu_sched):
+    """Returns the CPU time other threads got while each long task ran.
+
+    One row per (task_ts, task_utid, process_name, thread_name) with overlap_ns and cpu_count;
+    tasks are identified by their ts and utid. The idle thread and the task's own thread are
+    left out. DataFrame and chunked sched data are searched with a SchedIndex per chunk.
+    """
+    keys = ["task_ts", "task_utid", "process_name", "thread_name"]
+    if _is_precomputed(cpu_sched):
+        return cpu_sched.aggregates["long_task_competition"]
+    if long_tasks_df.empty:
+        return pd.DataFrame(columns=keys + ["overlap_ns", "cpu_count"])
+    if _is_trace_session(cpu_sched):
+        tasks = values_table("tasks", ["task_ts", "end_ts", "task_utid"],
+                             zip(long_tasks_df["ts"].tolist(), (long_tasks_df["ts"] + long_tasks_df["dur"]).tolist(), long_tasks_df["utid"].tolist()))
+        return cpu_sched.query_df(LONG_TASK_COMPETITION_SQL.format(tasks=tasks), label="long_task_competition aggregate")
+
+    tasks = long_tasks_df[["ts", "dur", "utid"]].reset_index(drop=True)
+    partials = []
+    for chunk in iter_chunks(cpu_sched):
+        if chunk.empty:
+            continue
+        competing = competing_threads(SchedIndex(chunk[SLICE_COLUMNS]), tasks, per_cpu=True)
+        task = competing["task"].to_numpy()
+        partials.append(competing.assign(task_ts=tasks["ts"].to_numpy()[task], task_utid=tasks["utid"].to_numpy()[task]))
+    if not partials:
+        return pd.DataFrame(columns=keys + ["overlap_ns", "cpu_count"])
+    return pd.concat(partials).groupby(keys, observed=True, dropna=False).agg(overlap_ns=("overlap_ns", "sum"), cpu_count=("cpu", "nunique")).reset_index()
+
+def _long_task_competition_report(long_tasks_df, cpu_sched):
+    report = []
+    competition = long_task_competition_aggregate(long_tasks_df, cpu_sched)
+    longest = long_tasks_df.sort_values(["dur", "ts"], ascending=[False, True]).head(LONG_TASK_DETAIL_TOP_N)
+    report.append(f"  - Threads that ran on the CPUs during the {len(longest)} longest tasks (CPU time while the task ran):")
+    for _, task in longest.iterrows():
+        competing = competition[(competition["task_ts"] == task["ts"]) & (competition["task_utid"] == task["utid"])]
+        competing = competing.sort_values(["overlap_ns", "thread_name"], ascending=[False, True]).head(COMPETING_THREADS_TOP_N)
+        threads = ", ".join(f"**{row['process_name']}** / {row['thread_name']} ({row['overlap_ns'] / 1_000_000:.2f} ms on {row['cpu_count']} CPUs)"
+                            for _, row in competing.iterrows())
+        report.append(f"    - '{task['slice_name']}' ({task['dur'] / 1_000_000:.2f} ms): {threads or 'no other threads ran'}")
+    per_process = competition.groupby("process_name", observed=True)["overlap_ns"].sum().sort_values(ascending=False)
+    if not per_process.empty:
+        report.append("  - Processes taking the most CPU time during all long tasks: "
+                      + ", ".join(f"{process} ({ns / 1_000_000:.2f} ms)" for process, ns in per_process.head(COMPETING_THREADS_TOP_N).items()) + ".")
+    return report
+
+def _topology_note(topology):
+    if topology.source == "assumed":
+        return f"- Assuming LITTLE cores: {ASSUMED_LITTLE_CORES}, BIG cores: {ASSUMED_BIG_CORES} for this analysis. (Neither the trace metadata nor the cpufreq counters give the CPU frequencies.)"
+    source = "the trace metadata" if topology.source == "metadata" else "the cpufreq counters"
+    return f"- CPU clusters detected from {source}: {topology.describe()}."
+
+@traced("analyzer")
+def analyze_youtube_thread_core_placement(cpu_sched, system_info_df, topology=None):
     report = []
     report.append("## YouTube Thread CPU Core Placement Analysis")
-    
-    cpu_info = system_info_df[system_info_df["name"].str.contains("cpu[0-9]+_max_freq_khz", case=False, na=False)]
-    
-    report.append(f"- Assuming LITTLE cores: {ASSUMED_LITTLE_CORES}, BIG cores: {ASSUMED_BIG_CORES} for this analysis. (This should be verified with device specs or detailed trace metadata if possible).")
+    topology = topology or detect_topology(system_info_df, cpu_sched)
+    report.append(_topology_note(topology))
+
+    placement = core_placement_aggregate(cpu_sched, topology)
+    youtube_critical_sched = placement[placement["thread_name"].notna()]
 
-    youtube_sched_df = cpu_sched_df[cpu_sched_df["process_name"] == "com.google.android.youtube"].copy()
-    if youtube_sched_df.empty:
+    if placement["slice_count"].sum() == 0:
         report.append("- No CPU scheduling slices found for 'com.google.android.youtube'. Cannot analyze core placement.")
+    elif "LITTLE" not in topology.clusters:
+        report.append("- All CPUs have the same maximum frequency, so core placement does not matter on this device.")
+    elif youtube_critical_sched.empty:
+        report.append("- No scheduling data found for critical YouTube threads (main, RenderThread, GPU completion).")
     else:
-        youtube_sched_df["core_type"] = youtube_sched_df["cpu"].apply(lambda x: "LITTLE" if x in ASSUMED_LITTLE_CORES else ("BIG" if x in ASSUMED_BIG_CORES else "UNKNOWN"))
-        
-        critical_threads = ["com.google.android.youtube:main", "RenderThread", "GPU completion"]
-        youtube_critical_sched = youtube_sched_df[youtube_sched_df["thread_name"].isin(critical_threads)]
-        
-        if youtube_critical_sched.empty:
-            report.append("- No scheduling data found for critical YouTube threads (main, RenderThread, GPU completion).")
+        little_core_usage = youtube_critical_sched[youtube_critical_sched["core_type"] == "LITTLE"]
+        if not little_core_usage.empty:
+            total_dur_on_little = little_core_usage["dur"].sum()
+            total_dur_critical = youtube_critical_sched["dur"].sum()
+            percentage_on_little = (total_dur_on_little / total_dur_critical) * 100 if total_dur_critical > 0 else 0
+            report.append(f"- Critical YouTube threads spent **{percentage_on_little:.2f}%** of their CPU time on LITTLE cores ({total_dur_on_little / 1_000_000:.2f} ms out of {total_dur_critical / 1_000_000:.2f} ms).")
+            report.append("  - Running critical tasks on LITTLE cores can lead to slower performance and jank, especially if BIG cores were available.")
+            
+            main_thread_on_little = little_core_usage[little_core_usage["thread_name"] == "com.google.android.youtube:main"]
+            if not main_thread_on_little.empty:
+                # Corrected f-string (already correct in original, but good to double check)
+                report.append(f"    - Specifically, 'com.google.android.youtube:main' ran on LITTLE cores for {main_thread_on_little['dur'].sum() / 1_000_000:.2f} ms.")
         else:
-            little_core_usage = youtube_critical_sched[youtube_critical_sched["core_type"] == "LITTLE"]
-            if not little_core_usage.empty:
-                total_dur_on_little = little_core_usage["dur"].sum()
-                total_dur_critical = youtube_critical_sched["dur"].sum()
-                percentage_on_little = (total_dur_on_little / total_dur_critical) * 100 if total_dur_critical > 0 else 0
-                report.append(f"- Critical YouTube threads spent **{percentage_on_little:.2f}%** of their CPU time on assumed LITTLE cores ({total_dur_on_little / 1_000_000:.2f} ms out of {total_dur_critical / 1_000_000:.2f} ms).")
-                report.append("  - Running critical tasks on LITTLE cores can lead to slower performance and jank, especially if BIG cores were available.")
-                
-                main_thread_on_little = little_core_usage[little_core_usage["thread_name"] == "com.google.android.youtube:main"]
-                if not main_thread_on_little.empty:
-                    # Corrected f-string (already correct in original, but good to double check)
-                    report.append(f"    - Specifically, 'com.google.android.youtube:main' ran on LITTLE cores for {main_thread_on_little['dur'].sum() / 1_000_000:.2f} ms.")
-            else:
-                report.append("- Critical YouTube threads did not appear to run on assumed LITTLE cores.")
+            report.append("- Critical YouTube threads did not appear to run on LITTLE cores.")
     report.append("\n")
     return "\n".join(report)
 
-def analyze_cpu_spikes(cpu_sched_df):
+@traced("analyzer")
+def analyze_cluster_utilization(cpu_sched, system_info_df, topology=None, cpu_time=None):
+    report = []
+    report.append("## CPU Cluster Utilization Analysis")
+    topology = topology or detect_topology(system_info_df, cpu_sched)
+    cluster_time = cluster_time_aggregate(cpu_sched, topology)
+    _, bounds = cpu_time or cpu_time_aggregate(cpu_sched)
+
+    if bounds["slice_count"] == 0 or cluster_time.empty:
+        report.append("- CPU scheduling data is empty. Cannot analyze cluster utilization.")
+    else:
+        total_trace_duration_ns = bounds["max_ts"] + bounds["dur_at_max_ts"] - bounds["min_ts"]
+        per_cluster = cluster_time.groupby("cluster", observed=True)["dur"].sum()
+        for cluster in topology.categories:
+            busy_ns = per_cluster.get(cluster, 0)
+            cpus = topology.cpus(cluster)
+            if cluster == UNKNOWN_CLUSTER:
+                if busy_ns > 0:
+                    report.append(f"- {busy_ns / 1_000_000:.2f} ms ran on CPUs outside the detected clusters.")
+                continue
+            utilization = busy_ns / (len(cpus) * total_trace_duration_ns) * 100 if total_trace_duration_ns > 0 else 0
+            top = cluster_time[cluster_time["cluster"] == cluster].nlargest(3, "dur")
+            top_text = ", ".join(f"{row['process_name']} ({row['dur'] / 1_000_000:.2f} ms)" for _, row in top.iterrows())
+            report.append(f"- **{cluster}** (CPUs {cpus}): {utilization:.1f}% busy, {busy_ns / 1_000_000:.2f} ms of CPU time." + (f" Top processes: {top_text}." if top_text else ""))
+    report.append("\n")
+    return "\n".join(report)
+
+@traced("analyzer")
+def analyze_core_migrations(cpu_sched, system_info_df, topology=None):
+    report = []
+    report.append("## Thread Core Migration Analysis")
+    topology = topology or detect_topology(system_info_df, cpu_sched)
+    migrations, _ = migrations_aggregate(cpu_sched, topology)
+    migrations = migrations[migrations["migrations"] > 0]
+
+    if migrations.empty:
+        report.append("- No thread moved between CPUs (or CPU scheduling data is empty).")
+    else:
+        report.append(f"- {int(migrations['migrations'].sum())} CPU migrations across {len(migrations)} threads, {int(migrations['cluster_migrations'].sum())} of them between clusters.")
+        report.append(f"- Threads migrating most often (top {MIGRATION_TOP_N}):")
+        top = migrations.sort_values(["migrations", "slice_count"], ascending=[False, False]).head(MIGRATION_TOP_N)
+        for _, row in top.iterrows():
+            report.append(f"  - **{row['process_name']}** / {row['thread_name']}: {int(row['migrations'])} migrations in {int(row['slice_count'])} runs ({int(row['cluster_migrations'])} between clusters)")
+        report.append("  - Frequent migrations cost cache locality, and moves between clusters also change the available CPU performance.")
+    report.append("\n")
+    return "\n".join(report)
+
+def cpu_time_aggregate(cpu_sched):
+    """Returns (total dur per process_name, sched bounds).
+
+    The bounds are a dict with slice_count, min_ts, max_ts and dur_at_max_ts (dur of the slice starting last).
+    """
+    if _is_precomputed(cpu_sched):
+        return cpu_sched.aggregates["cpu_time"], dict(cpu_sched.aggregates["sched_bounds"])
+    if _is_trace_session(cpu_sched):
+        per_process = cpu_sched.query_df(f"""
+            SELECT process.name AS process_name, SUM(sched_slice.dur) AS dur
+            {SCHED_JOIN_SQL}
+            WHERE process.name IS NOT NULL
+            GROUP BY process.name
+        """, label="cpu_time aggregate")
+        bounds = cpu_sched.query_df(f"""
+            SELECT
+                COUNT(*) AS slice_count,
+                MIN(sched_slice.ts) AS min_ts,
+                MAX(sched_slice.ts) AS max_ts,
+                (SELECT sched_slice.dur {SCHED_JOIN_SQL} ORDER BY sched_slice.ts DESC LIMIT 1) AS dur_at_max_ts
+            {SCHED_JOIN_SQL}
+        """, label="sched bounds aggregate").iloc[0].to_dict()
+        return per_process, bounds
+
+    partials = []
+    bounds = {"slice_count": 0, "min_ts": None, "max_ts": None, "dur_at_max_ts": 0}
+    for chunk in iter_chunks(cpu_sched):
+        if chunk.empty:
+            continue
+        bounds["slice_count"] += len(chunk)
+        partials.append(chunk.groupby("process_name", observed=True)["dur"].sum().reset_index())
+        chunk_min_ts = chunk["ts"].min()
+        chunk_max_ts = chunk["ts"].max()
+        if bounds["min_ts"] is None or chunk_min_ts < bounds["min_ts"]:
+            bounds["min_ts"] = chunk_min_ts
+        if bounds["max_ts"] is None or chunk_max_ts > bounds["max_ts"]:
+            bounds["max_ts"] = chunk_max_ts
+            bounds["dur_at_max_ts"] = chunk.loc[chunk["ts"].idxmax()]["dur"]
+    return _sum_partials(partials, ["dur"], ["process_name"]), bounds
+
+def window_busy_aggregate(cpu_sched, origin_ts, bucket_ns=None):
+    """Returns busy time per (process_name, bucket) and per (cpu, bucket) as (key, window, busy_ns) tables.
+
+    Buckets are `bucket_ns` (by default CPU_SPIKE_SLIDE_MS) long and counted from origin_ts;
+    slices crossing a bucket boundary are split between buckets. Idle (utid 0) slices are not
+    counted. Precomputed sources only hold the default buckets.
+    """
+    default_bucket_ns = CPU_SPIKE_SLIDE_MS * 1_000_000
+    bucket_ns = bucket_ns or default_bucket_ns
+    if _is_precomputed(cpu_sched):
+        if bucket_ns != default_bucket_ns:
+            raise ValueError(f"Precomputed busy time is only available in {CPU_SPIKE_SLIDE_MS} ms buckets")
+        return cpu_sched.aggregates["process_busy"], cpu_sched.aggregates["cpu_busy"]
+    if _is_trace_session(cpu_sched):
+        # Slices inside a single bucket are summed by trace processor; only the few slices
+        # crossing a bucket boundary are transferred and split in Python.
+        inside = {key: cpu_sched.query_df(query.bind(origin_ts=origin_ts, bucket_ns=bucket_ns), label=f"{key} bucket busy aggregate")
+                  for key, query in BUCKET_BUSY_QUERIES.items()}
+        crossing = cpu_sched.query_df(BUCKET_CROSSING_QUERY.bind(origin_ts=origin_ts, bucket_ns=bucket_ns), label="bucket crossing slices")
+        process_busy = combine_busy_time([inside["process"], busy_time_per_window(crossing["ts"], crossing["dur"], crossing["process_name"], bucket_ns, origin_ts)])
+        cpu_busy = combine_busy_time([inside["cpu"], busy_time_per_window(crossing["ts"], crossing["dur"], crossing["cpu"], bucket_ns, origin_ts)])
+        return process_busy, cpu_busy
+
+    process_partials = []
+    cpu_partials = []
+    for chunk in iter_chunks(cpu_sched):
+        busy = chunk[chunk["utid"] != 0]
+        process_partials.append(busy_time_per_window(busy["ts"], busy["dur"], busy["process_name"], bucket_ns, origin_ts))
+        cpu_partials.append(busy_time_per_window(busy["ts"], busy["dur"], busy["cpu"], bucket_ns, origin_ts))
+    return combine_busy_time(process_partials), combine_busy_time(cpu_partials)
+
+def _window_spike_report(cpu_sched, origin_ts, total_trace_duration_ns):
+    report = []
+    window_ns = CPU_SPIKE_WINDOW_MS * 1_000_000
+    window_buckets = max(1, CPU_SPIKE_WINDOW_MS // CPU_SPIKE_SLIDE_MS)
+    process_busy, cpu_busy = window_busy_aggregate(cpu_sched, origin_ts)
+    process_windows = sliding_busy_time(process_busy, window_buckets)
+    cpu_windows = sliding_busy_time(cpu_busy, window_buckets)
+    window_desc = f"{CPU_SPIKE_WINDOW_MS} ms window (windows sliding by {CPU_SPIKE_SLIDE_MS} ms)"
+
+    spikes = process_windows[process_windows["busy_ns"] > CPU_SPIKE_PROCESS_THRESHOLD_MS * 1_000_000].sort_values(["busy_ns", "window"], ascending=[False, True])
+    if spikes.empty:
+        report.append(f"- No process used more than {CPU_SPIKE_PROCESS_THRESHOLD_MS} ms of CPU time within any {window_desc}.")
+    else:
+        report.append(f"- Found **{len(spikes)} CPU spike windows** in {spikes['key'].nunique()} processes, where a process used more than {CPU_SPIKE_PROCESS_THRESHOLD_MS} ms of CPU time within a {window_desc}. Largest spikes:")
+        for _, row in spikes.head(5).iterrows():
+            report.append(f"  - **{row['key']}**: {row['busy_ns'] / 1_000_000:.2f} ms of CPU time ({row['busy_ns'] / window_ns * 100:.0f}% of one CPU) in the window starting at +{row['window'] * CPU_SPIKE_SLIDE_MS} ms.")
+        spike_windows_per_process = spikes.groupby("key", observed=True).size().sort_values(ascending=False)
+        report.append("  - Processes with the most spike windows: " + ", ".join(f"{process} ({count})" for process, count in spike_windows_per_process.head(5).items()) + ".")
+
+    if not cpu_windows.empty:
+        report.append(f"- Per-CPU utilization (mean over the trace / peak {CPU_SPIKE_WINDOW_MS} ms window):")
+        cpu_total = cpu_busy.groupby("key")["busy_ns"].sum()
+        peaks = cpu_windows.sort_values(["busy_ns", "window"], ascending=[False, True]).drop_duplicates("key").set_index("key").sort_index()
+        for cpu, peak in peaks.iterrows():
+            mean_utilization = cpu_total[cpu] / total_trace_duration_ns * 100 if total_trace_duration_ns > 0 else 0
+            report.append(f"  - CPU {cpu}: mean {mean_utilization:.1f}%, peak {min(peak['busy_ns'] / window_ns, 1) * 100:.1f}% at +{peak['window'] * CPU_SPIKE_SLIDE_MS} ms")
+        system_windows = cpu_windows.groupby("window")["busy_ns"].sum()
+        cpu_count = len(peaks)
+        report.append(f"- Peak system-wide utilization: {system_windows.max() / (cpu_count * window_ns) * 100:.1f}% of {cpu_count} CPUs in the window starting at +{system_windows.idxmax() * CPU_SPIKE_SLIDE_MS} ms.")
+    return report
+
+@traced("analyzer")
+def analyze_cpu_spikes(cpu_sched, cpu_time=None):
     report = []
     report.append("## CPU Spikes Analysis")
-    if cpu_sched_df.empty:
+    per_process, bounds = cpu_time or cpu_time_aggregate(cpu_sched)
+
+    if bounds["slice_count"] == 0:
         report.append("- CPU scheduling data is empty. Cannot analyze CPU spikes.")
     else:
-        total_cpu_time_per_process = cpu_sched_df.groupby("process_name")["dur"].sum().sort_values(ascending=False)
-        # Ensure 'ts' and 'dur' columns exist before using them for total_trace_duration_ns calculation
-        if 'ts' in cpu_sched_df.columns and 'dur' in cpu_sched_df.columns and not cpu_sched_df.empty:
-            total_trace_duration_ns = cpu_sched_df["ts"].max() + cpu_sched_df.loc[cpu_sched_df["ts"].idxmax()]["dur"] - cpu_sched_df["ts"].min()
-            total_trace_duration_ms = total_trace_duration_ns / 1_000_000
-            report.append(f"- Overall trace duration considered for CPU usage: {total_trace_duration_ms:.2f} ms.")
-        else:
-            report.append("- Could not determine total trace duration from sched_slice data (missing 'ts' or 'dur' columns, or data is empty).")
-            total_trace_duration_ns = 0 # Avoid further errors
+        total_cpu_time_per_process = per_process.set_index("process_name")["dur"].sort_values(ascending=False)
+        total_trace_duration_ns = bounds["max_ts"] + bounds["dur_at_max_ts"] - bounds["min_ts"]
+        total_trace_duration_ms = total_trace_duration_ns / 1_000_000
+        report.append(f"- Overall trace duration considered for CPU usage: {total_trace_duration_ms:.2f} ms.")
 
         report.append("- Top 5 CPU consuming processes (total duration):")
         for process, dur_ns in total_cpu_time_per_process.head(5).items():
             report.append(f"  - **{process}**: {dur_ns / 1_000_000:.2f} ms")
         
-        youtube_cpu_time_ns = total_cpu_time_per_process.get("com.google.android.youtube", 0)
+        youtube_cpu_time_ns = total_cpu_time_per_process.get(YOUTUBE_PROCESS_NAME, 0)
         if youtube_cpu_time_ns > 0:
             report.append(f"- 'com.google.android.youtube' consumed {youtube_cpu_time_ns / 1_000_000:.2f} ms of CPU time in total.")
         else:
             report.append("- 'com.google.android.youtube' process not found or had no CPU time in sched_slice data.")
-        report.append("- Note: A more detailed spike analysis would involve windowing and looking for sudden bursts of activity.")
+        report.extend(_window_spike_report(cpu_sched, bounds["min_ts"], total_trace_duration_ns))
     report.append("\n")
     return "\n".join(report)
 
-def analyze_short_runs_sleeps(cpu_sched_df, thread_states_df):
+def short_runs_aggregate(cpu_sched, thread_states, count_threshold=None):
+    """Returns (short_run_count per (process_name, thread_name) above `count_threshold`, has_data).
+
+    count_threshold defaults to FREQUENT_SHORT_RUN_COUNT_THRESHOLD. has_data is False when
+    either the sched or the thread state data is empty.
+    """
+    count_threshold = FREQUENT_SHORT_RUN_COUNT_THRESHOLD if count_threshold is None else count_threshold
+    if _is_precomputed(cpu_sched):
+        counts = cpu_sched.aggregates["short_runs"]
+        counts = counts[counts["short_run_count"] > count_threshold].sort_values(["process_name", "thread_name"])
+        return counts, cpu_sched.aggregates["flags"]["has_sched"] and cpu_sched.aggregates["flags"]["has_thread_states"]
+    if _is_trace_session(cpu_sched):
+        sql = SHORT_RUNS_QUERY.bind(short_run_threshold_ns=SHORT_RUN_THRESHOLD_NS, count_threshold=count_threshold)
+        counts = cpu_sched.query_df(sql, label="short_runs aggregate")
+        presence = cpu_sched.query_df(f"""
+            SELECT
+                EXISTS(SELECT 1 {SCHED_JOIN_SQL}) AS has_sched,
+                EXISTS(SELECT 1 FROM thread_state JOIN thread ON thread_state.utid = thread.utid JOIN process ON thread.upid = process.upid) AS has_thread_states
+        """, label="short_runs presence")
+        has_data = bool(presence["has_sched"].iloc[0]) and bool(presence["has_thread_states"].iloc[0])
+        return counts, has_data
+
+    slice_count = 0
+    partials = []
+    for chunk in iter_chunks(cpu_sched):
+        slice_count += len(chunk)
+        short_runs = chunk[chunk["dur"] < SHORT_RUN_THRESHOLD_NS]
+        partials.append(short_runs.groupby(["process_name", "thread_name"], observed=True)["utid"].count().reset_index(name="short_run_count"))
+    counts = _sum_partials(partials, ["short_run_count"], ["process_name", "thread_name"]).dropna(subset=["process_name", "thread_name"])
+    counts = counts[counts["short_run_count"] > count_threshold].sort_values(["process_name", "thread_name"])
+    return counts, slice_count > 0 and _has_rows(thread_states)
+
+def _has_column(table, column):
+    for chunk in iter_chunks(table):
+        return column in chunk.columns
+    return False
+
+def _iter_next_states(thread_states):
+    """Yields the non-Running thread states chunk by chunk as (utid, state_ts, state, blocked_function)."""
+    for chunk in iter_chunks(thread_states):
+        states = chunk[~name_mask(chunk["state"], "Running")]
+        yield pd.DataFrame({
+            "utid": states["utid"].to_numpy(),
+            "state_ts": states["ts"].to_numpy(),
+            "state": states["state"].astype(object).to_numpy(),
+            "blocked_function": states["blocked_function"].astype(object).to_numpy() if "blocked_function" in states.columns else None,
+        })
+
+def run_sleep_aggregate(cpu_sched, thread_states):
+    """Counts short runs by the thread state that follows them.
+
+    Returns (transitions, has_states): transitions has one row per (process_name, thread_name,
+    state, blocked_function) with the number of short runs (< SHORT_RUN_THRESHOLD_NS) after which
+    the thread entered that state. has_states is False when the thread state data has no state column.
+    """
+    if _is_precomputed(cpu_sched):
+        return cpu_sched.aggregates["run_sleep"], cpu_sched.aggregates["flags"]["has_states"]
+    if _is_trace_session(cpu_sched):
+        sql = RUN_SLEEP_QUERY.bind(short_run_threshold_ns=SHORT_RUN_THRESHOLD_NS, max_gap_ns=RUN_SLEEP_MAX_GAP_NS)
+        transitions = cpu_sched.query_df(sql, label="run_sleep aggregate")
+        return transitions, True
+
+    keys = ["process_name", "thread_name", "state", "blocked_function"]
+    if not _has_column(thread_states, "state"):
+        return pd.DataFrame(columns=keys + ["run_count"]), False
+
+    # Both inputs are ordered by ts, so the thread states are read alongside the sched
+    # chunks: a buffer holds the states from the start of the current sched chunk up to
+    # just past the end of its last run, and each run is matched to the first later
+    # state of the same utid with a vectorized merge_asof.
+    states_iter = _iter_next_states(thread_states)
+    buffer = pd.DataFrame({"utid": pd.Series(dtype="int64"), "state_ts": pd.Series(dtype="int64"), "state": pd.Series(dtype=object), "blocked_function": pd.Series(dtype=object)})
+    read_until = None
+    exhausted = False
+    partials = []
+    for chunk in iter_chunks(cpu_sched):
+        runs = chunk[(chunk["dur"] < SHORT_RUN_THRESHOLD_NS) & (chunk["utid"] != 0)]
+        if runs.empty:
+            continue
+        runs = pd.DataFrame({
+            "process_name": runs["process_name"],
+            "thread_name": runs["thread_name"],
+            "utid": runs["utid"].astype("int64"),
+            "end_ts": (runs["ts"] + runs["dur"]).astype("int64"),
+        }).sort_values("end_ts")
+        horizon = runs["end_ts"].iloc[-1] + RUN_SLEEP_MAX_GAP_NS
+        buffered = [buffer]
+        while not exhausted and (read_until is None or read_until < horizon):
+            states = next(states_iter, None)
+            if states is None:
+                exhausted = True
+            elif not states.empty:
+                buffered.append(states)
+                read_until = states["state_ts"].max()
+        buffer = pd.concat(buffered).astype({"utid": "int64", "state_ts": "int64"}).sort_values("state_ts", kind="stable")
+
+        matched = pd.merge_asof(runs, buffer, left_on="end_ts", right_on="state_ts", by="utid",
+                                direction="forward", tolerance=RUN_SLEEP_MAX_GAP_NS).dropna(subset=["state"])
+        partials.append(matched.groupby(keys, dropna=False, observed=True).size().reset_index(name="run_count"))
+        # Later chunks only hold runs starting (and so ending) after this chunk's last run started
+        buffer = buffer[buffer["state_ts"] >= chunk["ts"].max()]
+    return _sum_partials(partials, ["run_count"], keys), True
+
+def _run_sleep_report(cpu_sched, thread_states, frequent_short_runners):
+    report = []
+    transitions, has_states = run_sleep_aggregate(cpu_sched, thread_states)
+    if not has_states:
+        for _, row in frequent_short_runners.iterrows():
+            report.append(f"  - Process: **{row['process_name']}**, Thread: **{row['thread_name']}** - Short Run Count: {row['short_run_count']}")
+        report.append("- The thread state data has no state column, so the states following short runs could not be checked.")
+        return report
+
+    transitions = transitions.dropna(subset=["process_name", "thread_name"])
+    transitions["kind"] = np.where(transitions["state"].isin(UNINTERRUPTIBLE_SLEEP_STATES), "run_d",
+                                   np.where(transitions["state"].isin(SLEEP_STATES), "run_s", "other"))
+    per_thread = transitions.pivot_table(index=["process_name", "thread_name"], columns="kind", values="run_count", aggfunc="sum", fill_value=0)
+    per_thread = per_thread.reindex(columns=["run_s", "run_d", "other"], fill_value=0)
+
+    for _, row in frequent_short_runners.iterrows():
+        key = (row["process_name"], row["thread_name"])
+        run_s, run_d = (per_thread.loc[key, "run_s"], per_thread.loc[key, "run_d"]) if key in per_thread.index else (0, 0)
+        report.append(f"  - Process: **{row['process_name']}**, Thread: **{row['thread_name']}** - Short Run Count: {row['short_run_count']} "
+                      f"(followed by sleeping (S): {run_s / row['short_run_count'] * 100:.0f}%, uninterruptible sleep (D): {run_d / row['short_run_count'] * 100:.0f}%)")
+
+    sleepers = per_thread[per_thread["run_s"] + per_thread["run_d"] > FREQUENT_SHORT_RUN_COUNT_THRESHOLD]
+    sleepers = sleepers.assign(sleeps=sleepers["run_s"] + sleepers["run_d"]).sort_values(["sleeps", "run_d"], ascending=False)
+    if sleepers.empty:
+        report.append(f"- No thread went to sleep after more than {FREQUENT_SHORT_RUN_COUNT_THRESHOLD} of its short runs.")
+    else:
+        report.append(f"- Threads with more than {FREQUENT_SHORT_RUN_COUNT_THRESHOLD} run→sleep sequences (a short run immediately followed by S or D):")
+        for (process_name, thread_name), row in sleepers.head(RUN_SLEEP_TOP_N).iterrows():
+            report.append(f"  - Process: **{process_name}**, Thread: **{thread_name}** - run→S: {row['run_s']}, run→D: {row['run_d']}")
+
+    blocked = transitions[transitions["kind"] == "run_d"]
+    if blocked.empty:
+        report.append("- No short runs were followed by uninterruptible sleep (D).")
+    else:
+        blocked = blocked.assign(blocked_function=blocked["blocked_function"].fillna("(unknown)"))
+        functions = blocked.groupby("blocked_function").agg(run_count=("run_count", "sum"), thread_count=("thread_name", "nunique")).sort_values("run_count", ascending=False)
+        report.append(f"- Kernel functions threads blocked in after a short run (run→D, {functions['run_count'].sum()} sequences):")
+        for function, row in functions.head(RUN_SLEEP_TOP_N).iterrows():
+            top_threads = blocked[blocked["blocked_function"] == function].sort_values("run_count", ascending=False)["thread_name"].head(3)
+            report.append(f"  - `{function}`: {row['run_count']} times in {row['thread_count']} threads (e.g. {', '.join(top_threads)})")
+    return report
+
+@traced("analyzer")
+def analyze_short_runs_sleeps(cpu_sched, thread_states, short_runs=None):
     report = []
     report.append("## Frequent Short Runs Followed by Sleep Analysis (Potential I/O or Lock Contention)")
-    if cpu_sched_df.empty or thread_states_df.empty:
+    frequent_short_runners, has_data = short_runs or short_runs_aggregate(cpu_sched, thread_states)
+    if not has_data:
         report.append("- CPU scheduling or thread state data is empty. Cannot perform this analysis.")
     else:
-        short_runs = cpu_sched_df[cpu_sched_df["dur"] < SHORT_RUN_THRESHOLD_NS]
-        frequent_short_runners = short_runs.groupby(["process_name", "thread_name"])["utid"].count().reset_index(name="short_run_count")
-        frequent_short_runners = frequent_short_runners[frequent_short_runners["short_run_count"] > FREQUENT_SHORT_RUN_COUNT_THRESHOLD]
-        
         if frequent_short_runners.empty:
             report.append(f"- No threads found with more than {FREQUENT_SHORT_RUN_COUNT_THRESHOLD} short CPU runs (less than {SHORT_RUN_THRESHOLD_NS / 1_000_000}ms each).")
         else:
             report.append(f"- Identified threads with frequent short CPU runs (>{FREQUENT_SHORT_RUN_COUNT_THRESHOLD} instances, each <{SHORT_RUN_THRESHOLD_NS / 1_000_000}ms), which *might* indicate I/O waits or lock contention if followed by sleep states:")
-            for _, row in frequent_short_runners.iterrows():
-                # Corrected f-string (already correct in original, but good to double check)
-                report.append(f"  - Process: **{row['process_name']}**, Thread: **{row['thread_name']}** - Short Run Count: {row['short_run_count']}")
-            report.append("  - Deeper analysis is needed to confirm if these short runs are consistently followed by sleep states indicative of I/O or lock waits.")
+        report.extend(_run_sleep_report(cpu_sched, thread_states, frequent_short_runners))
     report.append("\n")
     return "\n".join(report)
 
-def main(system_info_path, cpu_sched_path, long_tasks_path, yt_thread_states_path, thread_states_path, output_report_path):
+SYSTEM_INFO_COLUMNS = ['name', 'int_value', 'str_value']
+CPU_SCHED_COLUMNS = ['process_name', 'thread_name', 'cpu', 'ts', 'dur', 'utid']
+LONG_TASKS_COLUMNS = ['slice_name', 'thread_name', 'process_name', 'ts', 'dur', 'utid', 'upid']
+YT_THREAD_STATES_COLUMNS = ['thread_name', 'total_running_ns', 'total_runnable_ns', 'total_sleeping_ns', 'total_interruptible_sleep_ns', 'total_uninterruptible_sleep_ns', 'total_stopped_ns', 'total_parked_ns', 'runnable_plus_running_ns', 'runnable_ratio']
+THREAD_STATES_COLUMNS = ['utid', 'thread_name', 'process_name', 'ts', 'dur', 'state', 'blocked_function']
+
+def load_input(source, columns, chunked=False):
+    """Returns `source` as a compact DataFrame (see trace_model.py); paths are read with only `columns` loaded.
+
+    Paths may be CSV, Parquet or Arrow files (see table_io.py). None and empty CSV files become
+    empty DataFrames with `columns`, to prevent downstream errors. With `chunked`, a chunk
+    directory written by the extractors is returned as a ChunkedTable instead of being loaded.
+    """
+    if isinstance(source, pd.DataFrame):
+        return compact_table(source)
+    if isinstance(source, ChunkedTable) or _is_trace_session(source) or _is_precomputed(source):
+        return source
+    # Column stores are memory-mapped as a whole rather than streamed
+    if chunked and source is not None and os.path.isdir(source) and not is_column_store(source):
+        return ChunkedTable(source, columns=columns, transform=compact_table)
+    if source is None:
+        return pd.DataFrame(columns=columns)
     try:
-        system_info_df = pd.read_csv(system_info_path)
-        cpu_sched_df = pd.read_csv(cpu_sched_path)
-        long_tasks_df = pd.read_csv(long_tasks_path)
-        yt_thread_states_df = pd.read_csv(yt_thread_states_path)
-        thread_states_df = pd.read_csv(thread_states_path)
+        return compact_table(read_table(source, columns=columns))
     except FileNotFoundError as e:
         print(f"Error: Input file not found: {e.filename}")
         sys.exit(1)
-    except pd.errors.EmptyDataError as e:
-        print(f"Error: Input file is empty: {e.filename if hasattr(e, 'filename') else 'Unknown file'}")
-        # Initialize empty DataFrames with expected columns if any are empty, to prevent downstream errors
-        if 'system_info_df' not in locals() or system_info_df.empty: system_info_df = pd.DataFrame(columns=['name', 'int_value', 'str_value'])
-        if 'cpu_sched_df' not in locals() or cpu_sched_df.empty: cpu_sched_df = pd.DataFrame(columns=['process_name', 'thread_name', 'cpu', 'ts', 'dur', 'utid'])
-        if 'long_tasks_df' not in locals() or long_tasks_df.empty: long_tasks_df = pd.DataFrame(columns=['slice_name', 'thread_name', 'process_name', 'ts', 'dur', 'utid', 'upid'])
-        if 'yt_thread_states_df' not in locals() or yt_thread_states_df.empty: yt_thread_states_df = pd.DataFrame(columns=['thread_name', 'total_running_ns', 'total_runnable_ns', 'total_sleeping_ns', 'total_interruptible_sleep_ns', 'total_uninterruptible_sleep_ns', 'total_stopped_ns', 'total_parked_ns', 'runnable_plus_running_ns', 'runnable_ratio'])
-        if 'thread_states_df' not in locals() or thread_states_df.empty: thread_states_df = pd.DataFrame(columns=['utid', 'thread_name', 'process_name', 'ts', 'dur', 'state', 'blocked_function'])
-        # pass # Or initialize empty DFs: e.g., if 'long_tasks_path' is empty, long_tasks_df = pd.DataFrame()
-
-    # Ensure DataFrames are initialized even if some files were empty and caught by EmptyDataError
-    if 'system_info_df' not in locals(): system_info_df = pd.DataFrame(columns=['name', 'int_value', 'str_value'])
-    if 'cpu_sched_df' not in locals(): cpu_sched_df = pd.DataFrame(columns=['process_name', 'thread_name', 'cpu', 'ts', 'dur', 'utid'])
-    if 'long_tasks_df' not in locals(): long_tasks_df = pd.DataFrame(columns=['slice_name', 'thread_name', 'process_name', 'ts', 'dur', 'utid', 'upid'])
-    if 'yt_thread_states_df' not in locals(): yt_thread_states_df = pd.DataFrame(columns=['thread_name', 'total_running_ns', 'total_runnable_ns', 'total_sleeping_ns', 'total_interruptible_sleep_ns', 'total_uninterruptible_sleep_ns', 'total_stopped_ns', 'total_parked_ns', 'runnable_plus_running_ns', 'runnable_ratio'])
-    if 'thread_states_df' not in locals(): thread_states_df = pd.DataFrame(columns=['utid', 'thread_name', 'process_name', 'ts', 'dur', 'state', 'blocked_function'])
+    except pd.errors.EmptyDataError:
+        print(f"Error: Input file is empty: {source}")
+        return pd.DataFrame(columns=columns)
+
+def build_report(system_info_df, cpu_sched, long_tasks_df, yt_thread_states_df, thread_states):
+    return build_report_and_aggregates(system_info_df, cpu_sched, long_tasks_df, yt_thread_states_df, thread_states)[0]
+
+def build_report_and_aggregates(system_info_df, cpu_sched, long_tasks_df, yt_thread_states_df, thread_states):
+    """Returns (report, aggregates). The aggregates used by several analyzers are computed once.
 
+    aggregates has "cpu_time", the result of cpu_time_aggregate, and "short_runs", the result
+    of short_runs_aggregate, so callers can reuse them instead of recomputing them.
+    """
+    aggregates = {
+        "cpu_time": cpu_time_aggregate(cpu_sched),
+        "short_runs": short_runs_aggregate(cpu_sched, thread_states),
+    }
     full_report = "# Performance Anomalies Report\n\n"
     full_report += "This report summarizes potential performance anomalies identified from the extracted Perfetto trace data.\n\n"
 
     full_report += analyze_perf_samples_skipped(system_info_df)
-    full_report += analyze_long_main_thread_tasks(long_tasks_df, "com.google.android.youtube", "com.google.android.youtube:main")
+    full_report += analyze_long_main_thread_tasks(long_tasks_df, "com.google.android.youtube", "com.google.android.youtube:main", cpu_sched)
     full_report += analyze_high_runnable_time(yt_thread_states_df)
-    full_report += analyze_youtube_thread_core_placement(cpu_sched_df, system_info_df)
-    full_report += analyze_cpu_spikes(cpu_sched_df)
-    full_report += analyze_short_runs_sleeps(cpu_sched_df, thread_states_df)
+    with span("detect_topology", "analyzer"):
+        topology = detect_topology(system_info_df, cpu_sched)
+    full_report += analyze_youtube_thread_core_placement(cpu_sched, system_info_df, topology)
+    full_report += analyze_cluster_utilization(cpu_sched, system_info_df, topology, aggregates["cpu_time"])
+    full_report += analyze_core_migrations(cpu_sched, system_info_df, topology)
+    full_report += analyze_cpu_spikes(cpu_sched, aggregates["cpu_time"])
+    full_report += analyze_short_runs_sleeps(cpu_sched, thread_states, aggregates["short_runs"])
+
+    return full_report, aggregates
+
+def main(system_info, cpu_sched, long_tasks, yt_thread_states, thread_states, output_report_path):
+    """Writes the anomalies report. Each input is either a table path (CSV/Parquet/Arrow) or an already extracted DataFrame.
+
+    cpu_sched and thread_states may also be chunk directories written by the extractors'
+    chunked mode; those are streamed one chunk at a time. Passing a TraceSession for both
+    runs the sched-based analyses as SQL aggregations against the loaded trace instead.
+    Returns the aggregates of build_report_and_aggregates.
+    """
+    system_info_df = load_input(system_info, SYSTEM_INFO_COLUMNS)
+    cpu_sched_table = load_input(cpu_sched, CPU_SCHED_COLUMNS, chunked=True)
+    long_tasks_df = load_input(long_tasks, LONG_TASKS_COLUMNS)
+    yt_thread_states_df = load_input(yt_thread_states, YT_THREAD_STATES_COLUMNS)
+    thread_states_table = load_input(thread_states, THREAD_STATES_COLUMNS, chunked=True)
+
+    full_report, aggregates = build_report_and_aggregates(system_info_df, cpu_sched_table, long_tasks_df, yt_thread_states_df, thread_states_table)
 
     try:
-        with open(output_report_path, "w") as f:
-            f.write(full_report)
+        with span(os.path.basename(output_report_path), "serialization", path=output_report_path, mode="write"):
+            with open(output_report_path, "w") as f:
+                f.write(full_report)
         print(f"Performance anomalies report saved to {output_report_path}")
     except IOError as e:
         print(f"Error writing report to file: {e}")
         sys.exit(1)
+    return aggregates
 
 if __name__ == "__main__":
     if len(sys.argv) != 7:
-        print("Usage: python identify_performance_anomalies.py <system_info_csv> <cpu_sched_csv> <long_tasks_csv> <yt_thread_states_csv> <thread_states_csv> <output_report_md>")
+        print("Usage: python identify_performance_anomalies.py <system_info_table> <cpu_sched_table> <long_tasks_table> <yt_thread_states_table> <thread_states_table> <output_report_md>")
         sys.exit(1)
     
     main(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5], sys.argv[6])
-
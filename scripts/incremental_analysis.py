@@ -0,0 +1,345 @@
+from trace_session import TraceSession
+from table_io import read_table, write_table
+from extract_metadata import extract_system_info
+from extract_cpu_usage import CPU_SCHED_QUERY_TEMPLATE
+from extract_thread_states import THREAD_STATES_QUERY_TEMPLATE, THREAD_STATES_CHUNK_QUERY
+from extract_long_tasks import extract_long_tasks_batch, LONG_TASKS_COLUMNS
+from extract_process_thread_states import pivot_state_totals, RUNNING_STATE
+from extract_youtube_thread_cpu_states import YOUTUBE_THREAD_STATES_COLUMNS
+from query_builder import QueryTemplate
+from trace_model import compact_table
+from cpu_topology import CpuTopology
+from window_utilization import combine_busy_time
+import identify_performance_anomalies as anomalies
+import argparse
+import json
+import os
+import pandas as pd
+import shutil
+import sys
+
+MAIN_THREAD_NAME = "com.google.android.youtube:main"
+STATE_FILE = "state.json"
+# Tables tracked by a high-water mark on the end time (ts + dur) of their finished rows
+TRACKED_TABLES = ["sched_slice", "thread_state", "slice"]
+THREAD_KEYS = ["process_name", "pid", "thread_name", "tid"]
+AGGREGATE_KEYS = {
+    "core_placement": (["thread_name", "core_type"], ["dur", "slice_count"]),
+    "cpu_time": (["process_name"], ["dur"]),
+    "short_runs": (["process_name", "thread_name"], ["short_run_count"]),
+    "run_sleep": (["process_name", "thread_name", "state", "blocked_function"], ["run_count"]),
+    "thread_state_totals": (THREAD_KEYS + ["state"], ["state_ns"]),
+    "long_task_competition": (["task_ts", "task_utid", "process_name", "thread_name"], ["overlap_ns", "cpu_count"]),
+    "cluster_time": (["process_name", "cluster"], ["dur"]),
+    "thread_migrations": (THREAD_KEYS, ["slice_count", "migrations", "cluster_migrations"]),
+}
+BUSY_TABLES = ["process_busy", "cpu_busy"]
+# CPU of each thread's last finished sched slice, so a migration across two pulls is counted
+LAST_CPU_TABLE = "last_cpu"
+
+TABLE_BOUNDS_QUERY = """
+    SELECT
+        MIN(ts) AS min_ts,
+        MAX(CASE WHEN dur >= 0 THEN ts + dur END) AS max_end_ts,
+        MIN(CASE WHEN dur < 0 THEN ts END) AS open_ts
+    FROM {table}
+"""
+# Finished rows whose end falls in [:end_from, :end_before). Rows still open at the previous pull
+# started at or after :open_ts, so the ts bound keeps the scan to the new part of the trace.
+NEW_ROWS_WHERE = "WHERE {table}.ts >= :open_ts AND {table}.dur >= 0 AND {table}.ts + {table}.dur >= :end_from AND {table}.ts + {table}.dur < :end_before"
+NEW_SCHED_QUERY = QueryTemplate(CPU_SCHED_QUERY_TEMPLATE.format(where=NEW_ROWS_WHERE.format(table="sched_slice")))
+NEW_THREAD_STATES_QUERY = QueryTemplate(THREAD_STATES_QUERY_TEMPLATE.format(where=NEW_ROWS_WHERE.format(table="thread_state")))
+# Only the main thread's slices hold back the slice high-water mark; an unfinished slice
+# elsewhere (an async slice spanning the whole trace, say) must not stall it.
+MAIN_THREAD_SLICES_WHERE = QueryTemplate("""
+    WHERE id IN (
+        SELECT slice.id
+        FROM slice
+        JOIN thread_track ON slice.track_id = thread_track.id
+        JOIN thread ON thread_track.utid = thread.utid
+        JOIN process ON thread.upid = process.upid
+        WHERE process.name = :process_name AND thread.name = :thread_name
+    )
+""")
+THREAD_IDS_QUERY = """
+    SELECT thread.utid, thread.tid, process.pid
+    FROM thread
+    LEFT JOIN process ON thread.upid = process.upid
+"""
+
+
+def _merge_sums(old, new, keys, columns):
+    if old is None or old.empty:
+        return new
+    if new.empty:
+        return old
+    return pd.concat([old, new]).groupby(keys, dropna=False, observed=True)[columns].sum().reset_index()
+
+
+def _merge_bounds(old, new):
+    if new["slice_count"] == 0:
+        return old
+    if old["slice_count"] == 0:
+        return new
+    merged = {"slice_count": old["slice_count"] + new["slice_count"], "min_ts": min(old["min_ts"], new["min_ts"])}
+    latest = new if new["max_ts"] >= old["max_ts"] else old
+    merged["max_ts"] = latest["max_ts"]
+    merged["dur_at_max_ts"] = latest["dur_at_max_ts"]
+    return merged
+
+
+def new_row_range(session, table, mark, where=""):
+    """Finds the rows of `table` (restricted by `where`) that finished since the high-water `mark`.
+
+    Returns (new_range, new_mark, warning). new_range is the (open_ts, end_from, end_before)
+    parameters of NEW_ROWS_WHERE, or None when there is nothing to read. warning describes data
+    lost to an overwritten ring buffer or a trace older than the mark, and is None otherwise.
+    """
+    bounds = session.query_df(TABLE_BOUNDS_QUERY.format(table=table) + where, label=f"{table} bounds").iloc[0]
+    if pd.isna(bounds["max_end_ts"]):
+        return None, mark, None
+    min_ts, max_end_ts = int(bounds["min_ts"]), int(bounds["max_end_ts"])
+    if mark is not None and max_end_ts + 1 < mark["end_ts"]:
+        return None, mark, f"{table} ends at {max_end_ts}, before the last pull's high-water mark {mark['end_ts']}. Is this an older trace?"
+    warning = None
+    if mark is not None and min_ts > mark["end_ts"]:
+        warning = (f"{table} starts at {min_ts}, after the last pull's high-water mark {mark['end_ts']}: "
+                   f"{(min_ts - mark['end_ts']) / 1_000_000:.2f} ms of data were overwritten before this pull.")
+    end_before = max_end_ts + 1
+    open_ts = int(bounds["open_ts"]) if not pd.isna(bounds["open_ts"]) else end_before
+    new_range = (min_ts, min_ts, end_before) if mark is None else (mark["open_ts"], mark["end_ts"], end_before)
+    return new_range, {"open_ts": open_ts, "end_ts": end_before}, warning
+
+
+def _json_value(value):
+    return None if value is None or pd.isna(value) else int(value)
+
+
+class IncrementalState:
+    """Running aggregates of the anomaly analyses, updated with only the rows added since the last pull.
+
+    The state directory holds state.json (high-water marks, sched bounds, pull history) and one
+    table per aggregate. Each tracked table keeps the end time of the last finished row counted:
+    a pull only extracts rows that finished after it, so rows still running at one pull are
+    counted once they finish. `aggregates` is what identify_performance_anomalies reads when
+    an IncrementalState is passed in place of the sched and thread state data.
+    """
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        self.meta = {
+            "marks": {table: None for table in TRACKED_TABLES},
+            "origin_ts": None,
+            "sched_bounds": {"slice_count": 0, "min_ts": None, "max_ts": None, "dur_at_max_ts": 0},
+            "flags": {"has_sched": False, "has_thread_states": False, "has_states": True},
+            "pulls": [],
+        }
+        self.tables = {}
+        self.system_info = pd.DataFrame(columns=anomalies.SYSTEM_INFO_COLUMNS)
+        self.long_tasks = pd.DataFrame(columns=LONG_TASKS_COLUMNS)
+
+    @classmethod
+    def load(cls, state_dir):
+        """Loads the state saved in `state_dir`, or returns an empty state if there is none."""
+        state = cls(state_dir)
+        state_path = os.path.join(state_dir, STATE_FILE)
+        if not os.path.exists(state_path):
+            return state
+        with open(state_path) as f:
+            state.meta = json.load(f)
+        for name in [*AGGREGATE_KEYS, *BUSY_TABLES, LAST_CPU_TABLE]:
+            path = os.path.join(state_dir, f"{name}.parquet")
+            if os.path.exists(path):
+                state.tables[name] = read_table(path)
+        for name in ["system_info", "long_tasks"]:
+            path = os.path.join(state_dir, f"{name}.parquet")
+            if os.path.exists(path):
+                setattr(state, name, read_table(path))
+        return state
+
+    def save(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        for name, table in self.tables.items():
+            write_table(table, os.path.join(self.state_dir, f"{name}.parquet"))
+        write_table(self.system_info, os.path.join(self.state_dir, "system_info.parquet"))
+        write_table(self.long_tasks, os.path.join(self.state_dir, "long_tasks.parquet"))
+        # Written last, so an interrupted save leaves the previous marks pointing at consistent tables
+        state_path = os.path.join(self.state_dir, STATE_FILE)
+        with open(state_path + ".tmp", "w") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(state_path + ".tmp", state_path)
+
+    @property
+    def aggregates(self):
+        aggregates = {name: self._table(name) for name in [*AGGREGATE_KEYS, *BUSY_TABLES]}
+        aggregates["sched_bounds"] = self.meta["sched_bounds"]
+        aggregates["flags"] = self.meta["flags"]
+        aggregates["topology"] = self.meta.get("topology")
+        return aggregates
+
+    def _table(self, name):
+        if name in self.tables:
+            return self.tables[name]
+        if name in BUSY_TABLES:
+            return combine_busy_time([])
+        if name == LAST_CPU_TABLE:
+            return pd.DataFrame(columns=["pid", "tid", "cpu"])
+        keys, columns = AGGREGATE_KEYS[name]
+        return pd.DataFrame(columns=keys + columns)
+
+    def _new_range(self, session, table, where=""):
+        new_range, self.meta["marks"][table], warning = new_row_range(session, table, self.meta["marks"][table], where)
+        if warning:
+            print(f"Warning: {warning}" + (" Use --reset to start over." if new_range is None else ""))
+        return new_range
+
+    def update(self, session):
+        """Extracts the rows added to the trace since the last pull and merges them into the aggregates.
+
+        Returns the number of new rows per tracked table.
+        """
+        new_rows = dict.fromkeys(TRACKED_TABLES, 0)
+        thread_ids = session.query_df(THREAD_IDS_QUERY, label="thread ids")
+        self.system_info = extract_system_info(session)
+
+        sched_range = self._new_range(session, "sched_slice")
+        sched = pd.DataFrame(columns=anomalies.CPU_SCHED_COLUMNS)
+        if sched_range:
+            open_ts, end_from, end_before = sched_range
+            sched = compact_table(session.query_df(NEW_SCHED_QUERY.bind(open_ts=open_ts, end_from=end_from, end_before=end_before), label="new sched slices"))
+        if not sched.empty:
+            new_rows["sched_slice"] = len(sched)
+            self._merge_sched(session, sched, thread_ids)
+
+        states_range = self._new_range(session, "thread_state")
+        if states_range:
+            open_ts, end_from, end_before = states_range
+            states = compact_table(session.query_df(NEW_THREAD_STATES_QUERY.bind(open_ts=open_ts, end_from=end_from, end_before=end_before), label="new thread states"))
+            new_rows["thread_state"] = len(states)
+            if not states.empty:
+                self.meta["flags"]["has_thread_states"] = True
+                not_running = states[states["state"].notna() & (states["state"] != RUNNING_STATE)]
+                self._merge_state_totals(not_running, thread_ids)
+
+        main_thread_where = MAIN_THREAD_SLICES_WHERE.bind(process_name=anomalies.YOUTUBE_PROCESS_NAME, thread_name=MAIN_THREAD_NAME)
+        slice_range = self._new_range(session, "slice", main_thread_where)
+        if slice_range:
+            _, end_from, end_before = slice_range
+            long_task_threshold_ns = anomalies.LONG_TASK_THRESHOLD_MS * 1_000_000
+            long_tasks = extract_long_tasks_batch(session, [(anomalies.YOUTUBE_PROCESS_NAME, MAIN_THREAD_NAME, long_task_threshold_ns)],
+                                                  end_range=(end_from, end_before))[LONG_TASKS_COLUMNS]
+            new_rows["slice"] = len(long_tasks)
+            if not long_tasks.empty:
+                self.long_tasks = pd.concat([self.long_tasks, long_tasks], ignore_index=True) if not self.long_tasks.empty else long_tasks
+                # A task is only seen once it has finished; sched slices still running at its end are left out
+                keys, columns = AGGREGATE_KEYS["long_task_competition"]
+                competition = anomalies.long_task_competition_aggregate(long_tasks, session)
+                self.tables["long_task_competition"] = _merge_sums(self.tables.get("long_task_competition"), competition[keys + columns], keys, columns)
+
+        self.meta["pulls"].append({"trace": os.path.abspath(session.trace_file), "new_rows": new_rows})
+        return new_rows
+
+    def _merge_sched(self, session, sched, thread_ids):
+        self.meta["flags"]["has_sched"] = True
+        if self.meta["origin_ts"] is None:
+            self.meta["origin_ts"] = int(sched["ts"].min())
+        _, bounds = anomalies.cpu_time_aggregate(sched)
+        self.meta["sched_bounds"] = {k: _json_value(v) for k, v in _merge_bounds(self.meta["sched_bounds"], bounds).items()}
+
+        # The topology is detected once; later pulls of the same device keep the clusters stable
+        if self.meta.get("topology") is None:
+            self.meta["topology"] = anomalies.detect_topology(self.system_info, session).to_dict()
+        topology = CpuTopology.from_dict(self.meta["topology"])
+        partials = {
+            "core_placement": anomalies.core_placement_aggregate(sched, topology),
+            "cluster_time": anomalies.cluster_time_aggregate(sched, topology),
+            "cpu_time": anomalies.cpu_time_aggregate(sched)[0],
+            "short_runs": anomalies.short_runs_aggregate(sched, sched, count_threshold=0)[0],
+        }
+        # A short run is matched to the thread state starting within RUN_SLEEP_MAX_GAP_NS of its
+        # end, which may still be open, so those states are read separately from the totals.
+        runs = sched[(sched["dur"] < anomalies.SHORT_RUN_THRESHOLD_NS) & (sched["utid"] != 0)]
+        if not runs.empty:
+            run_end = runs["ts"] + runs["dur"]
+            next_states = session.query_df(THREAD_STATES_CHUNK_QUERY.bind(start_ts=int(run_end.min()), end_ts=int(run_end.max()) + anomalies.RUN_SLEEP_MAX_GAP_NS + 1),
+                                           label="thread states after short runs")
+            partials["run_sleep"] = anomalies.run_sleep_aggregate(sched, next_states)[0]
+        for name, partial in partials.items():
+            keys, columns = AGGREGATE_KEYS[name]
+            self.tables[name] = _merge_sums(self.tables.get(name), partial[keys + columns], keys, columns)
+
+        process_busy, cpu_busy = anomalies.window_busy_aggregate(sched, self.meta["origin_ts"])
+        for name, partial in (("process_busy", process_busy), ("cpu_busy", cpu_busy)):
+            self.tables[name] = combine_busy_time([self._table(name), partial])
+
+        self._merge_migrations(sched, topology, thread_ids)
+
+        running = sched[sched["utid"] != 0].assign(state=RUNNING_STATE)
+        self._merge_state_totals(running, thread_ids)
+
+    def _merge_migrations(self, sched, topology, thread_ids):
+        last = self._table(LAST_CPU_TABLE).merge(thread_ids, on=["pid", "tid"])
+        last_cpu = pd.Series(last["cpu"].to_numpy(dtype="int64"), index=last["utid"].to_numpy())
+        migrations, last_cpu = anomalies.migrations_aggregate(sched, topology, last_cpu)
+        keys, columns = AGGREGATE_KEYS["thread_migrations"]
+        migrations = migrations.merge(thread_ids, on="utid", how="left").groupby(keys, dropna=False, observed=True)[columns].sum().reset_index()
+        self.tables["thread_migrations"] = _merge_sums(self.tables.get("thread_migrations"), migrations, keys, columns)
+        last_cpu = last_cpu.rename_axis("utid").reset_index(name="cpu").merge(thread_ids, on="utid")
+        self.tables[LAST_CPU_TABLE] = last_cpu[["pid", "tid", "cpu"]]
+
+    def _merge_state_totals(self, rows, thread_ids):
+        # utids are assigned per trace load, so threads are identified across pulls by pid and tid
+        rows = rows[["utid", "process_name", "thread_name", "state", "dur"]].merge(thread_ids, on="utid", how="left")
+        totals = rows.groupby(THREAD_KEYS + ["state"], dropna=False, observed=True)["dur"].sum().reset_index(name="state_ns")
+        keys, columns = AGGREGATE_KEYS["thread_state_totals"]
+        self.tables["thread_state_totals"] = _merge_sums(self.tables.get("thread_state_totals"), totals, keys, columns)
+
+    def youtube_thread_states(self):
+        """Returns the YouTube per-thread running and state times in the layout of extract_youtube_thread_cpu_states."""
+        totals = self._table("thread_state_totals")
+        totals = totals[totals["process_name"] == anomalies.YOUTUBE_PROCESS_NAME]
+        if totals.empty:
+            return pd.DataFrame(columns=YOUTUBE_THREAD_STATES_COLUMNS)
+        threads = totals[THREAD_KEYS].drop_duplicates(ignore_index=True)
+        result = pivot_state_totals(threads, totals, ["pid", "tid", "thread_name"])
+        result = result.sort_values(["total_running_ns", "thread_name"], ascending=[False, True], ignore_index=True)
+        return result[YOUTUBE_THREAD_STATES_COLUMNS]
+
+    def build_report(self):
+        long_tasks = self.long_tasks.sort_values("dur", ascending=False, ignore_index=True)
+        return anomalies.build_report(self.system_info, self, long_tasks, self.youtube_thread_states(), self)
+
+
+def run_incremental(trace_file, state_dir, output_report_path, reset=False):
+    if reset and os.path.isdir(state_dir):
+        shutil.rmtree(state_dir)
+    state = IncrementalState.load(state_dir)
+    with TraceSession(trace_file) as session:
+        new_rows = state.update(session)
+        state.save()
+        session.print_timings()
+    print("New rows since the last pull: " + ", ".join(f"{table}: {count}" for table, count in new_rows.items()))
+
+    try:
+        with open(output_report_path, "w") as f:
+            f.write(state.build_report())
+        print(f"Performance anomalies report ({len(state.meta['pulls'])} pulls) saved to {output_report_path}")
+    except IOError as e:
+        print(f"Error writing report to file: {e}")
+        sys.exit(1)
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the anomaly aggregates with the rows added since the last pull of a trace and re-render the report.")
+    parser.add_argument("trace_file_path")
+    parser.add_argument("state_dir", help="directory holding the high-water marks and running aggregates")
+    parser.add_argument("output_report_md")
+    parser.add_argument("--reset", action="store_true", help="discard the saved state and start from this trace")
+    args = parser.parse_args()
+
+    try:
+        run_incremental(args.trace_file_path, args.state_dir, args.output_report_md, args.reset)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
@@ -0,0 +1,244 @@
+import atexit
+import functools
+import json
+import os
+import resource
+import threading
+import time
+
+# Setting these environment variables turns instrumentation on in every script and writes
+# the timing report / pipeline trace when the process exits (see `configure`).
+TIMINGS_ENV = "PERFETTO_ANALYSIS_TIMINGS"
+TRACE_ENV = "PERFETTO_ANALYSIS_TRACE"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+SPAN_COLUMNS = ["name", "category", "start_ms", "dur_ms", "rows", "rss_mb", "rss_delta_mb", "depth", "pid", "tid", "args"]
+
+_enabled = False
+_spans = []
+_lock = threading.Lock()
+_local = threading.local()
+_origin_ns = time.perf_counter_ns()
+_outputs = {"timings": None, "trace": None}
+
+
+def rss_bytes(pid="self"):
+    """Returns the current resident set size of process `pid`, this one by default.
+
+    Where /proc is unavailable, returns the peak RSS of this process (0 for other processes).
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        if pid != "self":
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Span:
+    """One timed stage. Set `rows` (or add to `args`) inside the `with` block to record them."""
+
+    __slots__ = ("name", "category", "args", "rows", "_start_ns", "_rss", "_depth")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.rows = None
+
+    def __enter__(self):
+        self._depth = getattr(_local, "depth", 0)
+        _local.depth = self._depth + 1
+        self._rss = rss_bytes()
+        self._start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.perf_counter_ns()
+        rss = rss_bytes()
+        _local.depth = self._depth
+        args = dict(self.args)
+        if exc_type is not None:
+            args["error"] = exc_type.__name__
+        record = {
+            "name": self.name,
+            "category": self.category,
+            "start_ms": (self._start_ns - _origin_ns) / 1e6,
+            "dur_ms": (end_ns - self._start_ns) / 1e6,
+            "rows": self.rows,
+            "rss_mb": rss / 1024 ** 2,
+            "rss_delta_mb": (rss - self._rss) / 1024 ** 2,
+            "depth": self._depth,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": args,
+        }
+        with _lock:
+            _spans.append(record)
+        return False
+
+
+class _NullSpan:
+    """Returned by `span` while instrumentation is off; accepts the same attributes and costs nothing."""
+
+    __slots__ = ("rows", "args")
+
+    def __init__(self):
+        self.rows = None
+        self.args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+def span(name, category="stage", **args):
+    """Context manager timing the enclosed block as one span:
+
+        with span("cpu_sched", "query") as s:
+            df = ...
+            s.rows = len(df)
+    """
+    if not _enabled:
+        return _NullSpan()
+    return Span(name, category, args)
+
+
+def traced(category="stage", name=None):
+    """Decorator recording every call of the function as a span named after it."""
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(span_name, category, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    """Drops the recorded spans, e.g. in a forked worker that inherited its parent's."""
+    with _lock:
+        _spans.clear()
+
+
+def spans():
+    """Returns a copy of the spans recorded so far, in completion order."""
+    with _lock:
+        return list(_spans)
+
+
+def add_spans(records):
+    """Adds spans recorded by another process (see batch_analyze.py), keeping their pid."""
+    with _lock:
+        _spans.extend(records)
+
+
+def timings_frame():
+    import pandas as pd
+    df = pd.DataFrame(spans(), columns=SPAN_COLUMNS)
+    df["rows"] = df["rows"].astype("Int64")
+    df["args"] = df["args"].map(lambda a: json.dumps(a, default=str) if a else "")
+    return df.sort_values(["pid", "start_ms"], kind="stable", ignore_index=True)
+
+
+def summary_frame():
+    """Returns total/max time, call count and rows per (category, name), slowest first."""
+    df = timings_frame()
+    summary = df.groupby(["category", "name"], as_index=False).agg(
+        calls=("dur_ms", "size"),
+        total_ms=("dur_ms", "sum"),
+        max_ms=("dur_ms", "max"),
+        rows=("rows", "sum"),
+        rss_delta_mb=("rss_delta_mb", "sum"),
+    )
+    return summary.sort_values("total_ms", ascending=False, ignore_index=True)
+
+
+def write_timings(path):
+    """Writes one row per span to `path`: a .json file, or a table in any format of table_io."""
+    from table_io import write_table
+    df = timings_frame()
+    if str(path).endswith(".json"):
+        with open(path, "w") as f:
+            json.dump({"spans": df.to_dict("records"), "summary": summary_frame().to_dict("records")}, f, indent=1, default=str)
+    else:
+        write_table(df, path)
+
+
+def write_chrome_trace(path):
+    """Writes the spans in the Chrome JSON trace event format, which ui.perfetto.dev opens directly.
+
+    Each span is a complete ("X") event on its process and thread track; rows and memory
+    deltas are shown as event arguments.
+    """
+    events = []
+    for pid in sorted({record["pid"] for record in spans()}):
+        events.append({"ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": f"perfetto_analysis {pid}"}})
+    for record in spans():
+        args = {**record["args"], "rss_mb": round(record["rss_mb"], 1), "rss_delta_mb": round(record["rss_delta_mb"], 1)}
+        if record["rows"] is not None:
+            args["rows"] = int(record["rows"])
+        events.append({
+            "name": record["name"],
+            "cat": record["category"],
+            "ph": "X",
+            "ts": record["start_ms"] * 1000,
+            "dur": record["dur_ms"] * 1000,
+            "pid": record["pid"],
+            "tid": record["tid"],
+            "args": args,
+        })
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+def write_outputs():
+    """Writes the timing report and the pipeline trace configured by `configure`, if any."""
+    if _outputs["timings"]:
+        write_timings(_outputs["timings"])
+        print(f"Timing report saved to {_outputs['timings']}")
+    if _outputs["trace"]:
+        write_chrome_trace(_outputs["trace"])
+        print(f"Pipeline trace saved to {_outputs['trace']}")
+
+
+def configure(timings_path=None, trace_path=None):
+    """Enables instrumentation and writes the given outputs when the process exits."""
+    if not (timings_path or trace_path):
+        return
+    first = not (_outputs["timings"] or _outputs["trace"])
+    _outputs["timings"] = timings_path or _outputs["timings"]
+    _outputs["trace"] = trace_path or _outputs["trace"]
+    enable()
+    if first:
+        atexit.register(write_outputs)
+
+
+def add_instrumentation_arguments(parser):
+    """Adds the --timings/--pipeline-trace options shared by the pipeline entry points."""
+    parser.add_argument("--timings", default=os.environ.get(TIMINGS_ENV),
+                        help=f"write a timing report with one row per traced stage (.json, .csv, .parquet, ...; env {TIMINGS_ENV})")
+    parser.add_argument("--pipeline-trace", default=os.environ.get(TRACE_ENV),
+                        help=f"write the traced stages as a JSON trace that ui.perfetto.dev can open (env {TRACE_ENV})")
+
+
+def configure_from_args(args):
+    configure(args.timings, args.pipeline_trace)
+
+
+configure(os.environ.get(TIMINGS_ENV), os.environ.get(TRACE_ENV))
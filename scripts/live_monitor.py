@@ -0,0 +1,265 @@
+from trace_session import TraceSession
+from extract_long_tasks import extract_long_tasks_batch
+from incremental_analysis import new_row_range, NEW_SCHED_QUERY, NEW_THREAD_STATES_QUERY, MAIN_THREAD_SLICES_WHERE, THREAD_IDS_QUERY, MAIN_THREAD_NAME
+from trace_model import compact_table, name_mask
+from window_utilization import busy_time_per_window, sliding_busy_time, combine_busy_time
+import identify_performance_anomalies as anomalies
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import os
+import sys
+import time
+
+DEFAULT_POLL_INTERVAL_S = 2.0
+DEFAULT_WINDOW_S = 10.0
+# A "lagging" event is emitted when analyzing a snapshot takes longer than this, so the
+# time to the next output line stays bounded even when trace processor is slow
+DEFAULT_MAX_LATENCY_S = 10.0
+RUNNABLE_STATE = "R"
+# Threads active (running + runnable) for less than this in a window are not checked for runnable time
+MIN_ACTIVE_MS = 20
+
+
+def _utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds")
+
+
+class RollingChecks:
+    """The long-task, high-runnable-ratio and CPU spike checks of identify_performance_anomalies over rolling windows.
+
+    Each snapshot only reads the rows that finished since the previous one (see
+    incremental_analysis.new_row_range). Busy time is kept per CPU_SPIKE_SLIDE_MS bucket, and
+    only buckets inside the rolling window are retained, so memory does not grow with the trace.
+    A window is checked once every row overlapping it has finished. Not thread-safe: snapshots
+    are processed one at a time.
+    """
+
+    def __init__(self, window_ns):
+        self.bucket_ns = anomalies.CPU_SPIKE_SLIDE_MS * 1_000_000
+        self.spike_window_buckets = max(1, anomalies.CPU_SPIKE_WINDOW_MS // anomalies.CPU_SPIKE_SLIDE_MS)
+        self.window_buckets = max(1, window_ns // self.bucket_ns)
+        self.reset()
+
+    def reset(self):
+        self.marks = {"sched_slice": None, "thread_state": None, "slice": None}
+        self.origin_ts = None
+        self.process_busy = combine_busy_time([])
+        self.thread_running = combine_busy_time([])
+        self.thread_runnable = combine_busy_time([])
+        self.thread_names = {}
+        self.last_spike_window = -1
+        self.runnable_alerted_until = {}
+
+    def _new_rows(self, session, table, events, where=""):
+        new_range, self.marks[table], warning = new_row_range(session, table, self.marks[table], where)
+        if warning:
+            events.append({"type": "monitor", "event": "data_lost" if new_range else "trace_restarted", "message": warning})
+        return new_range
+
+    def update(self, session):
+        """Reads the rows added since the last snapshot and returns the alerts they raise."""
+        alerts = []
+        sched_range = self._new_rows(session, "sched_slice", alerts)
+        if alerts and alerts[-1]["event"] == "trace_restarted":
+            # A new recording replaced the trace: start over from its beginning
+            self.reset()
+            sched_range = self._new_rows(session, "sched_slice", alerts)
+        states_range = self._new_rows(session, "thread_state", alerts)
+        main_thread_where = MAIN_THREAD_SLICES_WHERE.bind(process_name=anomalies.YOUTUBE_PROCESS_NAME, thread_name=MAIN_THREAD_NAME)
+        slice_range = self._new_rows(session, "slice", alerts, main_thread_where)
+
+        if slice_range:
+            alerts.extend(self._long_task_alerts(session, slice_range))
+        if self.origin_ts is None:
+            # Buckets are counted from the start of whichever table reports rows first; rows of
+            # the other table that started earlier are clipped to it
+            starts = [new_range[0] for new_range in (sched_range, states_range) if new_range]
+            self.origin_ts = min(starts) if starts else None
+        thread_ids = session.query_df(THREAD_IDS_QUERY, label="thread ids").set_index("utid")["tid"]
+        if sched_range:
+            open_ts, end_from, end_before = sched_range
+            sched = compact_table(session.query_df(NEW_SCHED_QUERY.bind(open_ts=open_ts, end_from=end_from, end_before=end_before), label="new sched slices"))
+            self._add_sched(sched, thread_ids)
+        if states_range:
+            open_ts, end_from, end_before = states_range
+            states = compact_table(session.query_df(NEW_THREAD_STATES_QUERY.bind(open_ts=open_ts, end_from=end_from, end_before=end_before), label="new thread states"))
+            self._add_runnable(states, thread_ids)
+
+        if self.origin_ts is not None:
+            # Rows still open started at or after their table's open_ts, so buckets before the
+            # earlier of the two marks are final in both tables
+            open_ts = min(mark["open_ts"] for mark in (self.marks["sched_slice"], self.marks["thread_state"]) if mark is not None)
+            settled_bucket = (open_ts - self.origin_ts) // self.bucket_ns
+            alerts.extend(self._cpu_spike_alerts(settled_bucket))
+            alerts.extend(self._runnable_alerts(settled_bucket))
+            self._prune(settled_bucket)
+        return alerts
+
+    def _long_task_alerts(self, session, slice_range):
+        _, end_from, end_before = slice_range
+        threshold_ns = anomalies.LONG_TASK_THRESHOLD_MS * 1_000_000
+        long_tasks = extract_long_tasks_batch(session, [(anomalies.YOUTUBE_PROCESS_NAME, MAIN_THREAD_NAME, threshold_ns)], end_range=(end_from, end_before))
+        return [{"type": "long_task", "process_name": row.process_name, "thread_name": row.thread_name, "slice_name": row.slice_name,
+                 "ts": int(row.ts), "dur_ms": row.dur / 1_000_000}
+                for row in long_tasks.sort_values("ts").itertuples()]
+
+    def _add_sched(self, sched, thread_ids):
+        busy = self._since_origin(sched[sched["utid"] != 0])
+        if busy.empty:
+            return
+        self.process_busy = combine_busy_time([self.process_busy, busy_time_per_window(busy["ts"], busy["dur"], busy["process_name"], self.bucket_ns, self.origin_ts)])
+        youtube = self._youtube_rows(busy, thread_ids)
+        self.thread_running = combine_busy_time([self.thread_running, busy_time_per_window(youtube["ts"], youtube["dur"], youtube["tid"], self.bucket_ns, self.origin_ts)])
+
+    def _add_runnable(self, states, thread_ids):
+        runnable = self._since_origin(states[name_mask(states["state"], RUNNABLE_STATE)])
+        if runnable.empty:
+            return
+        youtube = self._youtube_rows(runnable, thread_ids)
+        self.thread_runnable = combine_busy_time([self.thread_runnable, busy_time_per_window(youtube["ts"], youtube["dur"], youtube["tid"], self.bucket_ns, self.origin_ts)])
+
+    def _since_origin(self, rows):
+        """Returns `rows` with the part of each row before origin_ts cut off, and rows ending before it dropped."""
+        start = rows["ts"].clip(lower=self.origin_ts)
+        rows = rows.assign(ts=start, dur=rows["ts"] + rows["dur"] - start)
+        return rows[rows["dur"] > 0]
+
+    def _youtube_rows(self, rows, thread_ids):
+        # utids are assigned per trace load, so threads are followed across snapshots by tid
+        youtube = rows[name_mask(rows["process_name"], anomalies.YOUTUBE_PROCESS_NAME)]
+        youtube = youtube.assign(tid=youtube["utid"].map(thread_ids))
+        self.thread_names.update(zip(youtube["tid"], youtube["thread_name"]))
+        return youtube
+
+    def _cpu_spike_alerts(self, settled_bucket):
+        windows = sliding_busy_time(self.process_busy, self.spike_window_buckets)
+        # Window j covers buckets j .. j + spike_window_buckets - 1
+        last_complete = settled_bucket - self.spike_window_buckets
+        if last_complete <= self.last_spike_window:
+            return []
+        new = windows[(windows["window"] > self.last_spike_window) & (windows["window"] <= last_complete)]
+        self.last_spike_window = last_complete
+        spikes = new[new["busy_ns"] > anomalies.CPU_SPIKE_PROCESS_THRESHOLD_MS * 1_000_000].sort_values(["window", "busy_ns"], ascending=[True, False])
+        return [{"type": "cpu_spike", "process_name": row.key, "window_start_ts": int(self.origin_ts + row.window * self.bucket_ns),
+                 "window_ms": anomalies.CPU_SPIKE_WINDOW_MS, "cpu_ms": row.busy_ns / 1_000_000}
+                for row in spikes.itertuples()]
+
+    def _runnable_alerts(self, settled_bucket):
+        first_bucket = settled_bucket - self.window_buckets
+
+        def in_window(busy):
+            return busy[(busy["window"] >= first_bucket) & (busy["window"] < settled_bucket)].groupby("key")["busy_ns"].sum()
+
+        running = in_window(self.thread_running)
+        runnable = in_window(self.thread_runnable)
+        alerts = []
+        for tid in runnable.index:
+            runnable_ns = runnable[tid]
+            active_ns = runnable_ns + running.get(tid, 0)
+            if active_ns < MIN_ACTIVE_MS * 1_000_000 or runnable_ns / active_ns <= anomalies.HIGH_RUNNABLE_RATIO_THRESHOLD:
+                continue
+            # Alert once per window length for a thread that stays runnable
+            if self.runnable_alerted_until.get(tid, -1) > first_bucket:
+                continue
+            self.runnable_alerted_until[tid] = settled_bucket
+            alerts.append({"type": "high_runnable", "process_name": anomalies.YOUTUBE_PROCESS_NAME, "thread_name": self.thread_names.get(tid), "tid": int(tid),
+                           "window_start_ts": int(self.origin_ts + first_bucket * self.bucket_ns), "window_ms": self.window_buckets * anomalies.CPU_SPIKE_SLIDE_MS,
+                           "running_ms": (active_ns - runnable_ns) / 1_000_000, "runnable_ms": runnable_ns / 1_000_000, "runnable_ratio": runnable_ns / active_ns})
+        return alerts
+
+    def _prune(self, settled_bucket):
+        keep_from = min(self.last_spike_window + 1, settled_bucket - self.window_buckets)
+        self.process_busy = self.process_busy[self.process_busy["window"] >= keep_from]
+        self.thread_running = self.thread_running[self.thread_running["window"] >= keep_from]
+        self.thread_runnable = self.thread_runnable[self.thread_runnable["window"] >= keep_from]
+
+
+class LiveMonitor:
+    """Watches a trace file and writes alerts as JSON lines while it is being written or re-snapshotted.
+
+    The file is polled every `poll_interval_s`; when it changed, the latest version is analyzed
+    in a worker thread so the event loop keeps writing alerts while trace processor loads it.
+    Changes made while a snapshot is analyzed are coalesced into one later snapshot.
+    """
+
+    def __init__(self, trace_file, output=sys.stdout, poll_interval_s=DEFAULT_POLL_INTERVAL_S, window_s=DEFAULT_WINDOW_S,
+                 max_latency_s=DEFAULT_MAX_LATENCY_S, session_factory=TraceSession):
+        self.trace_file = trace_file
+        self.output = output
+        self.poll_interval_s = poll_interval_s
+        self.max_latency_s = max_latency_s
+        self.session_factory = session_factory
+        self.checks = RollingChecks(int(window_s * 1_000_000_000))
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-processor")
+
+    def _analyze_snapshot(self):
+        with self.session_factory(self.trace_file) as session:
+            return self.checks.update(session)
+
+    def emit(self, event, detected_at=None):
+        event = {"time": _utc_now(), **event}
+        if detected_at is not None:
+            event["latency_s"] = round(time.monotonic() - detected_at, 3)
+        self.output.write(json.dumps(event, default=str) + "\n")
+        self.output.flush()
+
+    async def _process(self, detected_at):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self._analyze_snapshot)
+        while True:
+            done, _ = await asyncio.wait([future], timeout=self.max_latency_s)
+            if done:
+                break
+            self.emit({"type": "monitor", "event": "lagging", "message": f"snapshot analysis running for more than {self.max_latency_s:g} s"}, detected_at)
+        try:
+            alerts = future.result()
+        except Exception as e:
+            self.emit({"type": "monitor", "event": "error", "message": str(e)}, detected_at)
+            return
+        for alert in alerts:
+            self.emit(alert, detected_at)
+
+    async def run(self, max_snapshots=None):
+        """Polls the trace until cancelled (or after `max_snapshots` snapshots) and emits the alerts of each new version."""
+        self.emit({"type": "monitor", "event": "started", "trace": os.path.abspath(self.trace_file)})
+        last_stat = None
+        snapshots = 0
+        try:
+            while max_snapshots is None or snapshots < max_snapshots:
+                try:
+                    stat = os.stat(self.trace_file)
+                    current = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                except FileNotFoundError:
+                    current = None
+                if current is not None and current != last_stat:
+                    last_stat = current
+                    snapshots += 1
+                    await self._process(time.monotonic())
+                    # Analysis may have taken several intervals; poll again right away
+                    continue
+                await asyncio.sleep(self.poll_interval_s)
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch a trace that is still being written and emit performance anomaly alerts as JSON lines.")
+    parser.add_argument("trace_file_path")
+    parser.add_argument("--output", help="append alerts to this file instead of writing them to stdout")
+    parser.add_argument("--interval", type=float, default=DEFAULT_POLL_INTERVAL_S, help="seconds between checks of the trace file")
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW_S, help="rolling window in seconds of the runnable time check")
+    parser.add_argument("--max-latency", type=float, default=DEFAULT_MAX_LATENCY_S, help="seconds after which a slow snapshot is reported as lagging")
+    args = parser.parse_args()
+
+    output = open(args.output, "a") if args.output else sys.stdout
+    monitor = LiveMonitor(args.trace_file_path, output, args.interval, args.window, args.max_latency)
+    try:
+        asyncio.run(monitor.run())
+    except KeyboardInterrupt:
+        print("Monitoring stopped.", file=sys.stderr)
+    finally:
+        if args.output:
+            output.close()
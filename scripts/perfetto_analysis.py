@@ -0,0 +1,150 @@
+from trace_daemon import DEFAULT_SOCKET, connect, plain_rows
+import argparse
+import csv
+import json
+import os
+import runpy
+import sys
+import time
+
+# Only the module of the chosen command is imported (trace_daemon needs nothing beyond the
+# standard library), so commands that do not use pandas, matplotlib or the perfetto package
+# start without importing them.
+
+# command -> (module run with the remaining arguments, help)
+SCRIPT_COMMANDS = {
+    "pipeline": ("run_pipeline", "extract all tables from one trace and write the anomalies report"),
+    "batch": ("batch_analyze", "run the pipeline on many traces in parallel"),
+    "identify": ("identify_performance_anomalies", "write the anomalies report from extracted tables"),
+    "extract-metadata": ("extract_metadata", "extract system, process and thread info"),
+    "extract-cpu-usage": ("extract_cpu_usage", "extract the sched slices"),
+    "extract-thread-states": ("extract_thread_states", "extract the thread states"),
+    "extract-process-thread-states": ("extract_process_thread_states", "extract thread state times of many processes"),
+    "extract-long-tasks": ("extract_long_tasks", "extract long slices of a thread"),
+    "extract-youtube-states": ("extract_youtube_thread_cpu_states", "extract the YouTube thread state totals"),
+    "visualize": ("visualize_top_processes_cpu", "plot the CPU time of the top processes"),
+    "incremental": ("incremental_analysis", "update the report with rows added since the last pull"),
+    "live": ("live_monitor", "watch a trace being written and emit alerts"),
+    "sched-index": ("sched_index", "report what ran during long tasks or at a timestamp"),
+    "topology": ("cpu_topology", "detect and cache the CPU clusters of the traced device"),
+    "tiles": ("utilization_tiles", "build and render multi-resolution utilization tiles"),
+    "compare": ("compare_builds", "compare builds over repeated runs"),
+    "benchmark": ("benchmark", "benchmark the extractors and analyzers"),
+    "synthetic": ("synthetic_trace", "write a synthetic dataset"),
+    "cache": ("query_cache", "inspect and purge the query result cache"),
+    "daemon": ("trace_daemon", "start, stop or inspect the trace daemon"),
+}
+OUTPUT_FORMATS = ("table", "csv", "json")
+DEFAULT_LONG_TASK_THRESHOLD_MS = 50
+
+
+def run_script(command, argv):
+    module = SCRIPT_COMMANDS[command][0]
+    sys.argv = [f"{module}.py", *argv]
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+
+def query_rows(trace_file, sql, use_daemon=True, socket_path=DEFAULT_SOCKET):
+    """Returns (columns, rows) of `sql` against `trace_file`, through the daemon unless use_daemon is False."""
+    if use_daemon:
+        with connect(socket_path) as client:
+            result = client.query(trace_file, sql)
+        return result["columns"], result["rows"]
+    from trace_session import TraceSession
+    with TraceSession(trace_file) as session:
+        df = session.query_df(sql, label="query")
+    return list(df.columns), plain_rows(df)
+
+
+def print_rows(columns, rows, fmt="table", out=sys.stdout):
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    elif fmt == "json":
+        for row in rows:
+            out.write(json.dumps(dict(zip(columns, row)), default=str) + "\n")
+    else:
+        cells = [["" if value is None else str(value) for value in row] for row in rows]
+        widths = [max([len(str(c))] + [len(row[i]) for row in cells]) for i, c in enumerate(columns)]
+        out.write("  ".join(str(c).ljust(w) for c, w in zip(columns, widths)).rstrip() + "\n")
+        for row in cells:
+            out.write("  ".join(value.ljust(w) for value, w in zip(row, widths)).rstrip() + "\n")
+
+
+def command_query(args):
+    sql = args.sql
+    if sql.endswith(".sql") and os.path.isfile(sql):
+        with open(sql) as f:
+            sql = f.read()
+    start = time.perf_counter()
+    columns, rows = query_rows(args.trace_file_path, sql, not args.no_daemon, args.socket)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print_rows(columns, rows[:args.max_rows] if args.max_rows else rows, args.format)
+    print(f"({len(rows)} rows in {elapsed_ms:.0f} ms)", file=sys.stderr)
+
+
+def command_long_tasks(args):
+    from extract_long_tasks import long_tasks_batch_query, FILTER_COLUMNS, LONG_TASKS_COLUMNS
+
+    threshold_ns = int(args.threshold_ms * 1_000_000)
+    filters = [(process_name, args.thread, threshold_ns) for process_name in args.process_names]
+    start = time.perf_counter()
+    columns, rows = query_rows(args.trace_file_path, long_tasks_batch_query(filters), not args.no_daemon, args.socket)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    if args.output:
+        # pandas is only needed to write the table
+        import pandas as pd
+        from table_io import write_table
+        write_table(pd.DataFrame(rows, columns=columns)[FILTER_COLUMNS + LONG_TASKS_COLUMNS], args.output)
+        print(f"Long tasks saved to {args.output}")
+    index = {column: i for i, column in enumerate(columns)}
+    out_columns = ["process_name", "thread_name", "slice_name", "ts", "dur_ms"]
+    out_rows = [[row[index["process_name"]], row[index["thread_name"]], row[index["slice_name"]], row[index["ts"]],
+                 round(row[index["dur"]] / 1_000_000, 2)] for row in rows]
+    print_rows(out_columns, out_rows[:args.max_rows] if args.max_rows else out_rows, args.format)
+    print(f"({len(rows)} long tasks over {args.threshold_ms:g} ms in {elapsed_ms:.0f} ms)", file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Perfetto trace analysis tools. Script commands take the arguments of the script they run; "
+                                                 "query and long-tasks go through the trace daemon, which keeps traces loaded between commands.")
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+    for command, (module, help_text) in SCRIPT_COMMANDS.items():
+        subparsers.add_parser(command, help=f"{help_text} ({module}.py)", add_help=False)
+
+    query_parser = subparsers.add_parser("query", help="run one SQL query against a trace")
+    query_parser.add_argument("trace_file_path")
+    query_parser.add_argument("sql", help="the query, or a .sql file holding it")
+    long_tasks_parser = subparsers.add_parser("long-tasks", help="list the long slices of one or more apps")
+    long_tasks_parser.add_argument("trace_file_path")
+    long_tasks_parser.add_argument("process_names", nargs="+", metavar="process_name")
+    long_tasks_parser.add_argument("--thread", default="all", help="thread name, or all (default) for every thread of the process")
+    long_tasks_parser.add_argument("--threshold-ms", type=float, default=DEFAULT_LONG_TASK_THRESHOLD_MS)
+    long_tasks_parser.add_argument("--output", help="also write every long task to this table file")
+    for command_parser in (query_parser, long_tasks_parser):
+        command_parser.add_argument("--format", choices=OUTPUT_FORMATS, default="table")
+        command_parser.add_argument("--max-rows", type=int, default=None, help="print at most this many rows")
+        command_parser.add_argument("--no-daemon", action="store_true", help="load the trace in this process instead of the trace daemon")
+        command_parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"unix socket of the trace daemon (default: {DEFAULT_SOCKET})")
+    return parser
+
+
+def main(argv):
+    if argv and argv[0] in SCRIPT_COMMANDS:
+        run_script(argv[0], argv[1:])
+        return
+    args = build_parser().parse_args(argv)
+    try:
+        if args.command == "query":
+            command_query(args)
+        else:
+            command_long_tasks(args)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,84 @@
+import math
+import numbers
+import re
+
+# String literals are kept intact while looking for :name placeholders
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+_PLACEHOLDER = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+
+def sql_literal(value):
+    """Returns `value` as an SQL literal: strings are quoted with embedded quotes doubled, None becomes NULL.
+
+    Trace processor's query API has no parameter binding, so this is the one place where
+    values are turned into SQL text.
+    """
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    if isinstance(value, numbers.Real):
+        if not math.isfinite(value):
+            raise ValueError(f"Cannot use {value} as an SQL value")
+        return repr(float(value))
+    if isinstance(value, str):
+        if "\0" in value:
+            raise ValueError("SQL string values cannot contain NUL characters")
+        return "'" + value.replace("'", "''") + "'"
+    raise TypeError(f"Unsupported SQL value type: {type(value).__name__}")
+
+
+def sql_list(values):
+    """Returns `values` as a comma-separated list of literals for IN (...). An empty list becomes NULL, which matches nothing."""
+    values = list(values)
+    if not values:
+        return "NULL"
+    return ", ".join(sql_literal(v) for v in values)
+
+
+def values_table(name, columns, rows):
+    """Returns a `name(columns) AS (VALUES ...)` common table expression holding `rows`."""
+    rows = list(rows)
+    if not rows:
+        raise ValueError(f"values_table {name} needs at least one row")
+    values = ",\n        ".join("(" + ", ".join(sql_literal(v) for v in row) + ")" for row in rows)
+    return f"{name}({', '.join(columns)}) AS (\n    VALUES\n        {values}\n)"
+
+
+class QueryTemplate:
+    """An SQL query with :name placeholders, parsed once and bound to different values many times.
+
+    Placeholders inside string literals are left alone. A list or tuple value is bound as a
+    comma-separated list, for use in `IN (:names)`. Binding the same values always gives the
+    same text, so repeated queries hit the query cache.
+    """
+
+    def __init__(self, sql):
+        self.sql = sql
+        # Alternating SQL text and placeholder names; even indexes are text
+        self._parts = [""]
+        for i, piece in enumerate(_STRING_LITERAL.split(sql)):
+            if i % 2:
+                self._parts[-1] += piece
+                continue
+            for j, token in enumerate(_PLACEHOLDER.split(piece)):
+                if j % 2:
+                    self._parts.append(token)
+                    self._parts.append("")
+                else:
+                    self._parts[-1] += token
+        self.params = frozenset(self._parts[1::2])
+
+    def bind(self, **params):
+        """Returns the query text with every placeholder replaced by the literal of its value."""
+        missing = self.params - params.keys()
+        unknown = params.keys() - self.params
+        if missing or unknown:
+            raise ValueError(f"Query parameters do not match the template: missing {sorted(missing)}, unknown {sorted(unknown)}")
+        literals = {name: sql_list(value) if isinstance(value, (list, tuple)) else sql_literal(value) for name, value in params.items()}
+        return "".join(part if i % 2 == 0 else literals[part] for i, part in enumerate(self._parts))
+
+    def __repr__(self):
+        return f"QueryTemplate(params={sorted(self.params)})"
@@ -0,0 +1,213 @@
+import pandas as pd
+import argparse
+import contextlib
+import hashlib
+import importlib.metadata
+import os
+import re
+import sqlite3
+import sys
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "perfetto_analysis")
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+# Bump when the meaning of cached results changes (e.g. how DataFrames are produced)
+CACHE_FORMAT_VERSION = 1
+INDEX_FILE_NAME = "index.sqlite"
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def tool_version():
+    """Version string stored in every cache key: cache format plus the trace processor package version."""
+    try:
+        perfetto_version = importlib.metadata.version("perfetto")
+    except importlib.metadata.PackageNotFoundError:
+        perfetto_version = "unknown"
+    return f"{CACHE_FORMAT_VERSION}/perfetto-{perfetto_version}"
+
+
+def normalize_query(sql):
+    """Collapses whitespace and drops a trailing ';' outside of string literals, so formatting changes keep cache hits."""
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class QueryCache:
+    """On-disk cache of query results keyed by trace content digest, normalized query text and tool version.
+
+    Results are stored as pickled DataFrames next to an SQLite index that tracks size and
+    last access time. When the cache grows beyond `max_bytes`, the least recently used
+    entries are evicted. Several processes may share one cache directory.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = tool_version()
+        os.makedirs(os.path.join(cache_dir, "entries"), exist_ok=True)
+        with self._connect() as con:
+            con.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, trace_digest TEXT, trace_path TEXT, query TEXT,
+                tool_version TEXT, size_bytes INTEGER, row_count INTEGER, created REAL, last_access REAL)""")
+            con.execute("""CREATE TABLE IF NOT EXISTS trace_digests (
+                path TEXT PRIMARY KEY, size_bytes INTEGER, mtime_ns INTEGER, digest TEXT)""")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        con = sqlite3.connect(os.path.join(self.cache_dir, INDEX_FILE_NAME), timeout=60)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, "entries", key[:2], key + ".pkl")
+
+    def trace_digest(self, trace_file):
+        """SHA-256 of the trace content, remembered per (path, size, mtime) so unchanged traces are hashed once."""
+        path = os.path.abspath(trace_file)
+        stat = os.stat(path)
+        with self._connect() as con:
+            row = con.execute("SELECT digest FROM trace_digests WHERE path = ? AND size_bytes = ? AND mtime_ns = ?",
+                              (path, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row:
+            return row[0]
+        digest = file_digest(path)
+        with self._connect() as con:
+            con.execute("INSERT OR REPLACE INTO trace_digests VALUES (?, ?, ?, ?)", (path, stat.st_size, stat.st_mtime_ns, digest))
+        return digest
+
+    def key(self, trace_digest, sql):
+        return hashlib.sha256("\0".join([trace_digest, normalize_query(sql), self.version]).encode()).hexdigest()
+
+    def get(self, key):
+        """Returns the cached DataFrame for `key`, or None."""
+        path = self._entry_path(key)
+        try:
+            df = pd.read_pickle(path)
+        except (FileNotFoundError, EOFError):
+            return None
+        with self._connect() as con:
+            con.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        return df
+
+    def put(self, key, df, trace_digest, trace_path, sql):
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+        now = time.time()
+        with self._connect() as con:
+            con.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (key, trace_digest, os.path.abspath(trace_path), normalize_query(sql), self.version,
+                         os.path.getsize(path), len(df), now, now))
+        self.evict()
+
+    def evict(self, max_bytes=None):
+        """Removes least recently used entries until the cache is at most `max_bytes`. Returns the number removed."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed = []
+        with self._connect() as con:
+            total = con.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM entries").fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            for key, size in con.execute("SELECT key, size_bytes FROM entries ORDER BY last_access"):
+                if total <= max_bytes:
+                    break
+                removed.append(key)
+                total -= size
+            con.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in removed])
+        for key in removed:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._entry_path(key))
+        return len(removed)
+
+    def entries(self):
+        with self._connect() as con:
+            return pd.read_sql_query(
+                "SELECT key, trace_path, trace_digest, tool_version, row_count, size_bytes, "
+                "datetime(created, 'unixepoch') AS created, datetime(last_access, 'unixepoch') AS last_access, query "
+                "FROM entries ORDER BY last_access DESC", con)
+
+    def purge(self, trace_file=None, older_than_s=None, stale_versions=False):
+        """Removes entries for one trace, entries not accessed within `older_than_s`, entries from other
+        tool versions, or (with no filter) everything. Returns the number of entries removed."""
+        conditions = []
+        params = []
+        if trace_file is not None:
+            conditions.append("trace_digest = ?")
+            params.append(self.trace_digest(trace_file))
+        if older_than_s is not None:
+            conditions.append("last_access < ?")
+            params.append(time.time() - older_than_s)
+        if stale_versions:
+            conditions.append("tool_version != ?")
+            params.append(self.version)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        with self._connect() as con:
+            keys = [row[0] for row in con.execute(f"SELECT key FROM entries{where}", params)]
+            con.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k in keys])
+        for key in keys:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._entry_path(key))
+        return len(keys)
+
+
+def add_cache_arguments(parser):
+    """Adds the --cache-dir/--cache-max-gb/--no-cache options shared by the pipeline entry points."""
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help=f"query result cache directory (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--cache-max-gb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3, help="evict least recently used cache entries above this size")
+    parser.add_argument("--no-cache", action="store_true", help="always load the trace and run every query")
+
+
+def cache_from_args(args):
+    if args.no_cache:
+        return None
+    return QueryCache(args.cache_dir, int(args.cache_max_gb * 1024 ** 3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and purge the extraction result cache.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="show number of entries and total size")
+    list_parser = subparsers.add_parser("list", help="list cached entries, most recently used first")
+    list_parser.add_argument("--limit", type=int, default=50)
+    purge_parser = subparsers.add_parser("purge", help="remove entries (all of them when no filter is given)")
+    purge_parser.add_argument("--trace", help="only entries of this trace file")
+    purge_parser.add_argument("--older-than-days", type=float, help="only entries not used for this many days")
+    purge_parser.add_argument("--stale-versions", action="store_true", help="only entries written by other tool versions")
+    evict_parser = subparsers.add_parser("evict", help="evict least recently used entries down to a size")
+    evict_parser.add_argument("max_gb", type=float)
+    args = parser.parse_args()
+
+    cache = QueryCache(args.cache_dir)
+    if args.command == "stats":
+        entries = cache.entries()
+        print(f"Cache directory: {args.cache_dir}")
+        print(f"Entries: {len(entries)} for {entries['trace_digest'].nunique()} traces")
+        print(f"Total size: {entries['size_bytes'].sum() / 1024 ** 2:.1f} MB (limit {cache.max_bytes / 1024 ** 3:.1f} GB)")
+    elif args.command == "list":
+        entries = cache.entries().head(args.limit)
+        entries["query"] = entries["query"].str.slice(0, 60)
+        print(entries.drop(columns=["key", "trace_digest"]).to_string(index=False))
+    elif args.command == "purge":
+        older_than_s = args.older_than_days * 86400 if args.older_than_days is not None else None
+        removed = cache.purge(args.trace, older_than_s, args.stale_versions)
+        print(f"Removed {removed} cache entries.")
+    elif args.command == "evict":
+        removed = cache.evict(int(args.max_gb * 1024 ** 3))
+        print(f"Evicted {removed} cache entries.")
+    sys.exit(0)
@@ -0,0 +1,79 @@
+from trace_session import TraceSession, DaemonSession
+from extract_metadata import extract_system_info, extract_process_info, extract_thread_info
+from extract_cpu_usage import extract_cpu_sched
+from extract_thread_states import extract_thread_states
+from extract_long_tasks import extract_long_tasks
+from extract_youtube_thread_cpu_states import extract_youtube_thread_cpu_states, YOUTUBE_PROCESS_NAME
+from query_cache import add_cache_arguments, cache_from_args
+from instrumentation import add_instrumentation_arguments, configure_from_args, span
+import identify_performance_anomalies
+import argparse
+import sys
+
+MAIN_THREAD_NAME = "com.google.android.youtube:main"
+ENGINES = ("pandas", "sql")
+
+
+def extract_all(session, engine="pandas"):
+    """Runs every extraction query against one loaded trace and returns the DataFrames by name.
+
+    With the "sql" engine the raw sched_slice and thread_state tables are not extracted:
+    cpu_sched and thread_states are the session itself, and the analyzers push their
+    aggregations down into trace processor.
+    """
+    tables = {}
+    tables["system_info"] = extract_system_info(session)
+    tables["process_info"] = extract_process_info(session)
+    tables["thread_info"] = extract_thread_info(session)
+    if engine == "sql":
+        tables["cpu_sched"] = session
+        tables["thread_states"] = session
+    else:
+        tables["cpu_sched"] = extract_cpu_sched(session)
+        tables["thread_states"] = extract_thread_states(session)
+    long_task_threshold_ns = identify_performance_anomalies.LONG_TASK_THRESHOLD_MS * 1_000_000
+    tables["long_tasks"] = extract_long_tasks(session, YOUTUBE_PROCESS_NAME, MAIN_THREAD_NAME, long_task_threshold_ns)
+    tables["yt_thread_states"] = extract_youtube_thread_cpu_states(session, YOUTUBE_PROCESS_NAME)
+    if tables["yt_thread_states"] is None:
+        print(f"Process '{YOUTUBE_PROCESS_NAME}' not found in the trace.")
+    return tables
+
+
+def run_pipeline(trace_file, output_report_path, engine="pandas", cache=None, daemon=False):
+    """With `daemon`, queries run in the trace daemon, which keeps the trace loaded for the next run."""
+    session_class = DaemonSession if daemon else TraceSession
+    with session_class(trace_file, cache=cache) as session:
+        with span("extract", "pipeline", engine=engine):
+            tables = extract_all(session, engine)
+        with span("identify_performance_anomalies", "pipeline", engine=engine):
+            identify_performance_anomalies.main(
+                tables["system_info"],
+                tables["cpu_sched"],
+                tables["long_tasks"],
+                tables["yt_thread_states"],
+                tables["thread_states"],
+                output_report_path,
+            )
+        session.print_timings()
+    return tables
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract all tables from one trace and write the performance anomalies report.")
+    parser.add_argument("trace_file_path")
+    parser.add_argument("output_report_md")
+    parser.add_argument("engine", nargs="?", choices=ENGINES, default="pandas",
+                        help="the sql engine runs the sched-based analyses as aggregation queries inside trace processor")
+    parser.add_argument("--daemon", action="store_true", help="query the trace through the trace daemon (see trace_daemon.py), starting it if needed")
+    add_cache_arguments(parser)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    try:
+        run_pipeline(args.trace_file_path, args.output_report_md, args.engine, cache_from_args(args), args.daemon)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
+
+    print("Pipeline complete.")
@@ -0,0 +1,126 @@
+from table_io import read_table, write_table
+import argparse
+import numpy as np
+import pandas as pd
+import sys
+
+SLICE_COLUMNS = ["cpu", "ts", "dur", "utid", "process_name", "thread_name"]
+# Competing threads listed per long task by the CLI
+DEFAULT_TOP_N = 5
+
+
+class SchedIndex:
+    """Sched slices sorted by (cpu, ts) for batched "what ran on each CPU during [start, end)" queries.
+
+    Slices of one CPU do not overlap, so for each CPU the slices overlapping a range are a
+    contiguous run found with two binary searches: one over the start times and one over the
+    running maximum of the end times (which keeps the search correct even if some slices do
+    overlap). All ranges of a query are searched at once per CPU, so thousands of long tasks
+    cost a few vectorized searchsorted calls instead of a scan of the table per task.
+    """
+
+    def __init__(self, cpu_sched):
+        cpu = cpu_sched["cpu"].to_numpy()
+        ts = cpu_sched["ts"].to_numpy(dtype=np.int64)
+        order = np.lexsort((ts, cpu))
+        self.slices = cpu_sched.iloc[order].reset_index(drop=True)
+        self.ts = ts[order]
+        self.end = self.ts + np.maximum(cpu_sched["dur"].to_numpy(dtype=np.int64)[order], 0)
+        cpu = cpu[order]
+        self.cpus, self._cpu_start = np.unique(cpu, return_index=True)
+        self._cpu_stop = np.append(self._cpu_start[1:], len(cpu))
+        self._max_end = pd.Series(self.end).groupby(cpu).cummax().to_numpy()
+
+    def __len__(self):
+        return len(self.slices)
+
+    def overlapping(self, starts, ends):
+        """Finds the slices overlapping each [starts[i], ends[i]) range.
+
+        Returns (query, row, overlap_ns) arrays with one entry per overlapping (range, slice)
+        pair: `query` indexes the ranges, `row` indexes `slices` and overlap_ns is the time the
+        slice ran inside the range.
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        queries = np.arange(len(starts))
+        first_rows = []
+        counts = []
+        for lo, hi in zip(self._cpu_start, self._cpu_stop):
+            first = lo + np.searchsorted(self._max_end[lo:hi], starts, side="right")
+            last = lo + np.searchsorted(self.ts[lo:hi], ends, side="left")
+            first_rows.append(first)
+            counts.append(np.maximum(last - first, 0))
+        first_rows = np.concatenate(first_rows) if first_rows else np.zeros(0, dtype=np.int64)
+        counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+        query = np.repeat(np.tile(queries, len(self.cpus)), counts)
+        # Number the slices of each (range, CPU) run: first row + 0, 1, ... count - 1
+        row = np.repeat(first_rows, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        overlap = np.minimum(self.end[row], ends[query]) - np.maximum(self.ts[row], starts[query])
+        keep = overlap > 0
+        return query[keep], row[keep], overlap[keep]
+
+    def query(self, starts, ends):
+        """Returns the slices overlapping each range as a DataFrame with a `query` column and overlap_ns."""
+        query, row, overlap = self.overlapping(starts, ends)
+        result = self.slices.iloc[row].reset_index(drop=True)
+        result.insert(0, "query", query)
+        result["overlap_ns"] = overlap
+        return result
+
+    def running_at(self, ts):
+        """Returns the slice running on each CPU at `ts`."""
+        return self.query([ts], [ts + 1]).drop(columns=["query", "overlap_ns"])
+
+
+def competing_threads(index, tasks, per_cpu=False):
+    """Returns the CPU time other threads got while each task ran, one row per (task, process_name, thread_name).
+
+    `tasks` needs ts, dur and utid columns; the task's own thread and the idle thread (utid 0)
+    are left out. The result has `task` (the position of the task in `tasks`), process_name,
+    thread_name, overlap_ns and cpu_count (the number of CPUs the thread ran on meanwhile).
+    With per_cpu, there is one row per CPU as well, with a cpu column instead of cpu_count.
+    """
+    starts = tasks["ts"].to_numpy(dtype=np.int64)
+    overlaps = index.query(starts, starts + tasks["dur"].to_numpy(dtype=np.int64))
+    task_utid = tasks["utid"].to_numpy()[overlaps["query"].to_numpy()]
+    overlaps = overlaps[(overlaps["utid"].to_numpy() != 0) & (overlaps["utid"].to_numpy() != task_utid)]
+    overlaps = overlaps.rename(columns={"query": "task"})
+    if per_cpu:
+        return overlaps.groupby(["task", "process_name", "thread_name", "cpu"], observed=True, dropna=False)["overlap_ns"].sum().reset_index()
+    return (overlaps.groupby(["task", "process_name", "thread_name"], observed=True, dropna=False)
+            .agg(overlap_ns=("overlap_ns", "sum"), cpu_count=("cpu", "nunique"))
+            .reset_index())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index sched slices by CPU and time, and report what ran during long tasks or at a timestamp.")
+    parser.add_argument("cpu_sched_table")
+    parser.add_argument("--tasks", help="long tasks table (from extract_long_tasks.py) to find competing threads for")
+    parser.add_argument("--output", help="output table of competing threads per task (.csv, .parquet, .arrow or .cols)")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_N, help="competing threads kept per task")
+    parser.add_argument("--at", type=int, help="print the slice running on every CPU at this timestamp (ns)")
+    args = parser.parse_args()
+    if (args.tasks is None) == (args.at is None) or (args.tasks and not args.output):
+        parser.error("give either --tasks with --output, or --at")
+
+    try:
+        index = SchedIndex(read_table(args.cpu_sched_table, columns=SLICE_COLUMNS))
+        if args.at is not None:
+            running = index.running_at(args.at)
+            if running.empty:
+                print(f"Nothing was running at {args.at}.")
+            for _, row in running.iterrows():
+                print(f"CPU {row['cpu']}: {row['process_name']} / {row['thread_name']} (utid {row['utid']}, {row['ts']} + {row['dur']} ns)")
+            sys.exit(0)
+
+        tasks = read_table(args.tasks)
+        competing = competing_threads(index, tasks)
+        competing = competing.sort_values(["task", "overlap_ns"], ascending=[True, False]).groupby("task").head(args.top)
+        task_columns = tasks[["slice_name", "ts", "dur"]].rename(columns={"ts": "task_ts", "dur": "task_dur"})
+        result = competing.join(task_columns, on="task")
+        write_table(result[["task", "slice_name", "task_ts", "task_dur", "process_name", "thread_name", "cpu_count", "overlap_ns"]], args.output)
+        print(f"Competing threads of {len(tasks)} tasks saved to {args.output}")
+    except FileNotFoundError as e:
+        print(f"Error: Input file not found: {e.filename}")
+        sys.exit(1)
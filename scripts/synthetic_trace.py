@@ -0,0 +1,198 @@
+from table_io import write_table
+from identify_performance_anomalies import YOUTUBE_PROCESS_NAME, CRITICAL_YOUTUBE_THREADS
+from extract_process_thread_states import state_column, STATE_COLUMNS
+import numpy as np
+import pandas as pd
+import os
+import sys
+
+# Synthetic traces start at 1000 s and use microsecond timestamps, the resolution of the systrace text format
+TRACE_START_NS = 1_000_000_000_000
+CPU_COUNT = 8
+MEAN_SLICE_NS = 1_000_000
+IDLE_FRACTION = 0.2
+END_STATES = ["S", "R", "D", "R+"]
+END_STATE_WEIGHTS = [0.5, 0.3, 0.1, 0.1]
+BLOCKED_FUNCTIONS = ["io_schedule", "folio_wait_bit_common", "mutex_lock", "binder_wait_for_work"]
+# Main-thread slices (one per this many sched slices) with exponential durations of this mean
+MAIN_THREAD_SLICE_EVERY = 100
+MEAN_MAIN_THREAD_SLICE_NS = 6_000_000
+MAIN_THREAD_NAME = "com.google.android.youtube:main"
+TABLE_NAMES = ["system_info", "cpu_sched", "thread_states", "long_tasks", "yt_thread_states"]
+
+
+def _round_us(values):
+    return np.maximum(np.round(values / 1000).astype(np.int64), 1) * 1000
+
+
+def _threads(thread_count, rng):
+    """Returns the thread table (utid, tid, thread_name, upid, pid, process_name). utid 0 is the idle thread."""
+    process_count = max(2, thread_count // 8)
+    upid = np.concatenate([[0], rng.integers(1, process_count + 1, thread_count)])
+    # The first threads belong to YouTube (upid 1) and carry its main and critical thread names
+    critical = [MAIN_THREAD_NAME] + [t for t in CRITICAL_YOUTUBE_THREADS if t != MAIN_THREAD_NAME]
+    upid[1:len(critical) + 1] = 1
+    thread_name = np.array(["swapper"] + [f"worker_{utid}" for utid in range(1, thread_count + 1)], dtype=object)
+    thread_name[1:len(critical) + 1] = critical
+    process_names = np.array([None, YOUTUBE_PROCESS_NAME] + [f"com.example.app{i}" for i in range(2, process_count + 1)], dtype=object)
+    return pd.DataFrame({
+        "utid": np.arange(thread_count + 1),
+        "tid": np.where(upid == 0, 0, 20000 + np.arange(thread_count + 1)),
+        "thread_name": thread_name,
+        "upid": upid,
+        "pid": np.where(upid == 0, 0, 10000 + upid),
+        "process_name": process_names[upid],
+    })
+
+
+def synthetic_tables(slice_count, thread_count=None, cpu_count=CPU_COUNT, seed=0):
+    """Generates the tables the extractors produce, with `slice_count` sched slices.
+
+    Each CPU runs back-to-back slices; every thread is pinned to CPU utid % cpu_count so no
+    thread runs twice at the same time. Thread states are derived from the sched slices
+    (a Running interval followed by the slice's end state until the thread runs again).
+    Returns a dict of DataFrames named like run_pipeline.extract_all's tables.
+    """
+    rng = np.random.default_rng(seed)
+    thread_count = thread_count or max(32, slice_count // 500)
+    threads = _threads(thread_count, rng)
+
+    cpu = np.arange(slice_count) % cpu_count
+    order = np.argsort(cpu, kind="stable")
+    cpu = cpu[order]
+    dur = _round_us(rng.exponential(MEAN_SLICE_NS, slice_count))
+    # Pick a thread of the slice's CPU (or the idle thread) for every slice
+    per_cpu_threads = [np.arange(1, thread_count + 1)[np.arange(1, thread_count + 1) % cpu_count == c] for c in range(cpu_count)]
+    utid = np.zeros(slice_count, dtype=np.int64)
+    for c, candidates in enumerate(per_cpu_threads):
+        on_cpu = np.flatnonzero(cpu == c)
+        if len(candidates):
+            utid[on_cpu] = candidates[rng.integers(0, len(candidates), len(on_cpu))]
+    utid[rng.random(slice_count) < IDLE_FRACTION] = 0
+    cpu_start = np.searchsorted(cpu, np.arange(cpu_count))
+    ts = np.cumsum(dur) - dur
+    ts = ts - np.repeat(ts[cpu_start], np.diff(np.append(cpu_start, slice_count))) + TRACE_START_NS
+    end_state = np.where(utid == 0, "R", rng.choice(END_STATES, slice_count, p=END_STATE_WEIGHTS))
+
+    cpu_sched = pd.DataFrame({"utid": utid, "cpu": cpu, "ts": ts, "dur": dur, "end_state": end_state})
+    cpu_sched = cpu_sched.merge(threads[["utid", "thread_name", "process_name", "upid"]], on="utid").sort_values(["ts", "cpu"], ignore_index=True)
+    cpu_sched = cpu_sched[["thread_name", "process_name", "upid", "utid", "cpu", "ts", "dur", "end_state"]]
+    trace_end = int((cpu_sched["ts"] + cpu_sched["dur"]).max())
+
+    runs = cpu_sched[cpu_sched["utid"] != 0].sort_values(["utid", "ts"])
+    next_ts = runs.groupby("utid")["ts"].shift(-1).fillna(trace_end).astype(np.int64)
+    state_ts = runs["ts"] + runs["dur"]
+    is_d = runs["end_state"].to_numpy() == "D"
+    blocked = np.where(is_d, rng.choice(BLOCKED_FUNCTIONS, len(runs)), None)
+    thread_states = pd.concat([
+        pd.DataFrame({"utid": runs["utid"], "thread_name": runs["thread_name"], "process_name": runs["process_name"],
+                      "ts": runs["ts"], "dur": runs["dur"], "state": "Running", "blocked_function": None}),
+        pd.DataFrame({"utid": runs["utid"], "thread_name": runs["thread_name"], "process_name": runs["process_name"],
+                      "ts": state_ts, "dur": next_ts - state_ts, "state": runs["end_state"], "blocked_function": blocked}),
+    ]).sort_values(["ts", "utid"], ignore_index=True)
+
+    main_slice_count = max(1, slice_count // MAIN_THREAD_SLICE_EVERY)
+    main_dur = _round_us(rng.exponential(MEAN_MAIN_THREAD_SLICE_NS, main_slice_count))
+    gaps = _round_us(rng.exponential(MEAN_MAIN_THREAD_SLICE_NS, main_slice_count))
+    main_ts = TRACE_START_NS + np.cumsum(gaps + main_dur) - main_dur
+    main_thread = threads[threads["thread_name"] == MAIN_THREAD_NAME].iloc[0]
+    main_slices = pd.DataFrame({
+        "slice_name": [f"Choreographer#doFrame {i}" for i in range(main_slice_count)],
+        "thread_name": MAIN_THREAD_NAME, "process_name": YOUTUBE_PROCESS_NAME,
+        "ts": main_ts, "dur": main_dur, "utid": main_thread["utid"], "upid": main_thread["upid"],
+    })
+    long_tasks = main_slices[main_slices["dur"] > 16_000_000].sort_values("dur", ascending=False, ignore_index=True)
+
+    youtube_utids = threads.loc[threads["process_name"] == YOUTUBE_PROCESS_NAME, ["utid", "thread_name"]]
+    running = cpu_sched.groupby("utid")["dur"].sum().rename("total_running_ns")
+    not_running = thread_states[thread_states["state"] != "Running"]
+    state_totals = not_running.pivot_table(index="utid", columns="state", values="dur", aggfunc="sum", fill_value=0)
+    state_totals.columns = [state_column(s) for s in state_totals.columns]
+    yt_thread_states = youtube_utids.join(running, on="utid").join(state_totals, on="utid")
+    yt_thread_states = yt_thread_states.reindex(columns=["thread_name", "total_running_ns", *STATE_COLUMNS.values()]).fillna(0)
+    yt_thread_states = yt_thread_states.astype({c: np.int64 for c in yt_thread_states.columns[1:]})
+
+    system_info = pd.DataFrame({
+        "name": ["trace_uuid", "trace_size_bytes", "perf_samples_skipped"],
+        "str_value": [f"00000000-0000-0000-0000-{slice_count:012d}", None, None],
+        "int_value": pd.array([None, slice_count * 64, 0], dtype="Int64"),
+    })
+    return {
+        "system_info": system_info,
+        "cpu_sched": cpu_sched,
+        "thread_states": thread_states,
+        "long_tasks": long_tasks,
+        "yt_thread_states": yt_thread_states,
+        "threads": threads,
+        "main_slices": main_slices,
+    }
+
+
+def _task(comm, pid, tgid):
+    return f"{comm:>16}-{pid:<5} ({tgid:>5})"
+
+
+def write_systrace(tables, path):
+    """Writes the sched slices and main-thread slices of synthetic_tables() as a systrace text trace.
+
+    Trace processor parses the sched_switch lines into sched_slice and thread_state and the
+    tracing_mark_write B/E lines into slices, so the extractors can be run against the file.
+    """
+    threads = tables["threads"].set_index("utid")
+    comm = {utid: ("<idle>" if utid == 0 else str(name)[-15:]) for utid, name in threads["thread_name"].items()}
+    tid = threads["tid"].to_dict()
+    tgid = {utid: ("-----" if pid == 0 else pid) for utid, pid in threads["pid"].items()}
+
+    events = []
+    sched = tables["cpu_sched"].sort_values(["cpu", "ts"])
+    for cpu, slices in sched.groupby("cpu"):
+        prev_utid = 0
+        prev_state = "R"
+        for utid, ts, end_state in zip(slices["utid"], slices["ts"], slices["end_state"]):
+            prev_comm = f"swapper/{cpu}" if prev_utid == 0 else comm[prev_utid]
+            next_comm = f"swapper/{cpu}" if utid == 0 else comm[utid]
+            events.append((ts, f"{_task(comm[prev_utid], tid[prev_utid], tgid[prev_utid])} [{cpu:03d}] d..2 {ts / 1e9:.6f}: sched_switch: "
+                               f"prev_comm={prev_comm} prev_pid={tid[prev_utid]} prev_prio=120 prev_state={prev_state} ==> "
+                               f"next_comm={next_comm} next_pid={tid[utid]} next_prio=120"))
+            prev_utid, prev_state = utid, end_state
+
+    main = tables["main_slices"]
+    main_utid = int(main["utid"].iloc[0])
+    main_task = _task(comm[main_utid], tid[main_utid], tgid[main_utid])
+    main_cpu = main_utid % CPU_COUNT
+    for name, ts, dur in zip(main["slice_name"], main["ts"], main["dur"]):
+        events.append((ts, f"{main_task} [{main_cpu:03d}] ...1 {ts / 1e9:.6f}: tracing_mark_write: B|{tgid[main_utid]}|{name}"))
+        events.append((ts + dur, f"{main_task} [{main_cpu:03d}] ...1 {(ts + dur) / 1e9:.6f}: tracing_mark_write: E|{tgid[main_utid]}"))
+    events.sort(key=lambda e: e[0])
+
+    with open(path, "w") as f:
+        f.write("# tracer: nop\n#\n#           TASK-PID    TGID   CPU#  ||||    TIMESTAMP  FUNCTION\n#              | |        |      |   ||||       |         |\n")
+        for _, line in events:
+            f.write(line)
+            f.write("\n")
+
+
+def write_dataset(tables, output_dir, table_format="parquet"):
+    """Writes the extractor tables of synthetic_tables() to `output_dir`/<name>.<table_format>. Returns their paths by name."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for name in TABLE_NAMES:
+        paths[name] = os.path.join(output_dir, f"{name}.{table_format}")
+        write_table(tables[name], paths[name])
+    return paths
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python synthetic_trace.py <slice_count> <output_dir> [seed]")
+        print("Writes the synthetic extractor tables as Parquet files and a systrace text trace (trace.systrace) to output_dir.")
+        sys.exit(1)
+
+    slice_count = int(sys.argv[1])
+    output_dir = sys.argv[2]
+    seed = int(sys.argv[3]) if len(sys.argv) == 4 else 0
+
+    tables = synthetic_tables(slice_count, seed=seed)
+    write_dataset(tables, output_dir)
+    write_systrace(tables, os.path.join(output_dir, "trace.systrace"))
+    print(f"Synthetic dataset with {len(tables['cpu_sched'])} sched slices and {len(tables['thread_states'])} thread states saved to {output_dir}")
@@ -0,0 +1,288 @@
+from instrumentation import span
+import numpy as np
+import pandas as pd
+import glob
+import json
+import os
+
+# String columns that repeat the same few values on millions of rows. In the
+# columnar formats they are stored dictionary-encoded and read back as pandas
+# categoricals.
+DICTIONARY_COLUMNS = ["thread_name", "process_name", "slice_name", "state", "end_state", "blocked_function"]
+
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+ARROW_EXTENSIONS = (".arrow", ".feather")
+# A column store is a directory holding one uncompressed .npy file per column (string
+# columns as integer codes plus a dictionary in the metadata file), read back memory-mapped.
+COLUMN_STORE_EXTENSIONS = (".cols",)
+COLUMN_STORE_META = "columns.json"
+COMPRESSION = "zstd"
+# Rows per chunk when a single file is read incrementally
+READ_CHUNK_ROWS = 1_000_000
+
+
+def table_format(path):
+    """Returns "parquet", "arrow", "columns" or "csv" depending on the file extension of `path`."""
+    ext = os.path.splitext(str(path).rstrip(os.sep))[1].lower()
+    if ext in PARQUET_EXTENSIONS:
+        return "parquet"
+    if ext in COLUMN_STORE_EXTENSIONS:
+        return "columns"
+    if ext in ARROW_EXTENSIONS:
+        return "arrow"
+    return "csv"
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet/Arrow output requires pyarrow. Install it with 'pip install pyarrow' or use a .csv path.")
+    return pyarrow
+
+
+def _json_scalar(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def write_columns(df, path):
+    """Writes `df` as a column store directory: one .npy file per column and a columns.json describing them.
+
+    Numeric columns are saved as they are, nullable integer columns as values plus a null mask
+    and every other column dictionary-encoded, with its codes saved as the categorical codes
+    pandas would use and its distinct values in columns.json.
+    """
+    os.makedirs(path, exist_ok=True)
+    for stale in glob.glob(os.path.join(str(path), "*.npy")) + glob.glob(os.path.join(str(path), COLUMN_STORE_META)):
+        os.remove(stale)
+    meta = {"row_count": len(df), "columns": []}
+    for index, column in enumerate(df.columns):
+        values = df[column]
+        entry = {"name": column, "file": f"c{index:03d}.npy"}
+        if isinstance(values.dtype, pd.CategoricalDtype) or not (pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype)):
+            categorical = values.astype("category").array
+            entry["kind"] = "dictionary"
+            entry["dictionary"] = [_json_scalar(v) for v in categorical.categories]
+            data = categorical.codes
+        elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+            entry["kind"] = "masked"
+            entry["dtype"] = str(values.dtype)
+            entry["mask_file"] = f"c{index:03d}.mask.npy"
+            data = values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0)
+            np.save(os.path.join(str(path), entry["mask_file"]), values.isna().to_numpy())
+        else:
+            entry["kind"] = "numeric"
+            data = values.to_numpy()
+        np.save(os.path.join(str(path), entry["file"]), np.ascontiguousarray(data))
+        meta["columns"].append(entry)
+    # Written last: a directory without it is not a complete column store
+    with open(os.path.join(str(path), COLUMN_STORE_META), "w") as f:
+        json.dump(meta, f)
+
+
+def is_column_store(path):
+    return os.path.isfile(os.path.join(str(path), COLUMN_STORE_META))
+
+
+class ColumnStore:
+    """A column store directory with every column memory-mapped read-only.
+
+    `array` returns the raw NumPy memmap of a column (the codes of a dictionary column) and
+    `to_frame` wraps the memmaps in a DataFrame without copying them, so processes reading
+    the same store share one page-cached copy of the data.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(str(path), COLUMN_STORE_META)) as f:
+            meta = json.load(f)
+        self.row_count = meta["row_count"]
+        self._columns = {entry["name"]: entry for entry in meta["columns"]}
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def __len__(self):
+        return self.row_count
+
+    def array(self, name):
+        return np.load(os.path.join(str(self.path), self._columns[name]["file"]), mmap_mode="r")
+
+    def dictionary(self, name):
+        """Returns the distinct values of a dictionary column, indexed by code, or None for other columns."""
+        return self._columns[name].get("dictionary")
+
+    def column(self, name):
+        entry = self._columns[name]
+        # A plain ndarray view of the memmap, so pandas results are not memmap subclasses
+        data = self.array(name).view(np.ndarray)
+        if entry["kind"] == "dictionary":
+            return pd.Series(pd.Categorical.from_codes(data, categories=entry["dictionary"], validate=False), name=name, copy=False)
+        if entry["kind"] == "masked":
+            mask = np.load(os.path.join(str(self.path), entry["mask_file"]), mmap_mode="r").view(np.ndarray)
+            array_type = pd.api.types.pandas_dtype(entry["dtype"]).construct_array_type()
+            return pd.Series(array_type(data, mask, copy=False), name=name, copy=False)
+        return pd.Series(data, name=name, copy=False)
+
+    def to_frame(self, columns=None):
+        names = self.columns if columns is None else [c for c in columns if c in self._columns]
+        return pd.DataFrame({name: self.column(name) for name in names}, copy=False)
+
+
+def write_table(df, path):
+    """Writes `df` to `path` in the format selected by its extension (.parquet/.pq, .arrow/.feather, .cols or CSV)."""
+    with span(os.path.basename(str(path).rstrip(os.sep)), "serialization", path=str(path), mode="write") as s:
+        s.rows = len(df)
+        _write_table(df, path)
+
+
+def _write_table(df, path):
+    fmt = table_format(path)
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+        return
+    if fmt == "columns":
+        write_columns(df, path)
+        return
+
+    pa = _import_pyarrow()
+    df = df.copy(deep=False)
+    for column in DICTIONARY_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype("category")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if fmt == "parquet":
+        pa.parquet.write_table(table, path, compression=COMPRESSION, use_dictionary=True)
+    else:
+        pa.feather.write_feather(table, path, compression=COMPRESSION)
+
+
+def read_table(path, columns=None):
+    """Reads a table written by `write_table`, loading only `columns` when given.
+
+    Requested columns that are not present in the file are ignored, so callers can
+    list every column they might use. Column stores are memory-mapped, not read.
+    """
+    with span(os.path.basename(str(path).rstrip(os.sep)), "serialization", path=str(path), mode="read") as s:
+        df = _read_table(path, columns)
+        s.rows = len(df)
+    return df
+
+
+def _read_table(path, columns):
+    fmt = table_format(path)
+    if fmt == "columns":
+        return ColumnStore(path).to_frame(columns)
+    if fmt == "csv":
+        if columns is None:
+            return pd.read_csv(path)
+        wanted = set(columns)
+        return pd.read_csv(path, usecols=lambda c: c in wanted)
+
+    pa = _import_pyarrow()
+    if fmt == "parquet":
+        if columns is not None:
+            present = pa.parquet.read_schema(path).names
+            columns = [c for c in columns if c in present]
+        return pa.parquet.read_table(path, columns=columns).to_pandas()
+    if columns is not None:
+        with pa.memory_map(str(path)) as source:
+            present = pa.ipc.open_file(source).schema.names
+        columns = [c for c in columns if c in present]
+    return pa.feather.read_table(path, columns=columns).to_pandas()
+
+
+def _part_paths(path):
+    return sorted(glob.glob(os.path.join(str(path), "part-*")))
+
+
+def write_table_chunks(chunks, path):
+    """Writes each DataFrame from `chunks` as soon as it arrives to `path`/part-NNNNN.<ext>.
+
+    `path` is a directory; the format of the parts follows its extension, e.g. a
+    directory named cpu_sched_slices.parquet holds Parquet parts. Returns the
+    number of rows written.
+    """
+    os.makedirs(path, exist_ok=True)
+    for stale in _part_paths(path):
+        os.remove(stale)
+    ext = os.path.splitext(str(path).rstrip(os.sep))[1] or ".csv"
+    row_count = 0
+    for index, chunk in enumerate(chunks):
+        write_table(chunk, os.path.join(str(path), f"part-{index:05d}{ext}"))
+        row_count += len(chunk)
+    return row_count
+
+
+def iter_table_chunks(path, columns=None, chunk_rows=READ_CHUNK_ROWS):
+    """Yields DataFrames from a chunk directory (one per part) or from a single table file.
+
+    Single files are read incrementally too: CSV by `chunk_rows` rows, Parquet by
+    row batches and Arrow by record batches.
+    """
+    if is_column_store(path):
+        # Slices of the memory-mapped columns; nothing is read until a chunk is used
+        table = read_table(path, columns=columns)
+        for start in range(0, len(table), chunk_rows):
+            yield table.iloc[start:start + chunk_rows]
+        return
+    if os.path.isdir(path):
+        for part in _part_paths(path):
+            yield read_table(part, columns=columns)
+        return
+
+    fmt = table_format(path)
+    if fmt == "csv":
+        usecols = None if columns is None else (lambda c, wanted=set(columns): c in wanted)
+        try:
+            yield from pd.read_csv(path, usecols=usecols, chunksize=chunk_rows)
+        except pd.errors.EmptyDataError:
+            return
+        return
+
+    pa = _import_pyarrow()
+    if fmt == "parquet":
+        parquet_file = pa.parquet.ParquetFile(path)
+        if columns is not None:
+            columns = [c for c in columns if c in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        if columns is not None:
+            columns = [c for c in columns if c in reader.schema.names]
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            yield batch.to_pandas()
+
+
+class ChunkedTable:
+    """A table on disk that is read one chunk at a time. Can be iterated any number of times.
+
+    With `transform`, every chunk is passed through it as it is read.
+    """
+
+    def __init__(self, path, columns=None, transform=None):
+        self.path = path
+        self.columns = columns
+        self.transform = transform
+
+    def __iter__(self):
+        chunks = iter_table_chunks(self.path, columns=self.columns)
+        if self.transform is None:
+            return chunks
+        return map(self.transform, chunks)
+
+
+def iter_chunks(table):
+    """Yields the DataFrames of `table`, which is either a DataFrame (one chunk) or a ChunkedTable."""
+    if isinstance(table, pd.DataFrame):
+        yield table
+    else:
+        yield from table
@@ -0,0 +1,369 @@
+from instrumentation import rss_bytes
+from multiprocessing.connection import Client, Listener
+import argparse
+import collections
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Same directory as query_cache.DEFAULT_CACHE_DIR; not imported from there so that clients
+# of the daemon do not pay for importing pandas.
+DAEMON_DIR = os.path.join(os.path.expanduser("~"), ".cache", "perfetto_analysis")
+DEFAULT_SOCKET = os.path.join(DAEMON_DIR, "trace_daemon.sock")
+DEFAULT_MEMORY_BUDGET_GB = 4.0
+# How long `start_daemon` waits for a new daemon to accept connections
+START_TIMEOUT_S = 15
+
+
+class DaemonError(Exception):
+    """Raised by the client when the daemon cannot be reached or a request fails in it."""
+
+
+def plain_rows(df):
+    """Returns the rows of `df` as lists of plain Python values, with None for NULLs (not NaN)."""
+    return df.astype(object).where(df.notna(), None).to_numpy().tolist()
+
+
+def _open_trace_processor(trace_file):
+    from perfetto.trace_processor import TraceProcessor
+    return TraceProcessor(trace=trace_file)
+
+
+class _LoadedTrace:
+    """One trace of the daemon. `lock` serializes the queries, loading and closing of its trace processor."""
+
+    def __init__(self, trace_file):
+        self.trace_file = trace_file
+        self.lock = threading.Lock()
+        self.tp = None
+        self.load_s = None
+        self.queries = 0
+        self.last_used = time.time()
+
+    def rss(self):
+        process = getattr(self.tp, "subprocess", None)
+        return rss_bytes(process.pid) if process is not None else 0
+
+
+class TraceDaemon:
+    """Keeps recently used traces loaded in trace_processor and answers queries against them.
+
+    Clients connect over a unix socket (see `DaemonClient`). Each connection is served by its
+    own thread; queries against the same trace run one at a time, queries against different
+    traces run concurrently. After every load, the least recently used traces are closed
+    until the trace_processor shells together use at most `memory_budget` bytes of RSS.
+    The trace just loaded is always kept, even if it alone exceeds the budget.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, memory_budget=int(DEFAULT_MEMORY_BUDGET_GB * 1024 ** 3)):
+        self.socket_path = socket_path
+        self.memory_budget = memory_budget
+        self._traces = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def _entry(self, trace_file):
+        """Returns the loaded entry of `trace_file` with its lock held; the caller releases it."""
+        while True:
+            with self._lock:
+                entry = self._traces.get(trace_file)
+                if entry is None:
+                    entry = self._traces[trace_file] = _LoadedTrace(trace_file)
+                self._traces.move_to_end(trace_file)
+            entry.lock.acquire()
+            if self._traces.get(trace_file) is entry:
+                break
+            # Evicted between the lookup and taking its lock
+            entry.lock.release()
+
+        if entry.tp is None:
+            start = time.perf_counter()
+            try:
+                entry.tp = _open_trace_processor(trace_file)
+            except BaseException:
+                with self._lock:
+                    self._traces.pop(trace_file, None)
+                entry.lock.release()
+                raise
+            entry.load_s = time.perf_counter() - start
+            print(f"Loaded {trace_file} in {entry.load_s:.1f} s", flush=True)
+            entry.lock.release()
+            self._evict(keep=trace_file)
+            return self._entry(trace_file)
+        entry.last_used = time.time()
+        return entry
+
+    def _evict(self, keep=None):
+        with self._lock:
+            entries = list(self._traces.values())
+        total = sum(entry.rss() for entry in entries)
+        for entry in entries:
+            if total <= self.memory_budget:
+                break
+            if entry.trace_file == keep:
+                continue
+            rss = entry.rss()
+            self.close_trace(entry.trace_file)
+            total -= rss
+            print(f"Evicted {entry.trace_file} ({rss / 1024 ** 2:.0f} MB)", flush=True)
+
+    def close_trace(self, trace_file):
+        with self._lock:
+            entry = self._traces.pop(trace_file, None)
+        if entry is None:
+            return False
+        with entry.lock:
+            if entry.tp is not None:
+                entry.tp.close()
+                entry.tp = None
+        return True
+
+    def load(self, trace_file):
+        with self._lock:
+            warm = trace_file in self._traces and self._traces[trace_file].tp is not None
+        entry = self._entry(trace_file)
+        try:
+            return {"warm": warm, "load_s": entry.load_s}
+        finally:
+            entry.lock.release()
+
+    def query(self, trace_file, sql, frame=False):
+        """Returns the result as a DataFrame, or with frame False as {"columns", "rows"} of plain values."""
+        entry = self._entry(trace_file)
+        try:
+            entry.queries += 1
+            df = entry.tp.query(sql).as_pandas_dataframe()
+        finally:
+            entry.lock.release()
+        if frame:
+            return df
+        return {"columns": list(df.columns), "rows": plain_rows(df)}
+
+    def status(self):
+        with self._lock:
+            entries = list(self._traces.values())
+        now = time.time()
+        return {
+            "pid": os.getpid(),
+            "memory_budget": self.memory_budget,
+            "traces": [{"trace": e.trace_file, "rss": e.rss(), "load_s": e.load_s, "queries": e.queries,
+                        "idle_s": now - e.last_used} for e in entries if e.tp is not None],
+        }
+
+    def handle(self, request):
+        op = request.get("op")
+        if op == "ping":
+            return "pong"
+        if op == "load":
+            return self.load(request["trace"])
+        if op == "query":
+            return self.query(request["trace"], request["sql"], request.get("frame", False))
+        if op == "status":
+            return self.status()
+        if op == "evict":
+            if request.get("trace"):
+                return [request["trace"]] if self.close_trace(request["trace"]) else []
+            with self._lock:
+                loaded = list(self._traces)
+            return [trace_file for trace_file in loaded if self.close_trace(trace_file)]
+        if op == "shutdown":
+            self._stopping = True
+            return "stopping"
+        raise ValueError(f"unknown request {op!r}")
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = {"ok": True, "result": self.handle(request)}
+                except Exception as e:
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                try:
+                    conn.send(response)
+                except OSError:
+                    return
+                if self._stopping:
+                    # Wakes up the accept() in `serve` so that it sees the flag
+                    try:
+                        Client(self.socket_path, family="AF_UNIX").close()
+                    except OSError:
+                        pass
+                    return
+
+    def serve(self):
+        if is_running(self.socket_path):
+            raise DaemonError(f"a trace daemon is already listening on {self.socket_path}")
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        listener = Listener(self.socket_path, family="AF_UNIX")
+        # Requests are pickled; only this user may connect
+        os.chmod(self.socket_path, 0o600)
+        print(f"Trace daemon {os.getpid()} listening on {self.socket_path} "
+              f"(memory budget {self.memory_budget / 1024 ** 3:.1f} GB)", flush=True)
+        try:
+            while not self._stopping:
+                conn = listener.accept()
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            self.handle({"op": "evict"})
+            print("Trace daemon stopped.", flush=True)
+
+
+class DaemonClient:
+    """One connection to a running trace daemon."""
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        self.socket_path = socket_path
+        try:
+            self._conn = Client(socket_path, family="AF_UNIX")
+        except OSError as e:
+            raise DaemonError(f"no trace daemon listening on {socket_path}: {e}") from e
+
+    def request(self, op, **kwargs):
+        try:
+            self._conn.send({"op": op, **kwargs})
+            response = self._conn.recv()
+        except (EOFError, OSError) as e:
+            raise DaemonError(f"lost the connection to the trace daemon: {e}") from e
+        if not response["ok"]:
+            raise DaemonError(response["error"])
+        return response["result"]
+
+    def load(self, trace_file):
+        return self.request("load", trace=os.path.abspath(trace_file))
+
+    def query(self, trace_file, sql, frame=False):
+        return self.request("query", trace=os.path.abspath(trace_file), sql=sql, frame=frame)
+
+    def status(self):
+        return self.request("status")
+
+    def evict(self, trace_file=None):
+        return self.request("evict", trace=os.path.abspath(trace_file) if trace_file else None)
+
+    def shutdown(self):
+        return self.request("shutdown")
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class RemoteTraceProcessor:
+    """Stands in for a TraceProcessor loaded in the daemon, for TraceSession (see DaemonSession).
+
+    `query(sql)` runs the query right away; `as_pandas_dataframe()` on the result returns it.
+    `close()` only closes the connection, the trace stays loaded in the daemon.
+    """
+
+    class _Result:
+        def __init__(self, df):
+            self._df = df
+
+        def as_pandas_dataframe(self):
+            return self._df
+
+    def __init__(self, trace_file, socket_path=DEFAULT_SOCKET):
+        self.trace_file = trace_file
+        self.client = connect(socket_path)
+        self.warm = self.client.load(trace_file)["warm"]
+
+    def query(self, sql):
+        return self._Result(self.client.query(self.trace_file, sql, frame=True))
+
+    def close(self):
+        self.client.close()
+
+
+def is_running(socket_path=DEFAULT_SOCKET):
+    try:
+        with DaemonClient(socket_path) as client:
+            return client.request("ping") == "pong"
+    except DaemonError:
+        return False
+
+
+def start_daemon(socket_path=DEFAULT_SOCKET, memory_budget_gb=DEFAULT_MEMORY_BUDGET_GB):
+    """Starts a trace daemon in the background and waits until it accepts connections.
+
+    Its output goes to trace_daemon.log next to the socket.
+    """
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    log_path = os.path.splitext(socket_path)[0] + ".log"
+    with open(log_path, "a") as log:
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--socket", socket_path, "serve", "--memory-budget-gb", str(memory_budget_gb)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+        )
+    deadline = time.monotonic() + START_TIMEOUT_S
+    while time.monotonic() < deadline:
+        if is_running(socket_path):
+            return process.pid
+        if process.poll() is not None:
+            raise DaemonError(f"the trace daemon exited with code {process.returncode}, see {log_path}")
+        time.sleep(0.05)
+    raise DaemonError(f"the trace daemon did not start within {START_TIMEOUT_S} s, see {log_path}")
+
+
+def connect(socket_path=DEFAULT_SOCKET, start=True):
+    """Returns a DaemonClient, starting a daemon with the default memory budget if none is running."""
+    if start and not is_running(socket_path):
+        start_daemon(socket_path)
+    return DaemonClient(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Long-lived trace_processor server keeping recently used traces loaded.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help=f"unix socket of the daemon (default: {DEFAULT_SOCKET})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in [("serve", "run the daemon in the foreground"), ("start", "start the daemon in the background")]:
+        command_parser = subparsers.add_parser(name, help=help_text)
+        command_parser.add_argument("--memory-budget-gb", type=float, default=DEFAULT_MEMORY_BUDGET_GB,
+                                    help="close least recently used traces when the trace processors use more RSS than this")
+    subparsers.add_parser("stop", help="close every trace and stop the daemon")
+    subparsers.add_parser("status", help="list the loaded traces")
+    evict_parser = subparsers.add_parser("evict", help="close one loaded trace, or all of them")
+    evict_parser.add_argument("trace", nargs="?")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "serve":
+            TraceDaemon(args.socket, int(args.memory_budget_gb * 1024 ** 3)).serve()
+        elif args.command == "start":
+            if is_running(args.socket):
+                print(f"A trace daemon is already listening on {args.socket}")
+            else:
+                print(f"Trace daemon {start_daemon(args.socket, args.memory_budget_gb)} listening on {args.socket}")
+        else:
+            with DaemonClient(args.socket) as client:
+                if args.command == "stop":
+                    client.shutdown()
+                    print("Trace daemon stopped.")
+                elif args.command == "evict":
+                    closed = client.evict(args.trace)
+                    print(f"Closed {len(closed)} trace(s).")
+                else:
+                    status = client.status()
+                    print(f"Trace daemon {status['pid']}, memory budget {status['memory_budget'] / 1024 ** 3:.1f} GB")
+                    for t in status["traces"]:
+                        print(f"  - {t['trace']}: {t['rss'] / 1024 ** 2:.0f} MB, loaded in {t['load_s']:.1f} s, "
+                              f"{t['queries']} queries, idle {t['idle_s']:.0f} s")
+                    print(f"  total: {sum(t['rss'] for t in status['traces']) / 1024 ** 2:.0f} MB in {len(status['traces'])} trace(s)")
+    except DaemonError as e:
+        print(f"An error occurred: {e}")
+        sys.exit(1)
@@ -0,0 +1,46 @@
+from table_io import DICTIONARY_COLUMNS
+import numpy as np
+import pandas as pd
+
+# Narrowest integer types for the id columns; ts and dur stay int64. Columns with nulls
+# (upid of the idle thread) use the nullable variant of the same width.
+ID_DTYPES = {"utid": "int32", "upid": "int32", "cpu": "int16", "tid": "int32", "pid": "int32"}
+
+
+def compact_table(df):
+    """Returns `df` with its name columns as categoricals and its id columns as narrow integers.
+
+    Each distinct thread, process or state name is then stored once, with a small integer
+    code per row; filters on these columns can compare codes (see name_mask) instead of strings.
+    """
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in DICTIONARY_COLUMNS and not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype("category")
+        elif column in ID_DTYPES and values.dtype.kind in "iuf" and values.dtype != ID_DTYPES[column]:
+            if values.isna().any():
+                values = values.astype(ID_DTYPES[column].capitalize())
+            else:
+                values = values.astype(ID_DTYPES[column])
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+def name_mask(column, names):
+    """Returns a boolean Series that is True where `column` equals one of `names` (a name or a list of names).
+
+    For categorical columns the names are looked up once in the categories and the rows are
+    matched on their integer codes.
+    """
+    if isinstance(names, str):
+        names = [names]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes = column.cat.categories.get_indexer(list(names))
+        return pd.Series(np.isin(column.array.codes, codes[codes >= 0]), index=column.index)
+    return column.isin(names)
+
+
+def memory_mb(df):
+    """Returns the memory used by `df` in MB, including the strings of object columns."""
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
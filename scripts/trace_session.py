@@ -0,0 +1,128 @@
+from instrumentation import span
+from trace_daemon import DEFAULT_SOCKET, RemoteTraceProcessor
+import time
+
+# ts of every {chunk_rows}-th row of {table} in ts order, starting with the first row
+CHUNK_STARTS_QUERY = """
+    SELECT ts FROM (SELECT ts, ROW_NUMBER() OVER (ORDER BY ts) - 1 AS row_index FROM {table})
+    WHERE row_index % {chunk_rows} = 0
+"""
+
+
+class TraceSession:
+    """One loaded trace shared by every extraction query.
+
+    The trace is parsed lazily on the first query and reused afterwards, so
+    running several extractors against the same session pays the
+    TraceProcessor load only once. Wall-clock time of the load and of every
+    query is recorded in `timings` as (label, seconds, row_count) tuples.
+    With instrumentation enabled (see instrumentation.py) the load, each query and
+    its DataFrame conversion are also recorded as separate spans.
+
+    With a QueryCache (see query_cache.py), results are looked up by trace digest
+    and query text first; the trace is only loaded if some query misses the cache.
+    """
+
+    def __init__(self, trace_file, cache=None):
+        self.trace_file = trace_file
+        self.cache = cache
+        self.timings = []
+        self._tp = None
+        self._trace_digest = None
+
+    @property
+    def tp(self):
+        if self._tp is None:
+            start = time.perf_counter()
+            with span("trace load", "trace_processor", trace=self.trace_file):
+                # Imported here: sessions answered from the query cache never need it
+                from perfetto.trace_processor import TraceProcessor
+                self._tp = TraceProcessor(trace=self.trace_file)
+            self.timings.append(("trace load", time.perf_counter() - start, None))
+        return self._tp
+
+    def query_df(self, sql, label=None):
+        label = label or "query"
+        if self.cache is not None:
+            start = time.perf_counter()
+            with span(label, "cache lookup") as cache_span:
+                if self._trace_digest is None:
+                    self._trace_digest = self.cache.trace_digest(self.trace_file)
+                key = self.cache.key(self._trace_digest, sql)
+                df = self.cache.get(key)
+                cache_span.args["hit"] = df is not None
+                cache_span.rows = None if df is None else len(df)
+            if df is not None:
+                self.timings.append((f"{label} (cached)", time.perf_counter() - start, len(df)))
+                return df
+
+        tp = self.tp
+        start = time.perf_counter()
+        with span(label, "query") as query_span:
+            with span(label, "query execution"):
+                result = tp.query(sql)
+            with span(label, "as_pandas_dataframe") as convert_span:
+                df = result.as_pandas_dataframe()
+                convert_span.rows = len(df)
+            query_span.rows = len(df)
+        self.timings.append((label, time.perf_counter() - start, len(df)))
+        if self.cache is not None:
+            with span(label, "cache store", rows=len(df)):
+                self.cache.put(key, df, self._trace_digest, self.trace_file, sql)
+        return df
+
+    def ts_ranges(self, table, chunk_rows):
+        """Yields [start_ts, end_ts) ranges that split `table` into chunks of at most `chunk_rows` rows.
+
+        The ranges start at the ts of every `chunk_rows`-th row in ts order, so a burst of
+        slices is split like any other stretch of the trace. Only rows sharing one ts can
+        make a chunk larger.
+        """
+        bounds = self.query_df(f"SELECT MAX(ts) AS max_ts, COUNT(*) AS row_count FROM {table}", label=f"{table} bounds")
+        row_count = int(bounds["row_count"].iloc[0])
+        if row_count == 0:
+            return
+        starts = self.query_df(CHUNK_STARTS_QUERY.format(table=table, chunk_rows=int(chunk_rows)), label=f"{table} chunk starts")
+        starts = sorted(set(int(ts) for ts in starts["ts"]))
+        ends = starts[1:] + [int(bounds["max_ts"].iloc[0]) + 1]
+        yield from zip(starts, ends)
+
+    def print_timings(self):
+        print("Timings:")
+        for label, seconds, rows in self.timings:
+            rows_info = f" ({rows} rows)" if rows is not None else ""
+            print(f"  - {label}: {seconds:.3f} s{rows_info}")
+        print(f"  - total: {sum(t[1] for t in self.timings):.3f} s")
+
+    def close(self):
+        if self._tp is not None:
+            self._tp.close()
+            self._tp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class DaemonSession(TraceSession):
+    """A TraceSession whose queries run in the trace daemon (see trace_daemon.py).
+
+    The trace stays loaded in the daemon after the session is closed, so the next session
+    on the same trace skips the load. A daemon is started if none is running.
+    """
+
+    def __init__(self, trace_file, cache=None, socket_path=DEFAULT_SOCKET):
+        super().__init__(trace_file, cache)
+        self.socket_path = socket_path
+
+    @property
+    def tp(self):
+        if self._tp is None:
+            start = time.perf_counter()
+            with span("trace load", "trace_processor", trace=self.trace_file) as load_span:
+                self._tp = RemoteTraceProcessor(self.trace_file, self.socket_path)
+                load_span.args["warm"] = self._tp.warm
+            self.timings.append(("trace load", time.perf_counter() - start, None))
+        return self._tp
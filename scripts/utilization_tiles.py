@@ -0,0 +1,237 @@
+from trace_session import TraceSession
+from table_io import ColumnStore, read_table, write_table
+from extract_long_tasks import extract_long_tasks
+import identify_performance_anomalies as anomalies
+import argparse
+import json
+import matplotlib.pyplot as plt
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+TILES_META = "tiles.json"
+KINDS = ["cpu", "process"]
+DEFAULT_BASE_BUCKET_MS = 1
+# Each level has buckets LEVEL_FACTOR times longer than the level below it
+LEVEL_FACTOR = 4
+# The base level is coarsened until it has at most this many buckets, and levels are added
+# until the top one has at most TOP_LEVEL_BUCKETS
+MAX_BASE_BUCKETS = 1 << 20
+TOP_LEVEL_BUCKETS = 256
+# Rendering picks the finest level with at most this many buckets in the shown range
+DEFAULT_MAX_BUCKETS = 2000
+DEFAULT_TOP_PROCESSES = 8
+# Only the longest tasks in the shown range are drawn
+LONG_TASK_OVERLAY_LIMIT = 200
+MAIN_THREAD_NAME = "com.google.android.youtube:main"
+
+
+def _level_path(path, kind, level):
+    return os.path.join(path, f"{kind}_L{level}.cols")
+
+
+def _coarsen(busy, factor):
+    coarse = busy.assign(window=busy["window"].to_numpy() // factor)
+    return coarse.groupby(["key", "window"], observed=True, as_index=False)["busy_ns"].sum()
+
+
+def build_tiles(cpu_sched, path, long_tasks=None, base_bucket_ns=DEFAULT_BASE_BUCKET_MS * 1_000_000):
+    """Writes the utilization tiles of `cpu_sched` (a table, ChunkedTable or TraceSession) to the directory `path`.
+
+    Level 0 holds the busy time of every CPU and process per base bucket; each higher level
+    sums LEVEL_FACTOR buckets of the level below, so the raw slices are read only once. Each
+    level is a column store sorted by bucket, read back memory-mapped. Returns the tile metadata.
+    """
+    _, bounds = anomalies.cpu_time_aggregate(cpu_sched)
+    if bounds["slice_count"] == 0:
+        raise ValueError("No CPU scheduling slices to build tiles from")
+    origin_ts = int(bounds["min_ts"])
+    end_ts = int(bounds["max_ts"] + bounds["dur_at_max_ts"])
+    while (end_ts - origin_ts) / base_bucket_ns > MAX_BASE_BUCKETS:
+        base_bucket_ns *= LEVEL_FACTOR
+
+    process_busy, cpu_busy = anomalies.window_busy_aggregate(cpu_sched, origin_ts, base_bucket_ns)
+    os.makedirs(path, exist_ok=True)
+    level_count = 0
+    for kind, busy in (("cpu", cpu_busy), ("process", process_busy)):
+        level = 0
+        buckets = (end_ts - origin_ts) // base_bucket_ns + 1
+        while True:
+            write_table(busy.sort_values(["window", "key"], ignore_index=True), _level_path(path, kind, level))
+            if buckets <= TOP_LEVEL_BUCKETS:
+                break
+            busy = _coarsen(busy, LEVEL_FACTOR)
+            buckets = buckets // LEVEL_FACTOR + 1
+            level += 1
+        level_count = level + 1
+
+    if long_tasks is not None and not long_tasks.empty:
+        write_table(long_tasks[["slice_name", "ts", "dur"]].reset_index(drop=True), os.path.join(path, "long_tasks.parquet"))
+    meta = {
+        "origin_ts": origin_ts,
+        "end_ts": end_ts,
+        "base_bucket_ns": int(base_bucket_ns),
+        "level_factor": LEVEL_FACTOR,
+        "levels": level_count,
+        "cpus": sorted(int(cpu) for cpu in cpu_busy["key"].unique()),
+    }
+    # Written last: a directory without it is not a complete tile set
+    with open(os.path.join(path, TILES_META), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def is_tile_set(path):
+    return os.path.isfile(os.path.join(str(path), TILES_META))
+
+
+class UtilizationTiles:
+    """A tile set written by build_tiles, read one level and time range at a time."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, TILES_META)) as f:
+            self.meta = json.load(f)
+        self.origin_ts = self.meta["origin_ts"]
+        self.end_ts = self.meta["end_ts"]
+        self.cpus = self.meta["cpus"]
+
+    def bucket_ns(self, level):
+        return self.meta["base_bucket_ns"] * self.meta["level_factor"] ** level
+
+    def level_for(self, start_ts, end_ts, max_buckets=DEFAULT_MAX_BUCKETS):
+        """Returns the finest level showing [start_ts, end_ts) in at most `max_buckets` buckets."""
+        for level in range(self.meta["levels"]):
+            if (end_ts - start_ts) / self.bucket_ns(level) <= max_buckets:
+                return level
+        return self.meta["levels"] - 1
+
+    def read(self, kind, level, start_ts=None, end_ts=None):
+        """Returns the (key, window, busy_ns) rows of one level overlapping [start_ts, end_ts), plus their bucket ts.
+
+        The bucket column is memory-mapped, so only the pages of the requested range are read.
+        """
+        store = ColumnStore(_level_path(self.path, kind, level))
+        bucket_ns = self.bucket_ns(level)
+        window = store.array("window")
+        lo = 0 if start_ts is None else np.searchsorted(window, (start_ts - self.origin_ts) // bucket_ns, side="left")
+        hi = len(store) if end_ts is None else np.searchsorted(window, (end_ts - 1 - self.origin_ts) // bucket_ns, side="right")
+        rows = store.to_frame().iloc[lo:hi]
+        return rows.assign(ts=self.origin_ts + rows["window"].to_numpy(dtype=np.int64) * bucket_ns)
+
+    def process_totals(self):
+        """Returns the total CPU time per process, from the coarsest level."""
+        busy = self.read("process", self.meta["levels"] - 1)
+        return busy.groupby("key", observed=True)["busy_ns"].sum().sort_values(ascending=False)
+
+    def long_tasks(self, start_ts, end_ts, limit=LONG_TASK_OVERLAY_LIMIT):
+        path = os.path.join(self.path, "long_tasks.parquet")
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=["slice_name", "ts", "dur"])
+        tasks = read_table(path)
+        tasks = tasks[(tasks["ts"] < end_ts) & (tasks["ts"] + tasks["dur"] > start_ts)]
+        return tasks.nlargest(limit, "dur")
+
+
+def render_timeline(tiles, output_image, start_ts=None, end_ts=None, max_buckets=DEFAULT_MAX_BUCKETS, top_n=DEFAULT_TOP_PROCESSES):
+    """Draws the process stacked-area chart and the per-CPU utilization heatmap of [start_ts, end_ts) with long tasks overlaid.
+
+    Only the level with at most `max_buckets` buckets in the range is read, so the cost depends
+    on the image resolution and the number of CPUs and processes, not on the number of slices.
+    """
+    start_ts = tiles.origin_ts if start_ts is None else max(start_ts, tiles.origin_ts)
+    end_ts = tiles.end_ts if end_ts is None else min(end_ts, tiles.end_ts)
+    if end_ts <= start_ts:
+        raise ValueError("The selected time range is outside the trace")
+    level = tiles.level_for(start_ts, end_ts, max_buckets)
+    bucket_ns = tiles.bucket_ns(level)
+    first_window = (start_ts - tiles.origin_ts) // bucket_ns
+    window_count = (end_ts - 1 - tiles.origin_ts) // bucket_ns - first_window + 1
+    bucket_s = (first_window + np.arange(window_count)) * bucket_ns / 1e9
+
+    fig, (area_ax, cpu_ax) = plt.subplots(2, 1, figsize=(14, 9), sharex=True, gridspec_kw={"height_ratios": [3, 2]})
+
+    process_busy = tiles.read("process", level, start_ts, end_ts)
+    per_process = process_busy.groupby("key", observed=True)["busy_ns"].sum().sort_values(ascending=False)
+    top = list(per_process.index[:top_n])
+    series = []
+    for process in top:
+        rows = process_busy[process_busy["key"] == process]
+        values = np.zeros(window_count)
+        np.add.at(values, rows["window"].to_numpy(dtype=np.int64) - first_window, rows["busy_ns"].to_numpy())
+        series.append(values)
+    other = np.zeros(window_count)
+    rest = process_busy[~process_busy["key"].isin(top)]
+    np.add.at(other, rest["window"].to_numpy(dtype=np.int64) - first_window, rest["busy_ns"].to_numpy())
+    if series or other.any():
+        # The last bucket is repeated at its end so step="post" draws it in full
+        edges = np.append(bucket_s, bucket_s[-1] + bucket_ns / 1e9)
+        ys = [np.append(values, values[-1]) / bucket_ns for values in [*series, other]]
+        area_ax.stackplot(edges, *ys, labels=[str(p) for p in top] + ["other"], step="post")
+        area_ax.legend(loc="upper left", fontsize="small", ncol=2)
+    area_ax.set_ylabel("CPUs busy")
+    area_ax.set_title(f"CPU utilization by process ({bucket_ns / 1_000_000:g} ms buckets)")
+
+    cpu_busy = tiles.read("cpu", level, start_ts, end_ts)
+    heat = np.zeros((len(tiles.cpus), window_count))
+    row_of = {cpu: i for i, cpu in enumerate(tiles.cpus)}
+    rows = cpu_busy["key"].map(row_of).to_numpy(dtype=np.int64)
+    np.add.at(heat, (rows, cpu_busy["window"].to_numpy(dtype=np.int64) - first_window), cpu_busy["busy_ns"].to_numpy() / bucket_ns)
+    extent = (bucket_s[0], bucket_s[-1] + bucket_ns / 1e9, len(tiles.cpus) - 0.5, -0.5)
+    image = cpu_ax.imshow(heat, aspect="auto", interpolation="nearest", extent=extent, vmin=0, vmax=1, cmap="viridis")
+    cpu_ax.set_yticks(range(len(tiles.cpus)), [f"CPU {cpu}" for cpu in tiles.cpus])
+    cpu_ax.set_xlabel("Time since trace start (s)")
+    cpu_ax.set_xlim((start_ts - tiles.origin_ts) / 1e9, (end_ts - tiles.origin_ts) / 1e9)
+    # Attached to both axes, so they keep the same width and their time axes line up
+    fig.colorbar(image, ax=[area_ax, cpu_ax], label="utilization", pad=0.01)
+
+    for _, task in tiles.long_tasks(start_ts, end_ts).iterrows():
+        task_start = (task["ts"] - tiles.origin_ts) / 1e9
+        task_end = (task["ts"] + task["dur"] - tiles.origin_ts) / 1e9
+        for ax in (area_ax, cpu_ax):
+            ax.axvspan(task_start, task_end, color="red", alpha=0.15, linewidth=0)
+
+    fig.savefig(output_image, bbox_inches="tight")
+    plt.close(fig)
+    return level
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build multi-resolution CPU utilization tiles and render timelines from them.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="aggregate sched slices into a tile set")
+    build_parser.add_argument("cpu_sched", help="cpu sched table (file, chunk directory or .cols), or a trace file with --trace")
+    build_parser.add_argument("tiles_dir")
+    build_parser.add_argument("--trace", action="store_true", help="cpu_sched is a trace file; aggregate inside trace processor")
+    build_parser.add_argument("--long-tasks", help="long tasks table to overlay (extracted from the trace with --trace)")
+    build_parser.add_argument("--bucket-ms", type=float, default=DEFAULT_BASE_BUCKET_MS, help="bucket length of the finest level")
+    render_parser = subparsers.add_parser("render", help="render a timeline image from a tile set")
+    render_parser.add_argument("tiles_dir")
+    render_parser.add_argument("output_image")
+    render_parser.add_argument("--start", type=float, help="start of the shown range, in seconds since the trace start")
+    render_parser.add_argument("--end", type=float, help="end of the shown range, in seconds since the trace start")
+    render_parser.add_argument("--buckets", type=int, default=DEFAULT_MAX_BUCKETS, help="maximum buckets across the image")
+    render_parser.add_argument("--top", type=int, default=DEFAULT_TOP_PROCESSES, help="processes shown separately in the area chart")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "build":
+            bucket_ns = int(args.bucket_ms * 1_000_000)
+            if args.trace:
+                with TraceSession(args.cpu_sched) as session:
+                    long_tasks = extract_long_tasks(session, anomalies.YOUTUBE_PROCESS_NAME, MAIN_THREAD_NAME, anomalies.LONG_TASK_THRESHOLD_MS * 1_000_000)
+                    meta = build_tiles(session, args.tiles_dir, long_tasks, bucket_ns)
+            else:
+                long_tasks = read_table(args.long_tasks) if args.long_tasks else None
+                meta = build_tiles(anomalies.load_input(args.cpu_sched, anomalies.CPU_SCHED_COLUMNS, chunked=True), args.tiles_dir, long_tasks, bucket_ns)
+            print(f"{meta['levels']} tile levels ({meta['base_bucket_ns'] / 1_000_000:g} ms base buckets) saved to {args.tiles_dir}")
+        else:
+            tiles = UtilizationTiles(args.tiles_dir)
+            start_ts = tiles.origin_ts + int(args.start * 1e9) if args.start is not None else None
+            end_ts = tiles.origin_ts + int(args.end * 1e9) if args.end is not None else None
+            level = render_timeline(tiles, args.output_image, start_ts, end_ts, args.buckets, args.top)
+            print(f"Timeline (level {level}, {tiles.bucket_ns(level) / 1_000_000:g} ms buckets) saved to {args.output_image}")
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
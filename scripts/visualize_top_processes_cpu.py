@@ -1,16 +1,23 @@
+from table_io import read_table
+from utilization_tiles import UtilizationTiles, is_tile_set
 import pandas as pd
 import matplotlib.pyplot as plt
 import sys
 
 if len(sys.argv) != 3:
-    print("Usage: python visualize_top_processes_cpu.py <cpu_sched_csv_path> <output_image_path>")
+    print("Usage: python visualize_top_processes_cpu.py <cpu_sched_table_path_or_tiles_dir> <output_image_path>")
     sys.exit(1)
 
 cpu_sched_csv = sys.argv[1]
 output_image = sys.argv[2]
 
 try:
-    df = pd.read_csv(cpu_sched_csv)
+    if is_tile_set(cpu_sched_csv):
+        # The coarsest tile level already holds the per-process totals, so no slice is read
+        df = UtilizationTiles(cpu_sched_csv).process_totals().rename_axis('process_name').reset_index(name='dur')
+    else:
+        # Only the columns used for the per-process totals are loaded
+        df = read_table(cpu_sched_csv, columns=['process_name', 'dur'])
 except FileNotFoundError:
     print(f"Error: The file {cpu_sched_csv} was not found.")
     sys.exit(1)
@@ -36,7 +43,7 @@ if df.empty:
 
 # Calculate total CPU time per process
 # Assuming 'dur' is the column for duration in nanoseconds
-process_cpu_time = df.groupby('process_name')['dur'].sum().sort_values(ascending=False) / 1_000_000 # Convert to ms
+process_cpu_time = df.groupby('process_name', observed=True)['dur'].sum().sort_values(ascending=False) / 1_000_000 # Convert to ms
 
 # Get top N processes (e.g., top 10)
 top_n = 10
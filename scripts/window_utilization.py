@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+# Up to this many (key, window) cells the sums use a dense bincount; beyond it (many keys
+# over a long trace) the occupied cells are found with np.unique instead.
+DENSE_CELL_LIMIT = 1 << 24
+
+
+def _sum_per_cell(key_codes, windows, weights, key_count):
+    """Sums `weights` per (key code, window) cell. Returns (cells, sums) for the non-empty cells."""
+    n_windows = int(windows.max()) + 1
+    flat = key_codes.astype(np.int64) * n_windows + windows
+    cell_count = key_count * n_windows
+    if cell_count <= max(DENSE_CELL_LIMIT, 4 * len(flat)):
+        sums = np.bincount(flat, weights=weights, minlength=cell_count)
+        cells = np.flatnonzero(sums)
+        return cells, n_windows, sums[cells]
+    cells, cell_index = np.unique(flat, return_inverse=True)
+    return cells, n_windows, np.bincount(cell_index, weights=weights)
+
+
+def _key_column(key_values, key_codes):
+    """Builds the key column from factorized values; string keys stay categorical so no per-row strings are created."""
+    key_values = np.asarray(key_values)
+    if key_values.dtype.kind in "iuf":
+        return key_values[key_codes]
+    return pd.Categorical.from_codes(key_codes, categories=key_values)
+
+
+def split_into_windows(ts, dur, window_ns, origin_ts=0):
+    """Splits [ts, ts + dur) intervals at the boundaries of fixed windows of `window_ns`.
+
+    Returns (row, window, overlap_ns) arrays with one entry per (interval, window) pair the
+    interval overlaps: `row` indexes the input arrays, `window` is the window number counted
+    from `origin_ts` and `overlap_ns` the part of the interval inside that window. Intervals
+    are expected to start at or after `origin_ts`; zero-length intervals are dropped.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    dur = np.asarray(dur, dtype=np.int64)
+    rows = np.flatnonzero(dur > 0)
+    start = ts[rows] - origin_ts
+    end = start + dur[rows]
+    first_window = start // window_ns
+    last_window = (end - 1) // window_ns
+    crossing = np.flatnonzero(last_window > first_window)
+    if len(crossing) == 0:
+        return rows, first_window, end - start
+
+    # Most intervals lie within one window and are kept as they are. Crossing intervals get
+    # one entry per covered window: repeat each `span` times and number the repeats.
+    span = last_window[crossing] - first_window[crossing] + 1
+    repeated = np.repeat(crossing, span)
+    repeat_offset = np.arange(len(repeated)) - np.repeat(np.cumsum(span) - span, span)
+    windows = first_window[repeated] + repeat_offset
+    window_start = windows * window_ns
+    overlap = np.minimum(end[repeated], window_start + window_ns) - np.maximum(start[repeated], window_start)
+
+    inside = np.flatnonzero(last_window == first_window)
+    return (np.concatenate([rows[inside], rows[repeated]]),
+            np.concatenate([first_window[inside], windows]),
+            np.concatenate([(end - start)[inside], overlap]))
+
+
+def busy_time_per_window(ts, dur, keys, window_ns, origin_ts=0):
+    """Returns the busy time of every key in every window as a DataFrame of (key, window, busy_ns).
+
+    Only (key, window) pairs with non-zero busy time are returned, so memory scales with
+    the number of slices rather than with keys x windows.
+    """
+    rows, windows, overlap = split_into_windows(ts, dur, window_ns, origin_ts)
+    # Null keys get code -1 and are dropped
+    key_codes, key_values = pd.factorize(keys)
+    key_codes = key_codes[rows]
+    valid = key_codes >= 0
+    key_codes, windows, overlap = key_codes[valid], windows[valid], overlap[valid]
+    if len(windows) == 0:
+        return pd.DataFrame({"key": pd.Series(dtype=object), "window": pd.Series(dtype="int64"), "busy_ns": pd.Series(dtype="int64")})
+    cells, n_windows, busy = _sum_per_cell(key_codes, windows, overlap, len(key_values))
+    return pd.DataFrame({
+        "key": _key_column(key_values, cells // n_windows),
+        "window": cells % n_windows,
+        "busy_ns": np.rint(busy).astype(np.int64),
+    })
+
+
+def sliding_busy_time(busy, window_buckets):
+    """Turns busy time per fixed bucket into busy time per sliding window of `window_buckets` buckets.
+
+    `busy` has (key, window, busy_ns) columns as returned by busy_time_per_window. In the
+    result, window j covers buckets j .. j + window_buckets - 1; each bucket is added to the
+    `window_buckets` windows containing it with a repeat + bincount instead of a loop.
+    """
+    if window_buckets <= 1 or busy.empty:
+        return busy
+    offsets = np.arange(window_buckets)
+    windows = np.repeat(busy["window"].to_numpy(), window_buckets) - np.tile(offsets, len(busy))
+    key_codes, key_values = pd.factorize(busy["key"])
+    key_codes = np.repeat(key_codes, window_buckets)
+    busy_ns = np.repeat(busy["busy_ns"].to_numpy(), window_buckets)
+    valid = windows >= 0
+    key_codes, windows, busy_ns = key_codes[valid], windows[valid], busy_ns[valid]
+    cells, n_windows, sums = _sum_per_cell(key_codes, windows, busy_ns, len(key_values))
+    return pd.DataFrame({
+        "key": _key_column(key_values, cells // n_windows),
+        "window": cells % n_windows,
+        "busy_ns": np.rint(sums).astype(np.int64),
+    })
+
+
+def combine_busy_time(partials):
+    """Sums (key, window, busy_ns) tables computed on separate chunks of slices."""
+    partials = [p for p in partials if not p.empty]
+    if not partials:
+        return pd.DataFrame({"key": pd.Series(dtype=object), "window": pd.Series(dtype="int64"), "busy_ns": pd.Series(dtype="int64")})
+    if len(partials) == 1:
+        return partials[0]
+    return pd.concat(partials).groupby(["key", "window"], as_index=False, observed=True)["busy_ns"].sum()
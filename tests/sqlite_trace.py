@@ -0,0 +1,43 @@
+import pandas as pd
+import sqlite3
+
+
+class SnapshotSession:
+    """A synthetic trace (see synthetic_trace.synthetic_tables) in SQLite, standing in for a trace processor session.
+
+    Only rows that started in [lo, hi) are in the snapshot, as if the recording had reached
+    `hi` and its ring buffer kept data from `lo` on; rows still running at `hi` are open
+    (dur -1). `hi` is a timestamp or a dict of one per table, for tables lagging behind.
+    Trace processor numbers threads anew on every load; `utid_offset` shifts every utid but
+    the idle thread's to mimic that.
+    """
+
+    def __init__(self, tables, lo, hi, utid_offset=0):
+        self.trace_file = f"snapshot_{lo}"
+        self.con = sqlite3.connect(":memory:")
+        hi = hi if isinstance(hi, dict) else dict.fromkeys(["sched_slice", "thread_state", "slice"], hi)
+
+        def renumbered(df):
+            return df.assign(utid=df["utid"].where(df["utid"] == 0, df["utid"] + utid_offset))
+
+        def snapshot(df, table):
+            df = renumbered(df[(df["ts"] >= lo) & (df["ts"] < hi[table])])
+            df.loc[df["ts"] + df["dur"] > hi[table], "dur"] = -1
+            return df
+
+        threads = renumbered(tables["threads"])
+        snapshot(tables["cpu_sched"], "sched_slice")[["utid", "cpu", "ts", "dur", "end_state"]].to_sql("sched_slice", self.con)
+        snapshot(tables["thread_states"], "thread_state")[["utid", "ts", "dur", "state", "blocked_function"]].to_sql("thread_state", self.con)
+        threads[["utid", "tid", "thread_name", "upid"]].rename(columns={"thread_name": "name"}).to_sql("thread", self.con)
+        threads[["upid", "pid", "process_name"]].drop_duplicates("upid").rename(columns={"process_name": "name"}).to_sql("process", self.con)
+        main_slices = snapshot(tables["main_slices"], "slice")
+        pd.DataFrame({"id": range(len(main_slices)), "ts": main_slices["ts"], "dur": main_slices["dur"],
+                      "name": main_slices["slice_name"], "track_id": 0}).to_sql("slice", self.con)
+        pd.DataFrame({"id": [0], "utid": [int(renumbered(tables["main_slices"])["utid"].iloc[0])]}).to_sql("thread_track", self.con)
+        # cpufreq counters of a device with LITTLE cpus 0-3 and BIG cpus 4-7
+        pd.DataFrame({"id": range(8), "cpu": range(8), "name": "cpufreq"}).to_sql("cpu_counter_track", self.con)
+        pd.DataFrame({"track_id": range(8), "ts": lo, "value": [1_800_000] * 4 + [2_900_000] * 4}).to_sql("counter", self.con)
+        tables["system_info"].astype({"int_value": "float64"}).to_sql("metadata", self.con)
+
+    def query_df(self, sql, label=None):
+        return pd.read_sql_query(sql, self.con)
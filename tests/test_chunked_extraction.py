@@ -0,0 +1,69 @@
+from extract_cpu_usage import extract_cpu_sched, iter_cpu_sched_chunks
+from extract_thread_states import extract_thread_states, iter_thread_states_chunks
+from trace_session import TraceSession
+import numpy as np
+import pandas as pd
+import pytest
+import sqlite3
+
+
+class SqliteTraceProcessor:
+    def __init__(self, con):
+        self.con = con
+
+    def query(self, sql):
+        df = pd.read_sql_query(sql, self.con)
+
+        class Result:
+            def as_pandas_dataframe(self):
+                return df
+        return Result()
+
+    def close(self):
+        self.con.close()
+
+
+def sqlite_session(row_count, seed):
+    """A session over random sched slices and thread states with bursts and many rows sharing a ts."""
+    rng = np.random.default_rng(seed)
+    # Half the rows fall on a few timestamps, the rest are spread out with a dense burst
+    ts = np.concatenate([rng.choice([100, 105, 2000], size=row_count // 2),
+                         rng.integers(0, 10_000, size=row_count // 4), rng.integers(5000, 5010, size=row_count - row_count // 2 - row_count // 4)])
+    utid = rng.integers(1, 6, size=row_count)
+    con = sqlite3.connect(":memory:")
+    pd.DataFrame({"utid": utid, "cpu": rng.integers(0, 8, size=row_count), "ts": ts, "dur": rng.integers(1, 50, size=row_count),
+                  "end_state": "S"}).to_sql("sched_slice", con)
+    pd.DataFrame({"utid": utid, "ts": rng.permutation(ts), "dur": 10, "state": rng.choice(["R", "S", "Running"], size=row_count),
+                  "blocked_function": None}).to_sql("thread_state", con)
+    pd.DataFrame({"utid": range(1, 6), "tid": range(1, 6), "name": [f"t{i}" for i in range(1, 6)], "upid": [1, 1, 2, 2, 2]}).to_sql("thread", con)
+    pd.DataFrame({"upid": [1, 2], "pid": [1, 2], "name": ["p1", "p2"]}).to_sql("process", con)
+    session = TraceSession("sqlite")
+    session._tp = SqliteTraceProcessor(con)
+    return session
+
+
+def as_rows(df):
+    return sorted(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None), key=repr)
+
+
+@pytest.mark.parametrize("extract, iter_chunks", [(extract_cpu_sched, iter_cpu_sched_chunks), (extract_thread_states, iter_thread_states_chunks)])
+@pytest.mark.parametrize("chunk_rows", [1, 7, 64, 5000])
+def test_chunks_return_every_row_once(extract, iter_chunks, chunk_rows):
+    session = sqlite_session(600, seed=chunk_rows)
+    full = extract(session)
+    chunks = list(iter_chunks(session, chunk_rows))
+    assert as_rows(pd.concat(chunks)) == as_rows(full)
+
+    ts_counts = full["ts"].value_counts()
+    previous_end = -1
+    for chunk in chunks:
+        assert chunk["ts"].is_monotonic_increasing and chunk["ts"].min() > previous_end
+        previous_end = chunk["ts"].max()
+        # Only the rows sharing the chunk's first ts can push it past chunk_rows
+        assert len(chunk) <= chunk_rows + ts_counts[chunk["ts"].min()] - 1
+
+
+def test_ranges_of_an_empty_table():
+    session = sqlite_session(0, seed=0)
+    assert list(session.ts_ranges("sched_slice", 10)) == []
+    assert list(iter_cpu_sched_chunks(session, 10)) == []
@@ -0,0 +1,82 @@
+from compare_builds import benjamini_hochberg, histogram_edges, histogram_percentiles, log_histogram, mann_whitney
+import math
+import numpy as np
+
+
+def naive_mann_whitney(a, b):
+    n, m = len(a), len(b)
+    u = sum(1.0 if x > y else 0.5 if x == y else 0.0 for x in a for y in b)
+    values = list(a) + list(b)
+    ties = sum(t ** 3 - t for t in (values.count(v) for v in set(values)))
+    sigma = math.sqrt(n * m / 12 * ((n + m + 1) - ties / ((n + m) * (n + m - 1))))
+    if sigma == 0:
+        return u, 1.0
+    z = max(abs(u - n * m / 2) - 0.5, 0) / sigma
+    return u, math.erfc(z / math.sqrt(2))
+
+
+def naive_benjamini_hochberg(p_values):
+    valid = [p for p in p_values if not math.isnan(p)]
+    ranked = sorted(valid)
+    q_values = []
+    for p in p_values:
+        if math.isnan(p):
+            q_values.append(math.nan)
+            continue
+        # Smallest p * n / rank over all p-values at least as large
+        q_values.append(min(1.0, min(ranked[j] * len(ranked) / (j + 1) for j in range(len(ranked)) if ranked[j] >= p)))
+    return q_values
+
+
+def test_mann_whitney_matches_pairwise_count():
+    rng = np.random.default_rng(1)
+    # Small integers give plenty of ties; one row is constant on both sides
+    a = rng.integers(0, 6, size=(40, 7)).astype(np.float64)
+    b = rng.integers(1, 7, size=(40, 9)).astype(np.float64)
+    a[0] = b[0, 0] = 3.0
+    b[0] = 3.0
+    u, p_value = mann_whitney(a, b)
+    for row in range(len(a)):
+        expected_u, expected_p = naive_mann_whitney(a[row], b[row])
+        assert u[row] == expected_u
+        assert math.isclose(p_value[row], expected_p, rel_tol=1e-9, abs_tol=1e-12)
+
+
+def test_mann_whitney_needs_two_runs_per_side():
+    u, p_value = mann_whitney(np.ones((3, 1)), np.ones((3, 5)))
+    assert np.isnan(u).all() and np.isnan(p_value).all()
+
+
+def test_benjamini_hochberg_matches_definition():
+    rng = np.random.default_rng(2)
+    p_values = rng.uniform(0, 0.2, size=50)
+    p_values[[3, 17]] = np.nan
+    p_values[[5, 6]] = p_values[4]
+    expected = naive_benjamini_hochberg(list(p_values))
+    np.testing.assert_allclose(benjamini_hochberg(p_values), expected, rtol=1e-12)
+
+
+def test_log_histogram_matches_edges():
+    rng = np.random.default_rng(3)
+    durations = np.concatenate([10 ** rng.uniform(5, 12, size=2000), [0, 1, 1_000_000, 10 ** 11]])
+    edges = histogram_edges()
+    expected = np.zeros(len(edges) + 1, dtype=np.int64)
+    for dur in durations:
+        # Bin i + 1 holds [edges[i], edges[i + 1]); bin 0 is below edges[0], the last bin at or above edges[-1]
+        expected[int(np.searchsorted(edges, dur, side="right"))] += 1
+    np.testing.assert_array_equal(log_histogram(durations), expected)
+
+
+def test_histogram_percentiles_fall_in_the_bin_of_the_exact_percentile():
+    rng = np.random.default_rng(4)
+    durations = 10 ** rng.uniform(6.2, 9.5, size=5000)
+    counts = log_histogram(durations)
+    edges = histogram_edges()
+    for percentile, estimate in zip([10, 50, 90, 99], histogram_percentiles(counts, [10, 50, 90, 99])):
+        exact = np.percentile(durations, percentile, method="inverted_cdf")
+        i = int(np.searchsorted(edges, exact, side="right"))
+        assert edges[i - 1] <= estimate <= edges[i]
+
+
+def test_histogram_percentiles_of_empty_histogram():
+    assert histogram_percentiles(np.zeros(len(histogram_edges()) + 1, dtype=np.int64)) == [0.0, 0.0, 0.0]
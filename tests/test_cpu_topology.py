@@ -0,0 +1,47 @@
+from cpu_topology import load_topology, SETTLED_TRACES
+import pandas as pd
+
+SYSTEM_INFO = pd.DataFrame({"name": ["android_build_fingerprint"], "str_value": ["device/test"], "int_value": [None]})
+
+
+class CounterSession:
+    """Answers the cpufreq query with fixed per-CPU maxima and counts the queries."""
+
+    def __init__(self, max_freq_khz):
+        self.max_freq_khz = max_freq_khz
+        self.queries = 0
+
+    def query_df(self, sql, label=None):
+        self.queries += 1
+        return pd.DataFrame({"cpu": list(self.max_freq_khz), "max_freq_khz": list(self.max_freq_khz.values())})
+
+
+def test_counter_topology_merges_maxima_and_settles(tmp_path):
+    # BIG cores 2-3 stayed at a low frequency in the first trace
+    first = CounterSession({0: 1_800_000, 1: 1_800_000, 2: 1_200_000, 3: 1_200_000})
+    topology = load_topology(SYSTEM_INFO, first, tmp_path)
+    assert topology.cpu_clusters == {0: "BIG", 1: "BIG", 2: "LITTLE", 3: "LITTLE"}
+
+    # A later trace ramps them up; a trace where nothing ramped up does not undo that
+    ramped = CounterSession({0: 1_700_000, 1: 1_800_000, 2: 2_800_000, 3: 2_800_000})
+    idle = CounterSession({0: 1_800_000, 1: 1_800_000, 2: 1_000_000})
+    expected = {0: "LITTLE", 1: "LITTLE", 2: "BIG", 3: "BIG"}
+    assert load_topology(SYSTEM_INFO, ramped, tmp_path).cpu_clusters == expected
+    for _ in range(SETTLED_TRACES):
+        assert load_topology(SYSTEM_INFO, idle, tmp_path).cpu_clusters == expected
+    assert idle.queries == SETTLED_TRACES
+
+    # Settled: the counters are no longer queried, with or without a session
+    assert load_topology(SYSTEM_INFO, idle, tmp_path).cpu_clusters == expected
+    assert load_topology(SYSTEM_INFO, None, tmp_path).max_freq_khz == {0: 1_800_000, 1: 1_800_000, 2: 2_800_000, 3: 2_800_000}
+    assert idle.queries == SETTLED_TRACES
+
+
+def test_metadata_topology_replaces_counter_topology(tmp_path):
+    load_topology(SYSTEM_INFO, CounterSession({0: 1_000_000, 1: 2_000_000}), tmp_path)
+    metadata = pd.concat([SYSTEM_INFO, pd.DataFrame({"name": ["cpu0_max_freq_khz", "cpu1_max_freq_khz"], "str_value": [None, None],
+                                                     "int_value": [2_000_000, 3_000_000]})], ignore_index=True)
+    session = CounterSession({0: 1_000_000, 1: 2_000_000})
+    assert load_topology(metadata, session, tmp_path).source == "metadata"
+    assert load_topology(SYSTEM_INFO, session, tmp_path).max_freq_khz == {0: 2_000_000, 1: 3_000_000}
+    assert session.queries == 0
@@ -0,0 +1,72 @@
+from incremental_analysis import IncrementalState, AGGREGATE_KEYS, BUSY_TABLES
+from sqlite_trace import SnapshotSession
+from synthetic_trace import synthetic_tables
+import numpy as np
+import pandas as pd
+import pytest
+
+TABLES = synthetic_tables(6000)
+# Synthetic threads stay on one CPU; move each slice to a random one so threads migrate
+TABLES["cpu_sched"]["cpu"] = np.random.default_rng(31).integers(0, 8, size=len(TABLES["cpu_sched"]))
+START = int(TABLES["cpu_sched"]["ts"].min())
+END = int((TABLES["cpu_sched"]["ts"] + TABLES["cpu_sched"]["dur"]).max()) + 1
+# A sched slice still running when a long task ends is left out of that task's competition,
+# so this aggregate depends on where the pulls fall
+SPLIT_DEPENDENT = {"long_task_competition"}
+
+
+def normalized(table, keys):
+    table = table.astype({column: "int64" for column in table.columns if column not in keys and table[column].dtype.kind in "iuf"})
+    table = table.astype({key: str for key in keys})
+    table = table[(table.drop(columns=keys) != 0).any(axis=1)]
+    return table.sort_values(keys, ignore_index=True)[sorted(table.columns)]
+
+
+def pulled_state(state_dir, pulls):
+    for session in pulls:
+        # Each pull starts from the state saved by the previous one, as run_incremental does
+        state = IncrementalState.load(str(state_dir))
+        state.update(session)
+        state.save()
+    return IncrementalState.load(str(state_dir))
+
+
+@pytest.mark.parametrize("split", [0.3, 0.55])
+def test_two_pulls_match_one_full_pull(tmp_path, split):
+    full = pulled_state(tmp_path / "full", [SnapshotSession(TABLES, START, END)])
+    mid = int(START + (END - START) * split)
+    # The second pull renumbers the threads and its ring buffer has lost the start of the trace;
+    # rows still running at the first pull are only counted by the second
+    split_state = pulled_state(tmp_path / "split", [SnapshotSession(TABLES, START, mid),
+                                                    SnapshotSession(TABLES, int(START + (mid - START) * 0.8), END, utid_offset=1000)])
+    assert split_state.meta["marks"]["sched_slice"] == full.meta["marks"]["sched_slice"]
+    assert split_state.meta["sched_bounds"] == full.meta["sched_bounds"]
+    assert len(split_state.long_tasks) == len(full.long_tasks)
+
+    for name, (keys, _) in AGGREGATE_KEYS.items():
+        if name not in SPLIT_DEPENDENT:
+            pd.testing.assert_frame_equal(normalized(split_state.aggregates[name], keys), normalized(full.aggregates[name], keys), obj=name)
+    for name in BUSY_TABLES:
+        pd.testing.assert_frame_equal(normalized(split_state.aggregates[name], ["key", "window"]),
+                                      normalized(full.aggregates[name], ["key", "window"]), obj=name)
+
+
+def test_full_pull_matches_the_extracted_tables(tmp_path):
+    state = pulled_state(tmp_path, [SnapshotSession(TABLES, START, END)])
+    threads = TABLES["threads"].set_index("utid")
+
+    # Migrations by brute force over each thread's slices in ts order
+    expected = {}
+    for utid, slices in TABLES["cpu_sched"][TABLES["cpu_sched"]["utid"] != 0].sort_values("ts").groupby("utid"):
+        cpus = slices["cpu"].tolist()
+        expected[(int(threads.loc[utid, "pid"]), int(threads.loc[utid, "tid"]))] = (len(cpus), sum(a != b for a, b in zip(cpus, cpus[1:])))
+    migrations = state.aggregates["thread_migrations"]
+    assert {(int(row.pid), int(row.tid)): (int(row.slice_count), int(row.migrations)) for row in migrations.itertuples()} == expected
+
+    # State totals: sched slices as Running plus every other thread state
+    states = TABLES["thread_states"]
+    running = TABLES["cpu_sched"][TABLES["cpu_sched"]["utid"] != 0].assign(state="Running")
+    rows = pd.concat([running[["utid", "state", "dur"]], states[states["state"] != "Running"][["utid", "state", "dur"]]])
+    expected = rows.assign(tid=rows["utid"].map(threads["tid"])).groupby(["tid", "state"])["dur"].sum()
+    totals = state.aggregates["thread_state_totals"].groupby(["tid", "state"])["state_ns"].sum()
+    assert totals[totals > 0].to_dict() == expected[expected > 0].to_dict()
@@ -0,0 +1,64 @@
+from live_monitor import RollingChecks, RUNNABLE_STATE
+from sqlite_trace import SnapshotSession
+from synthetic_trace import synthetic_tables, YOUTUBE_PROCESS_NAME
+import numpy as np
+import pandas as pd
+
+TABLES = synthetic_tables(4000)
+START = int(TABLES["cpu_sched"]["ts"].min())
+END = int((TABLES["cpu_sched"]["ts"] + TABLES["cpu_sched"]["dur"]).max()) + 1
+# Long enough that no bucket is pruned, so every bucket can be checked
+NO_PRUNING_WINDOW_NS = 100 * (END - START)
+
+
+def naive_busy(rows, origin_ts, until_ts, keys):
+    """Time each key was busy in [origin_ts, until_ts), one interval at a time."""
+    busy = {}
+    for key, ts, dur in zip(keys, rows["ts"], rows["dur"]):
+        overlap = min(ts + dur, until_ts) - max(ts, origin_ts)
+        if overlap > 0:
+            busy[key] = busy.get(key, 0) + overlap
+    return busy
+
+
+def youtube_runnable():
+    states = TABLES["thread_states"]
+    runnable = states[(states["state"] == RUNNABLE_STATE) & (states["process_name"] == YOUTUBE_PROCESS_NAME)]
+    tids = runnable["utid"].map(TABLES["threads"].set_index("utid")["tid"])
+    return runnable, tids
+
+
+def settled_busy(busy, settled_bucket):
+    busy = busy[busy["window"] < settled_bucket]
+    return {key: int(ns) for key, ns in busy.groupby("key")["busy_ns"].sum().items() if ns}
+
+
+def test_windows_settle_on_the_lagging_table(monkeypatch):
+    checks = RollingChecks(NO_PRUNING_WINDOW_NS)
+    judged = []
+    original = checks._runnable_alerts
+    monkeypatch.setattr(checks, "_runnable_alerts", lambda settled_bucket: judged.append(settled_bucket) or original(settled_bucket))
+    runnable, tids = youtube_runnable()
+    for hi in np.linspace(START, END, 6).astype(int)[1:]:
+        # thread_state lags behind sched_slice by a sixth of the trace
+        lagging = int(hi - (END - START) // 6)
+        checks.update(SnapshotSession(TABLES, START, {"sched_slice": int(hi), "thread_state": lagging, "slice": int(hi)}))
+        settled_ts = checks.origin_ts + judged[-1] * checks.bucket_ns
+        assert settled_ts <= checks.marks["thread_state"]["open_ts"]
+        # Every runnable interval overlapping a settled bucket has been counted in full
+        assert settled_busy(checks.thread_runnable, judged[-1]) == naive_busy(runnable, checks.origin_ts, settled_ts, tids)
+
+
+def test_runnable_time_before_the_first_sched_rows_is_kept():
+    checks = RollingChecks(NO_PRUNING_WINDOW_NS)
+    # The first snapshot has thread states but no sched slices yet
+    checks.update(SnapshotSession(TABLES, START, {"sched_slice": START, "thread_state": END, "slice": START}))
+    checks.update(SnapshotSession(TABLES, START, END))
+    runnable, tids = youtube_runnable()
+    assert checks.origin_ts <= int(runnable["ts"].min())
+    totals = checks.thread_runnable.groupby("key")["busy_ns"].sum()
+    assert totals[totals > 0].to_dict() == naive_busy(runnable, checks.origin_ts, END, tids)
+
+    sched = TABLES["cpu_sched"][TABLES["cpu_sched"]["utid"] != 0]
+    totals = checks.process_busy.groupby("key")["busy_ns"].sum()
+    assert totals.to_dict() == naive_busy(sched, checks.origin_ts, END, sched["process_name"])
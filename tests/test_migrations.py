@@ -0,0 +1,70 @@
+from cpu_topology import CpuTopology
+from identify_performance_anomalies import migrations_aggregate
+import numpy as np
+import pandas as pd
+import sqlite3
+
+TOPOLOGY = CpuTopology({0: "LITTLE", 1: "LITTLE", 2: "BIG", 3: "BIG"}, "test")
+COLUMNS = ["utid", "slice_count", "migrations", "cluster_migrations"]
+
+
+def random_sched(rng, row_count=600):
+    utid = rng.integers(0, 12, size=row_count)
+    return pd.DataFrame({
+        "ts": rng.permutation(row_count) * 10,
+        "dur": 5,
+        "cpu": rng.integers(0, 5, size=row_count),  # cpu 4 is not in the topology
+        "utid": utid,
+        "process_name": [f"p{u % 3}" for u in utid],
+        "thread_name": [f"t{u}" for u in utid],
+    })
+
+
+def naive_migrations(cpu_sched):
+    rows = []
+    for utid, slices in cpu_sched[cpu_sched["utid"] != 0].sort_values("ts").groupby("utid"):
+        cpus = slices["cpu"].tolist()
+        clusters = [TOPOLOGY.cpu_clusters.get(cpu, "UNKNOWN") for cpu in cpus]
+        moves = [i for i in range(1, len(cpus)) if cpus[i] != cpus[i - 1]]
+        rows.append((utid, len(cpus), len(moves), sum(clusters[i] != clusters[i - 1] for i in moves)))
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def normalized(counts):
+    return counts[COLUMNS].astype("int64").sort_values("utid", ignore_index=True)
+
+
+def test_migrations_match_brute_force():
+    cpu_sched = random_sched(np.random.default_rng(8))
+    counts, last_cpu = migrations_aggregate(cpu_sched, TOPOLOGY)
+    pd.testing.assert_frame_equal(normalized(counts), naive_migrations(cpu_sched))
+    final = cpu_sched[cpu_sched["utid"] != 0].sort_values("ts").groupby("utid")["cpu"].last()
+    assert last_cpu.sort_index().to_dict() == final.to_dict()
+
+
+def test_migrations_carry_over_between_pulls_and_chunks():
+    cpu_sched = random_sched(np.random.default_rng(9)).sort_values("ts", ignore_index=True)
+    first, second = cpu_sched.iloc[:250], cpu_sched.iloc[250:]
+    counts_first, last_cpu = migrations_aggregate([first.iloc[:100], first.iloc[100:]], TOPOLOGY)
+    counts_second, _ = migrations_aggregate(second, TOPOLOGY, last_cpu)
+    combined = pd.concat([counts_first, counts_second]).groupby("utid", as_index=False)[COLUMNS[1:]].sum()
+    pd.testing.assert_frame_equal(normalized(combined), naive_migrations(cpu_sched))
+
+
+class SqliteSession:
+    def __init__(self, cpu_sched):
+        self.con = sqlite3.connect(":memory:")
+        cpu_sched[["utid", "cpu", "ts", "dur"]].to_sql("sched_slice", self.con)
+        threads = cpu_sched.drop_duplicates("utid")
+        pd.DataFrame({"utid": threads["utid"], "tid": threads["utid"], "name": threads["thread_name"],
+                      "upid": threads["utid"] % 3}).to_sql("thread", self.con)
+        pd.DataFrame({"upid": range(3), "pid": range(3), "name": [f"p{i}" for i in range(3)]}).to_sql("process", self.con)
+
+    def query_df(self, sql, label=None):
+        return pd.read_sql_query(sql, self.con)
+
+
+def test_migrations_sql_matches_brute_force():
+    cpu_sched = random_sched(np.random.default_rng(10))
+    counts, _ = migrations_aggregate(SqliteSession(cpu_sched), TOPOLOGY)
+    pd.testing.assert_frame_equal(normalized(counts), naive_migrations(cpu_sched))
@@ -0,0 +1,100 @@
+from query_builder import QueryTemplate, sql_list, sql_literal, values_table
+import numpy as np
+import pytest
+import sqlite3
+
+# Characters that need care in SQL text: quotes, comment and placeholder starts, non-ASCII
+ALPHABET = list("ab_1 ") + ["'", "''", '"', "\\", ":", "::", "--", ";", "\n", "é", "名"]
+
+
+def random_strings(rng, count):
+    return ["".join(rng.choice(ALPHABET, size=rng.integers(0, 8))) for _ in range(count)]
+
+
+def select(con, sql, params=()):
+    return con.execute(sql, params).fetchall()
+
+
+def test_sql_literal_round_trips_through_sqlite():
+    rng = np.random.default_rng(11)
+    con = sqlite3.connect(":memory:")
+    values = random_strings(rng, 300) + [None, 0, -1, 2 ** 63 - 1, -2 ** 63, 0.1, -2.5e-300, 1e300, np.int32(7), np.float64(0.25)]
+    for value in values:
+        assert select(con, f"SELECT {sql_literal(value)}") == [(value,)]
+    assert select(con, f"SELECT {sql_literal(True)}, {sql_literal(False)}") == [(1, 0)]
+
+
+@pytest.mark.parametrize("value, error", [
+    ("a\0b", ValueError),
+    (float("nan"), ValueError),
+    (float("inf"), ValueError),
+    (b"bytes", TypeError),
+    (object(), TypeError),
+])
+def test_sql_literal_rejects_unrepresentable_values(value, error):
+    with pytest.raises(error):
+        sql_literal(value)
+
+
+def test_template_matches_sqlite_parameter_binding():
+    # SQLite binds :name natively and leaves :name inside string literals alone, like QueryTemplate
+    rng = np.random.default_rng(12)
+    con = sqlite3.connect(":memory:")
+    for _ in range(200):
+        names = ["a", "b", "c_1"]
+        pieces = []
+        for _ in range(rng.integers(1, 6)):
+            kind = rng.integers(0, 3)
+            if kind == 0:
+                pieces.append(f":{rng.choice(names)}")
+            elif kind == 1:
+                pieces.append(sql_literal(f":{rng.choice(names)}" + random_strings(rng, 1)[0]))
+            else:
+                pieces.append(sql_literal(int(rng.integers(-5, 5))))
+        sql = "SELECT " + ", ".join(pieces)
+        params = dict(zip(names, random_strings(rng, 2) + [int(rng.integers(-100, 100))]))
+        template = QueryTemplate(sql)
+        used = {name: value for name, value in params.items() if name in template.params}
+        assert select(con, template.bind(**used)) == select(con, sql, used)
+
+
+def test_template_leaves_casts_and_literals_alone():
+    template = QueryTemplate("SELECT x::int, ':skip', 'it''s :skip', :a FROM t WHERE y = :a AND z IN (:names)")
+    assert template.params == {"a", "names"}
+    assert template.bind(a="it's", names=[1, "b"]) == (
+        "SELECT x::int, ':skip', 'it''s :skip', 'it''s' FROM t WHERE y = 'it''s' AND z IN (1, 'b')")
+
+
+def test_template_rejects_missing_and_unknown_parameters():
+    template = QueryTemplate("SELECT :a, :b")
+    with pytest.raises(ValueError, match="missing \\['b'\\]"):
+        template.bind(a=1)
+    with pytest.raises(ValueError, match="unknown \\['c'\\]"):
+        template.bind(a=1, b=2, c=3)
+
+
+def test_list_binding_matches_python_membership():
+    rng = np.random.default_rng(13)
+    con = sqlite3.connect(":memory:")
+    rows = random_strings(rng, 50)
+    con.execute("CREATE TABLE t (name TEXT)")
+    con.executemany("INSERT INTO t VALUES (?)", [(row,) for row in rows])
+    template = QueryTemplate("SELECT name FROM t WHERE name IN (:names)")
+    for size in [0, 1, 5, 20]:
+        names = list(rng.choice(rows, size=size)) + random_strings(rng, 3) if size else []
+        expected = sorted(row for row in rows if row in names)
+        assert sorted(name for (name,) in select(con, template.bind(names=names))) == expected
+        assert sql_list(names) == ("NULL" if not names else ", ".join(sql_literal(n) for n in names))
+
+
+def test_values_table_round_trips_through_sqlite():
+    rng = np.random.default_rng(14)
+    con = sqlite3.connect(":memory:")
+    rows = [(i, name, None if i % 3 == 0 else int(rng.integers(0, 10 ** 9))) for i, name in enumerate(random_strings(rng, 40))]
+    cte = values_table("filters", ["filter_id", "name", "min_dur"], rows)
+    assert select(con, f"WITH {cte} SELECT * FROM filters ORDER BY filter_id") == rows
+
+
+def test_values_table_needs_rows():
+    with pytest.raises(ValueError):
+        values_table("filters", ["name"], [])
@@ -0,0 +1,125 @@
+from query_cache import QueryCache, normalize_query
+from trace_session import TraceSession
+import numpy as np
+import os
+import pandas as pd
+import query_cache
+import sqlite3
+
+QUERY = "SELECT name, COUNT(*) AS n FROM slice WHERE name != 'a  b' GROUP BY name ORDER BY name"
+
+
+class CountingTraceProcessor:
+    """Answers queries from an SQLite table and counts them, standing in for a loaded trace."""
+
+    def __init__(self, names):
+        self.con = sqlite3.connect(":memory:")
+        pd.DataFrame({"name": names}).to_sql("slice", self.con)
+        self.queries = 0
+
+    def query(self, sql):
+        self.queries += 1
+        df = pd.read_sql_query(sql, self.con)
+
+        class Result:
+            def as_pandas_dataframe(self):
+                return df
+        return Result()
+
+    def close(self):
+        self.con.close()
+
+
+def session(trace_file, cache, tp):
+    # A loaded trace processor is never replaced, so the session uses this one instead of loading the trace
+    session = TraceSession(str(trace_file), cache)
+    session._tp = tp
+    return session
+
+
+def write_trace(path, content):
+    path.write_bytes(content)
+    return path
+
+
+def reformat(rng, sql):
+    """Changes the whitespace of `sql` outside string literals and maybe adds a trailing ';'."""
+    parts = sql.split("'")
+    for i in range(0, len(parts), 2):
+        parts[i] = "".join(rng.choice([" ", "\n", "\t  ", "   "]) if c == " " else c for c in parts[i])
+    return rng.choice(["", "\n  "]) + "'".join(parts) + rng.choice(["", ";", " ;\n", "\n"])
+
+
+def test_reformatted_queries_share_a_key(tmp_path):
+    rng = np.random.default_rng(21)
+    cache = QueryCache(str(tmp_path / "cache"))
+    key = cache.key("digest", QUERY)
+    for _ in range(50):
+        assert normalize_query(reformat(rng, QUERY)) == normalize_query(QUERY)
+        assert cache.key("digest", reformat(rng, QUERY)) == key
+    # Whitespace inside a string literal is part of the value
+    assert cache.key("digest", QUERY.replace("'a  b'", "'a b'")) != key
+    assert cache.key("other digest", QUERY) != key
+
+
+def test_cached_results_skip_the_trace_processor(tmp_path):
+    cache = QueryCache(str(tmp_path / "cache"))
+    names = ["x", "y", "x", "a  b"]
+    first = CountingTraceProcessor(names)
+    expected = session(write_trace(tmp_path / "a.trace", b"trace 1"), cache, first).query_df(QUERY)
+    assert first.queries == 1
+
+    # Same content under another name and another formatting of the query: a hit
+    copy = CountingTraceProcessor(names)
+    pd.testing.assert_frame_equal(session(write_trace(tmp_path / "b.trace", b"trace 1"), cache, copy).query_df(reformat(np.random.default_rng(0), QUERY)), expected)
+    assert copy.queries == 0
+
+    # Changed content: a miss
+    changed = CountingTraceProcessor(names)
+    session(write_trace(tmp_path / "a.trace", b"trace 2, longer"), cache, changed).query_df(QUERY)
+    assert changed.queries == 1
+
+
+def test_new_tool_version_invalidates_entries(tmp_path, monkeypatch):
+    trace = write_trace(tmp_path / "a.trace", b"trace")
+    old_cache = QueryCache(str(tmp_path / "cache"))
+    session(trace, old_cache, CountingTraceProcessor(["x"])).query_df(QUERY)
+
+    monkeypatch.setattr(query_cache, "CACHE_FORMAT_VERSION", query_cache.CACHE_FORMAT_VERSION + 1)
+    new_cache = QueryCache(str(tmp_path / "cache"))
+    assert new_cache.version != old_cache.version
+    tp = CountingTraceProcessor(["x"])
+    session(trace, new_cache, tp).query_df(QUERY)
+    assert tp.queries == 1
+    assert len(new_cache.entries()) == 2
+    assert new_cache.purge(stale_versions=True) == 1
+    assert new_cache.entries()["tool_version"].tolist() == [new_cache.version]
+
+
+def test_eviction_removes_least_recently_used_entries(tmp_path, monkeypatch):
+    rng = np.random.default_rng(22)
+    clock = [1000.0]
+    monkeypatch.setattr(query_cache.time, "time", lambda: clock[0])
+    cache = QueryCache(str(tmp_path / "cache"), max_bytes=10 ** 12)
+    sizes, last_access = {}, {}
+    for i in range(30):
+        clock[0] += 1
+        key = cache.key("digest", f"SELECT {i}")
+        cache.put(key, pd.DataFrame({"v": np.arange(rng.integers(1, 2000))}), "digest", "trace", f"SELECT {i}")
+        sizes[key] = os.path.getsize(cache._entry_path(key))
+        last_access[key] = clock[0]
+    for key in rng.choice(list(sizes), size=15):
+        clock[0] += 1
+        assert cache.get(key) is not None
+        last_access[key] = clock[0]
+
+    max_bytes = sum(sizes.values()) // 3
+    # Drop the least recently used entries one at a time until the rest fits
+    kept = sorted(sizes, key=last_access.get)
+    while sum(sizes[key] for key in kept) > max_bytes:
+        kept.pop(0)
+    assert cache.evict(max_bytes) == len(sizes) - len(kept)
+    assert set(cache.entries()["key"]) == set(kept)
+    for key in sizes:
+        assert os.path.exists(cache._entry_path(key)) == (key in kept)
+        assert (cache.get(key) is not None) == (key in kept)
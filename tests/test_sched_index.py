@@ -0,0 +1,46 @@
+from sched_index import SchedIndex
+import numpy as np
+import pandas as pd
+
+
+def random_slices(rng, cpu_count=4, per_cpu=200):
+    rows = []
+    for cpu in range(cpu_count):
+        gaps = rng.integers(0, 50, size=per_cpu)
+        durs = rng.integers(0, 100, size=per_cpu)
+        starts = np.cumsum(gaps + np.append(0, durs[:-1]))
+        rows.append(pd.DataFrame({"cpu": cpu, "ts": starts, "dur": durs}))
+    slices = pd.concat(rows, ignore_index=True)
+    # A few overlapping slices and an unfinished one (dur -1)
+    extra = pd.DataFrame({"cpu": [0, 1, 2], "ts": [500, 1200, 3000], "dur": [400, 2000, -1]})
+    slices = pd.concat([slices, extra], ignore_index=True).sample(frac=1, random_state=0, ignore_index=True)
+    slices["id"] = np.arange(len(slices))
+    return slices
+
+
+def naive_overlapping(slices, starts, ends):
+    found = set()
+    for query, (start, end) in enumerate(zip(starts, ends)):
+        for row in slices.itertuples():
+            overlap = min(row.ts + max(row.dur, 0), end) - max(row.ts, start)
+            if overlap > 0:
+                found.add((query, row.id, overlap))
+    return found
+
+
+def test_overlapping_matches_brute_force():
+    rng = np.random.default_rng(5)
+    slices = random_slices(rng)
+    starts = rng.integers(-100, 30000, size=60)
+    ends = starts + rng.integers(0, 2000, size=60)
+    index = SchedIndex(slices)
+    query, row, overlap = index.overlapping(starts, ends)
+    ids = index.slices["id"].to_numpy()[row]
+    assert set(zip(query.tolist(), ids.tolist(), overlap.tolist())) == naive_overlapping(slices, starts, ends)
+    assert len(query) == len(set(zip(query.tolist(), ids.tolist())))
+
+
+def test_running_at():
+    slices = pd.DataFrame({"cpu": [0, 0, 1], "ts": [0, 10, 5], "dur": [10, 10, 1]})
+    running = SchedIndex(slices).running_at(10)
+    assert running[["cpu", "ts"]].values.tolist() == [[0, 10]]
@@ -0,0 +1,54 @@
+from window_utilization import busy_time_per_window, sliding_busy_time, split_into_windows
+import numpy as np
+import pandas as pd
+
+
+def naive_split(ts, dur, window_ns, origin_ts):
+    entries = set()
+    for row, (start, length) in enumerate(zip(ts, dur)):
+        if length <= 0:
+            continue
+        end = start + length
+        for window in range((start - origin_ts) // window_ns, (end - 1 - origin_ts) // window_ns + 1):
+            window_start = origin_ts + window * window_ns
+            entries.add((row, window, min(end, window_start + window_ns) - max(start, window_start)))
+    return entries
+
+
+def test_split_into_windows_matches_brute_force():
+    rng = np.random.default_rng(6)
+    origin_ts = 1_000
+    ts = origin_ts + rng.integers(0, 10_000, size=300)
+    dur = rng.integers(-1, 2_500, size=300)
+    dur[:5] = [0, 100, 99, 1, 1_000]
+    ts[:5] = origin_ts + np.array([0, 0, 1, 99, 50])
+    row, window, overlap = split_into_windows(ts, dur, 100, origin_ts)
+    entries = list(zip(row.tolist(), window.tolist(), overlap.tolist()))
+    assert len(entries) == len(set(entries))
+    assert set(entries) == naive_split(ts, dur, 100, origin_ts)
+
+
+def test_sliding_busy_time_matches_brute_force():
+    rng = np.random.default_rng(7)
+    ts = rng.integers(0, 5_000, size=400)
+    dur = rng.integers(1, 700, size=400)
+    keys = rng.choice(["a", "b", "c"], size=400)
+    busy = busy_time_per_window(ts, dur, keys, 100)
+    sliding = sliding_busy_time(busy, 4)
+
+    per_bucket = {(k, w): b for k, w, b in zip(busy["key"], busy["window"], busy["busy_ns"])}
+    expected = {}
+    for key in "abc":
+        for window in range(0, int(busy["window"].max()) + 1):
+            total = sum(per_bucket.get((key, window + i), 0) for i in range(4))
+            if total:
+                expected[(key, window)] = total
+    assert dict(zip(zip(sliding["key"], sliding["window"]), sliding["busy_ns"])) == expected
+
+
+def test_busy_time_per_window_totals():
+    ts = np.array([0, 150, 390])
+    dur = np.array([250, 100, 20])
+    busy = busy_time_per_window(ts, dur, pd.Series(["x", "y", "x"]), 100)
+    assert busy.groupby("key", observed=True)["busy_ns"].sum().to_dict() == {"x": 270, "y": 100}
+    assert sliding_busy_time(busy, 1) is busy